@@ -1,19 +1,26 @@
 import argparse
+import collections
+from concurrent import futures
+import contextlib
+import itertools
 import json
 import logging
 import os
 import pathlib
+import random
+import re
 import sys
+import threading
 import time
 import typing
 from urllib import parse
 
 import coloredlogs
-import requests
 from requests import adapters, exceptions
 import urllib3
 
-from . import version
+from . import (client, fleet, health, journal, metrics, placement, planner,
+               poller, selection, snapshot, version)
 
 LOGGER = logging.getLogger(__name__)
 LOGGING_FORMAT = '[%(asctime)-15s] %(levelname)-8s %(message)s'
@@ -27,15 +34,71 @@ LOGGING_LEVEL_STYLES = {'debug': {'color': 'green'},
                         'warning': {'color': 'yellow'},
                         'error': {'color': 'red'},
                         'critical': {'color': 'red', 'bold': True}}
+COMMANDS = ['run', 'snapshot', 'plan', 'apply', 'fleet']
 DEFAULT_PRIORITY = 90
-SLEEP_DURATION = 5
+DEFAULT_SYNC_RATE = 50 * 1024 ** 2  # Bytes per second, until observed
+METRICS_INTERVAL = 30.0
+HEALTH_CHECK_INTERVAL = 5.0
+MAX_LEADER_ELECTIONS = 5
+MAX_PAGE_SIZE = 500
+MAX_PATTERN_LENGTH = 2000  # Characters of queue names per state request
+MAX_SKEW = 0.1
+MAX_POLL_INTERVAL = 30.0
+MIN_POLL_INTERVAL = 0.1
+MIN_SYNC_TIMEOUT = 300.0
+MOVE_SECONDS = 5.0  # Estimated duration of a move without HA sync
+MOVE_TIMEOUT = 300.0
+POLL_COLUMNS = ['name', 'node', 'type', 'slave_nodes',
+                'synchronised_slave_nodes', 'effective_policy_definition',
+                'leader', 'members', 'online', 'message_bytes']
+QUEUE_COLUMNS = ['name', 'vhost', 'type', 'node', 'policy', 'slave_nodes',
+                 'synchronised_slave_nodes', 'effective_policy_definition',
+                 'leader', 'members', 'online', 'exclusive', 'auto_delete',
+                 'durable', 'consumers', 'message_bytes', 'memory',
+                 'message_stats']
+REFRESH_COLUMNS = ['name', 'vhost', 'node', 'type']
+STATUS_INTERVAL = 1.0
+SYNC_RATE_WEIGHT = 0.3
+SYNC_TIMEOUT_FACTOR = 10  # Times the estimated sync duration, by default
+WATCH_INTERVAL = 60.0
+WEIGHT_COLUMNS = {
+    'count': [],
+    'message_bytes': ['message_bytes'],
+    'memory': ['memory'],
+    'publish_rate': ['message_stats'],
+    'deliver_rate': ['message_stats']
+}
 
-NUM_RETRIES = 3
 
-ADAPTER = adapters.HTTPAdapter(
-    max_retries=urllib3.Retry(
-        status=NUM_RETRIES,
-        status_forcelist=[429, 503]))
+class PhaseTimeout(Exception):
+    """Raised when a phase of a queue move does not finish in time"""
+    def __init__(self, name: str, phase: str):
+        super().__init__(name, phase)
+        self.name = name
+        self.phase = phase
+
+
+class QueueDeleted(Exception):
+    """Raised when a queue is deleted while it is being moved"""
+
+
+class PollScheduler:
+    """Returns the time to sleep between polls of a queue's state, starting
+    with the estimated duration of the operation being waited on and backing
+    off exponentially, with jitter, until the maximum interval is reached.
+
+    """
+    BACKOFF_FACTOR = 2.0
+
+    def __init__(self, minimum: float, maximum: float,
+                 estimate: float = 0.0):
+        self.maximum = maximum
+        self.interval = min(max(minimum, estimate), maximum)
+
+    def next_interval(self) -> float:
+        interval = random.uniform(self.interval / 2, self.interval)
+        self.interval = min(self.interval * self.BACKOFF_FACTOR, self.maximum)
+        return interval
 
 
 class Rebalance:
@@ -44,49 +107,87 @@ class Rebalance:
 
     def __init__(self, args: argparse.Namespace):
         self.args = args
-        self.session = requests.Session()
+        self.session = client.Session(
+            args.urls, max(args.concurrency, adapters.DEFAULT_POOLSIZE))
         self.session.auth = (args.username, args.password)
         self.session.headers = {
             'User-Agent': 'rmq-cluster-rebalance/{}'.format(version)}
-        self.session.mount('http://', ADAPTER)
-        self.session.mount('https://', ADAPTER)
         self.session.verify = False
-        self.vhost = parse.quote(self.args.vhost, safe='')
+        self.metrics = metrics.Metrics(
+            metrics.MAX_RECORDS if args.watch else None)
+        self.metrics_written_at = time.monotonic()
+        self.session.hooks['response'].append(self.metrics.response_hook)
+        if args.discover:
+            self._discover_endpoints()
+        self.vhosts = (self._lookup_vhosts() if self.args.all_vhosts
+                       else self.args.vhost)
         self.nodes = self._lookup_nodes()
-        self.node_offset = 0
-        max_priority = self._lookup_max_priority()
+        self.selection = selection.Selection(
+            args.include, args.exclude, args.skip_exclusive,
+            args.skip_auto_delete, args.skip_transient,
+            args.min_message_bytes, args.min_consumers)
+        self.index = placement.Index(args.weight)
+        self.sync_rate = None  # Observed HA sync rate in bytes per second
+        self.batch_ids = itertools.count(1)
+        self.journal = journal.Journal(args.journal, args.resume)
+        self.health_checked_at = None
+        self.sync_bytes = 0  # Bytes of the queues being synchronized
+        self.sync_condition = threading.Condition()
+        self.poller = poller.Poller(
+            self._queue_states, args.status_interval)
         self.priority = DEFAULT_PRIORITY
+        if args.command == 'snapshot':
+            return  # Does not change the cluster, so leftovers are kept
+        max_priority = self._lookup_max_priority()
         if max_priority > DEFAULT_PRIORITY:
             self.priority = max_priority + 1
 
     def run(self) -> typing.NoReturn:
         LOGGER.info('rmq-cluster-rebalance starting')
-        for queue in self._queues():
-            assign_to = self._node_assignment()
-            if assign_to == queue['node']:
-                LOGGER.info('Queue %s is already on %s, skipping',
-                            queue['name'], queue['node'])
-                self._advance_node()
-                continue
-            LOGGER.info('Moving %s to %s', queue['name'], assign_to)
-            if assign_to not in queue.get('synchronised_slave_nodes', []):
-                self._apply_step1_policy(queue)
-            self._apply_step2_policy(queue, assign_to)
-            self._delete_policy()
-            self._advance_node()
-
-    def _advance_node(self) -> typing.NoReturn:
-        self.node_offset += 1
-        if self.node_offset == len(self.nodes):
-            self.node_offset = 0
-
-    def _apply_policy(self, queue_name: str, definition: dict) \
+        deadline = None
+        if self.args.max_duration is not None:
+            deadline = time.monotonic() + self.args.max_duration
+        try:
+            if self.args.watch:
+                self._watch(deadline)
+            else:
+                self._execute(self._moves(), deadline)
+        finally:
+            self.journal.close()
+            self._write_metrics()
+        LOGGER.info('rmq-cluster-rebalance finished: %s',
+                    self.metrics.progress())
+
+    def snapshot(self, path: str) -> typing.NoReturn:
+        """Write the nodes, policies and queues of the cluster to a
+        snapshot file.
+
+        """
+        LOGGER.info('Writing a snapshot of %s to %s',
+                    ', '.join(self.vhosts), path)
+        policies = [p for p in self._get_policies()
+                    if p['vhost'] in self.vhosts]
+        count = snapshot.write(
+            path, self.nodes, self.vhosts, policies, self._queues())
+        LOGGER.info('Wrote %i queues to %s', count, path)
+
+    def _apply_batch_policy(self, policy: str,
+                            queue_names: typing.List[str],
+                            definition: dict,
+                            vhost: typing.Optional[str] = None) \
             -> typing.NoReturn:
+        """Apply the policy to all of the queues in the list"""
+        if len(queue_names) == 1:
+            pattern = '^{}$'.format(re.escape(queue_names[0]))
+        else:
+            pattern = '^({})$'.format(
+                '|'.join(re.escape(name) for name in queue_names))
         try:
             result = self.session.put(
-                self._build_url('/api/policies/{vhost}/{policy}'),
+                self._build_url(
+                    '/api/policies/{vhost}/{policy}', policy, vhost),
                 data=json.dumps({
-                    'pattern': '^{}$'.format(queue_name),
+                    'pattern': pattern,
                     'definition': definition,
                     'priority': self.priority,
                     'apply-to': 'queues'}))
@@ -97,36 +198,158 @@ class Rebalance:
                 exit_application('Error applying policy: {}'.format(
                     result.json()['reason']), 2)
 
-    def _apply_step1_policy(self, queue: dict) -> typing.NoReturn:
-        """Apply the policy to ensure HA is setup"""
-        policy = self._remove_blacklisted_keys(
-            queue['effective_policy_definition'] or {})
-        policy['ha-mode'] = 'all'
-        self._apply_policy(queue['name'], policy)
-        self._wait_for_synchronized_slaves(queue['name'])
-
-    def _apply_step2_policy(self,
-                            queue: dict,
-                            destination: str) -> typing.NoReturn:
-        """Apply the policy to move the master"""
-        policy = queue['effective_policy_definition'] or {}
-        self._remove_blacklisted_keys(policy)
-        policy['ha-mode'] = 'nodes'
-        policy['ha-params'] = [destination]
-        self._apply_policy(queue['name'], policy)
-        self._wait_for_queue_move(queue['name'], destination)
+    def _apply_policy(self, queue_name: str, definition: dict,
+                      vhost: typing.Optional[str] = None) -> typing.NoReturn:
+        self._apply_batch_policy(
+            self._policy_name(queue_name), [queue_name], definition, vhost)
+
+    def _apply_step1_policy(self, queue: dict,
+                            destination: typing.Optional[str] = None) -> int:
+        """Apply the policy to ensure HA is setup, mirroring the queue only
+        to the destination node when running in targeted mode. Returns the
+        number of times the queue was polled.
+
+        """
+        message_bytes = queue.get('message_bytes') or 0
+        with self._sync_budget(message_bytes):
+            started = time.monotonic()
+            self._apply_policy(
+                queue['name'], self._step1_definition(queue, destination),
+                queue.get('vhost'))
+            polls = self._wait_for_synchronized_slaves(
+                queue['name'], message_bytes,
+                destination if self.args.targeted else None,
+                queue.get('vhost'),
+                self._phase_deadline('sync', message_bytes))
+        self._record_sync_rate(message_bytes, time.monotonic() - started)
+        return polls
+
+    def _apply_step2_policy(self, queue: dict, destination: str) -> int:
+        """Apply the policy to move the master, returning the number of
+        times the queue was polled.
+
+        """
+        self._apply_policy(
+            queue['name'], self._step2_definition(queue, destination),
+            queue.get('vhost'))
+        return self._wait_for_queue_move(
+            queue['name'], destination, queue.get('vhost'),
+            self._phase_deadline('move'))
+
+    def _batch_key(self, move: planner.Move) -> tuple:
+        """Return the key for grouping moves that can share a policy: the
+        vhost, destination, whether HA sync is needed, the current master in
+        targeted mode, and the queue's temporary policy definition.
+
+        """
+        queue = move.queue
+        return (queue.get('vhost'),
+                move.destination,
+                self._needs_sync(queue, move.destination),
+                queue['node'] if self.args.targeted else None,
+                json.dumps(self._temporary_definition(queue),
+                           sort_keys=True))
+
+    def _batches(self, moves: typing.Iterable[planner.Move]) \
+            -> typing.Iterator[typing.List[planner.Move]]:
+        """Group the moves into batches of up to ``--batch-size`` moves
+        that can be performed with a single policy.
 
-    def _build_url(self, path: str) -> str:
-        kwargs = {'vhost': self.vhost}
+        """
+        if self.args.batch_size == 1:
+            for move in moves:
+                yield [move]
+            return
+        batches = {}
+        for move in moves:
+            if self._is_quorum(move.queue):
+                yield [move]
+                continue
+            key = self._batch_key(move)
+            batches.setdefault(key, []).append(move)
+            if len(batches[key]) == self.args.batch_size:
+                yield batches.pop(key)
+        yield from batches.values()
+
+    def _build_url(self, path: str, policy: typing.Optional[str] = None,
+                   vhost: typing.Optional[str] = None) -> str:
+        kwargs = {}
+        if '{vhost}' in path:
+            kwargs['vhost'] = parse.quote(
+                self.vhosts[0] if vhost is None else vhost, safe='')
         if '{policy}' in path:
-            kwargs['policy'] = self.POLICY_NAME
+            kwargs['policy'] = parse.quote(policy, safe='')
         return '{}/{}'.format(
-            self.args.url.rstrip('/'), path.format(**kwargs).lstrip('/'))
+            self.session.urls[0], path.format(**kwargs).lstrip('/'))
+
+    def _cheapest_first(self, moves: typing.Iterable[planner.Move]) \
+            -> typing.List[planner.Move]:
+        """Order the moves by their estimated duration, so the most moves
+        are made within the time budget.
+
+        """
+        return sorted(moves, key=lambda move: self._estimated_seconds([move]))
 
-    def _delete_policy(self) -> typing.NoReturn:
+    def _client_nodes(self) -> typing.Dict[planner.Key, str]:
+        """Return the node most of the consumers of each queue are connected
+        to, keyed by vhost and name. The node of a consumer's channel is
+        looked up from its connection when the channel details do not
+        include it.
+
+        """
+        counts = collections.defaultdict(collections.Counter)
+        connection_nodes = None
+        for vhost in self.vhosts:
+            for consumer in self._get_consumers(vhost):
+                channel = consumer.get('channel_details') or {}
+                node = channel.get('node')
+                if node is None:
+                    if connection_nodes is None:
+                        connection_nodes = {
+                            c['name']: c.get('node')
+                            for c in self._get_connections()}
+                    node = connection_nodes.get(channel.get('connection_name'))
+                if node is None:
+                    continue
+                queue = consumer['queue']
+                counts[queue.get('vhost', vhost), queue['name']][node] += 1
+        LOGGER.info('Found the consumer nodes of %i queues', len(counts))
+        return {key: counter.most_common(1)[0][0]
+                for key, counter in counts.items()}
+
+    def _current_moves(self, moves: typing.List[planner.Move]) \
+            -> typing.List[planner.Move]:
+        """Return the moves with the current state of their queues,
+        skipping the queues that were deleted or already reached their
+        destination since they were listed.
+
+        """
+        keys = [(move.queue.get('vhost') or self.vhosts[0],
+                 move.queue['name']) for move in moves]
+        states = self.poller.get_many(keys)
+        current = []
+        for move, key in zip(moves, keys):
+            state = states[key]
+            if state is None:
+                LOGGER.info('Queue %s no longer exists, skipping',
+                            move.queue['name'])
+            elif state['node'] == move.destination:
+                LOGGER.info('Queue %s is already on %s, skipping',
+                            move.queue['name'], move.destination)
+                self.journal.record_done(move.queue)
+            else:
+                current.append(planner.Move(
+                    dict(move.queue, **state), move.destination))
+                continue
+            self.metrics.move_skipped()
+        return current
+
+    def _delete_policy(self, policy: str,
+                       vhost: typing.Optional[str] = None) -> typing.NoReturn:
         try:
             result = self.session.delete(
-                self._build_url('/api/policies/{vhost}/{policy}'))
+                self._build_url(
+                    '/api/policies/{vhost}/{policy}', policy, vhost))
         except exceptions.ConnectionError as error:
             exit_application('Error deleting policy: {}'.format(error), 1)
         else:
@@ -134,14 +357,121 @@ class Rebalance:
                 exit_application('Error deleting policy: {}'.format(
                     result.json()['reason']), 3)
 
-    def _get_queue_info(self, name: str) -> dict:
+    def _discover_endpoints(self) -> typing.NoReturn:
+        """Add the management API endpoints of the nodes in the cluster
+        to the session.
+
+        """
+        urls = client.listener_urls(self._get_overview(), self.session.urls[0])
+        LOGGER.info('Discovered management API endpoints: %s',
+                    ', '.join(urls) or 'none')
+        self.session.add_urls(urls)
+
+    def _elect_quorum_leader(self, name: str, destination: str,
+                             replace: bool, message_bytes: int = 0,
+                             vhost: typing.Optional[str] = None,
+                             deadline: typing.Optional[float] = None) \
+            -> typing.Tuple[str, int]:
+        """Remove the replica of the leader until the destination member
+        is elected, adding each removed replica back unless ``replace`` is
+        set and it is the original leader's. A replica that is added back
+        has to catch up before the next one is removed, so the queue never
+        has more than one member behind the leader. Returns the leader and
+        the number of polls.
+
+        """
+        info = self._queue_state(name, vhost)
+        leader = original = info.get('leader') or info['node']
+        polls = 0
+        for _election in range(MAX_LEADER_ELECTIONS):
+            if leader == destination:
+                break
+            previous = leader
+            self._quorum_member('delete', name, previous, vhost)
+            leader, count = self._wait_for_quorum_leader(
+                name, previous, vhost, deadline)
+            polls += count
+            if replace and previous == original:
+                replace = False
+                continue
+            self._quorum_member('add', name, previous, vhost)
+            polls += self._wait_for_quorum_member(
+                name, previous, message_bytes, vhost, deadline, 'move')
+        return leader, polls
+
+    def _execute(self, moves: typing.Iterable[planner.Move],
+                 deadline: typing.Optional[float] = None) -> typing.NoReturn:
+        """Perform the moves with up to ``--concurrency`` batches in flight,
+        cheapest first when there is a deadline, skipping the batches that
+        would not finish before it.
+
+        """
+        pending, skipped = set(), 0
+        if deadline is not None:
+            moves = self._cheapest_first(moves)
+        with futures.ThreadPoolExecutor(self.args.concurrency) as executor:
+            for batch in self._batches(moves):
+                if len(pending) >= self.args.concurrency:
+                    pending = self._wait_for_moves(
+                        pending, futures.FIRST_COMPLETED)
+                self._wait_for_healthy_cluster(deadline)
+                if not self._fits_deadline(batch, deadline):
+                    skipped += len(batch)
+                    self.metrics.move_skipped(len(batch))
+                    continue
+                pending.add(executor.submit(self._move_batch, batch))
+            self._wait_for_moves(pending, futures.ALL_COMPLETED)
+        if skipped:
+            LOGGER.warning('Skipped %i queue moves that would not finish '
+                           'within --max-duration', skipped)
+
+    def _estimated_seconds(self, moves: typing.List[planner.Move]) -> float:
+        """Estimate the duration of a batch of moves from the size of the
+        queues that need to be synchronized to their destination and the
+        HA sync rate observed so far.
+
+        """
+        message_bytes = sum(move.queue.get('message_bytes') or 0
+                            for move in moves
+                            if self._needs_sync(move.queue, move.destination))
+        return MOVE_SECONDS + message_bytes / (
+            self.sync_rate or DEFAULT_SYNC_RATE)
+
+    def _fits_deadline(self, moves: typing.List[planner.Move],
+                       deadline: typing.Optional[float]) -> bool:
+        """Returns True if the batch of moves is estimated to finish
+        before the deadline.
+
+        """
+        if deadline is None:
+            return True
+        estimate = self._estimated_seconds(moves)
+        remaining = deadline - time.monotonic()
+        if estimate <= remaining:
+            return True
+        for move in moves:
+            LOGGER.info('Skipping the move of %s to %s, estimated to take '
+                        '%.0fs with %.0fs remaining', move.queue['name'],
+                        move.destination, estimate, max(remaining, 0))
+        return False
+
+    def _get_queue_info(self, name: str,
+                        vhost: typing.Optional[str] = None,
+                        missing_ok: bool = False) -> typing.Optional[dict]:
+        """Return the queue, or ``None`` if it does not exist and
+        ``missing_ok`` is set.
+
+        """
         try:
             response = self.session.get(
-                self._build_url('/api/queues/{vhost}/{name}'.format(
-                    vhost=self.vhost, name=name)))
+                self._build_url('/api/queues/{{vhost}}/{}'.format(
+                    parse.quote(name, safe='')), vhost=vhost),
+                params=self._queue_params())
         except exceptions.ConnectionError as error:
             exit_application('Error getting queue info: {}'.format(error), 1)
         else:
+            if response.status_code == 404 and missing_ok:
+                return None
             queue = response.json()
             if not response.ok:
                 exit_application('Error getting queue info: {}'.format(
@@ -149,20 +479,62 @@ class Rebalance:
             return queue
 
     def _lookup_max_priority(self) -> int:
+        policies = [p for p in self._get_policies()
+                    if p['vhost'] in self.vhosts]
+        for policy in [p for p in policies if self._is_own_policy(p)]:
+            LOGGER.info('Removing leftover policy %s in %s',
+                        policy['name'], policy['vhost'])
+            self._delete_policy(policy['name'], policy['vhost'])
+        policies = [p for p in policies if not self._is_own_policy(p)]
+        return max(p['priority'] for p in policies) if policies else 0
+
+    def _is_lazy(self, queue: dict) -> bool:
+        """Return True if the queue is made lazy while it is moved"""
+        return (self.args.lazy_above is not None and
+                (queue.get('message_bytes') or 0) > self.args.lazy_above)
+
+    @staticmethod
+    def _is_quorum(queue: dict) -> bool:
+        return queue.get('type') == 'quorum'
+
+    def _is_own_policy(self, policy: dict) -> bool:
+        """Returns True if the policy was created by a previous run, for
+        a single queue or a batch of them.
+
+        """
+        return (policy['name'] == self.POLICY_NAME or
+                policy['name'].startswith('{}-'.format(self.POLICY_NAME)))
+
+    def _get_connections(self) -> typing.List[dict]:
         try:
-            result = self.session.get(self._build_url('/api/policies/{vhost}'))
+            result = self.session.get(
+                self._build_url('/api/connections'),
+                params={'columns': 'name,node'})
         except exceptions.ConnectionError as error:
-            exit_application('Error looking up policies: {}'.format(error), 1)
+            exit_application('Error looking up connections: {}'.format(
+                error), 1)
         else:
-            policies = result.json()
+            connections = result.json()
             if not result.ok:
-                exit_application('Error looking up policies: {}'.format(
-                    policies['reason']), 5)
-            if any(p['name'] == self.POLICY_NAME for p in policies):
-                self._delete_policy()
-            return max(p['priority'] for p in policies) if policies else 0
+                exit_application('Error looking up connections: {}'.format(
+                    connections['reason']), 12)
+            return connections
 
-    def _lookup_nodes(self) -> typing.List[str]:
+    def _get_consumers(self, vhost: str) -> typing.List[dict]:
+        try:
+            result = self.session.get(
+                self._build_url('/api/consumers/{vhost}', vhost=vhost))
+        except exceptions.ConnectionError as error:
+            exit_application('Error looking up consumers: {}'.format(
+                error), 1)
+        else:
+            consumers = result.json()
+            if not result.ok:
+                exit_application('Error looking up consumers: {}'.format(
+                    consumers['reason']), 12)
+            return consumers
+
+    def _get_nodes(self) -> typing.List[dict]:
         try:
             result = self.session.get(self._build_url('/api/nodes'))
         except exceptions.ConnectionError as error:
@@ -172,10 +544,440 @@ class Rebalance:
             if not result.ok:
                 exit_application('Error looking up nodes: {}'.format(
                    nodes['reason']), 6)
-            return [node['name'] for node in nodes]
+            return nodes
+
+    def _get_overview(self) -> dict:
+        try:
+            result = self.session.get(self._build_url('/api/overview'))
+        except exceptions.ConnectionError as error:
+            exit_application('Error getting overview: {}'.format(error), 1)
+        else:
+            overview = result.json()
+            if not result.ok:
+                exit_application('Error getting overview: {}'.format(
+                   overview['reason']), 9)
+            return overview
+
+    def _get_policies(self) -> typing.List[dict]:
+        try:
+            result = self.session.get(self._build_url('/api/policies'))
+        except exceptions.ConnectionError as error:
+            exit_application('Error looking up policies: {}'.format(error), 1)
+        else:
+            policies = result.json()
+            if not result.ok:
+                exit_application('Error looking up policies: {}'.format(
+                    policies['reason']), 5)
+            return policies
+
+    def _health_problems(self) -> typing.List[str]:
+        """Return the reasons the cluster is too busy for more queue moves"""
+        problems = health.node_problems(
+            self._get_nodes(), self.args.max_memory_used,
+            self.args.max_fd_used)
+        if self.args.max_publish_rate is not None:
+            problems += health.overview_problems(
+                self._get_overview(), self.args.max_publish_rate)
+        return problems
+
+    def _lookup_nodes(self) -> typing.List[str]:
+        """Return the names of the running nodes, which queues may be
+        moved to.
+
+        """
+        return [node['name'] for node in self._get_nodes()
+                if node.get('running', True)]
+
+    def _lookup_vhosts(self) -> typing.List[str]:
+        try:
+            result = self.session.get(self._build_url('/api/vhosts'))
+        except exceptions.ConnectionError as error:
+            exit_application('Error looking up vhosts: {}'.format(error), 1)
+        else:
+            vhosts = result.json()
+            if not result.ok:
+                exit_application('Error looking up vhosts: {}'.format(
+                   vhosts['reason']), 8)
+            return sorted(vhost['name'] for vhost in vhosts)
+
+    def _plan(self, max_skew: typing.Optional[float] = None) \
+            -> typing.List[planner.Move]:
+        """Plan the moves for the configured strategy from the queues in
+        the index, with the ``min-moves`` planner standing in for
+        ``round-robin``. The ``min-moves`` planner stops once the skew is
+        within ``max_skew`` when it is set.
+
+        """
+        if self.args.strategy == 'locality':
+            return planner.locality(
+                self.index.queues.values(), self.nodes, self._client_nodes(),
+                self.args.weight, self.args.max_skew)
+        elif self.args.strategy == 'mirrors':
+            return planner.mirrored(
+                self.index.queues.values(), self.nodes,
+                self.args.mirror_tolerance)
+        return planner.plan(
+            self.index.queues.values(), self.nodes, self.args.weight, max_skew)
+
+    def _planned_moves(self, plan: typing.List[list]) \
+            -> typing.Iterator[planner.Move]:
+        """Return the ``[vhost, name, destination]`` moves of the plan
+        that have not been completed, with the current state of their queues
+        requested together for up to ``--page-size`` moves at a time,
+        skipping the queues that were deleted or already reached their
+        destination.
+
+        """
+        moves = (planner.Move({'vhost': vhost, 'name': name}, destination)
+                 for vhost, name, destination in plan
+                 if (vhost, name) not in self.journal.completed)
+        while True:
+            chunk = list(itertools.islice(moves, self.args.page_size))
+            if not chunk:
+                return
+            yield from self._current_moves(chunk)
+
+    def _moves(self) -> typing.Iterator[planner.Move]:
+        """Return the queue moves to perform for the configured strategy,
+        starting with the moves that were in-flight when a previous run was
+        interrupted and skipping the queues it completed.
+
+        """
+        resumed = set()
+        for move in self._resumed_moves():
+            resumed.add(journal.queue_key(move.queue))
+            yield move
+        for move in self._strategy_moves():
+            if (self.journal.is_completed(move.queue) or
+                    journal.queue_key(move.queue) in resumed):
+                continue
+            yield move
+
+    def _strategy_moves(self) -> typing.Iterator[planner.Move]:
+        """Return the queue moves for the configured strategy"""
+        if self.journal.plan is not None and (
+                self.args.plan or self.args.strategy != 'round-robin'):
+            LOGGER.info('Using the plan recorded in the journal')
+            self.metrics.total = len(
+                [m for m in self.journal.plan
+                 if tuple(m[:2]) not in self.journal.completed])
+            return self._planned_moves(self.journal.plan)
+        if self.args.plan:
+            plan = self._read_plan()
+            self.journal.record_plan(
+                planner.Move({'vhost': vhost, 'name': name}, destination)
+                for vhost, name, destination in plan)
+            self.metrics.total = len(plan)
+            return self._planned_moves(plan)
+        if self.args.strategy == 'round-robin':
+            return self._round_robin_moves()
+        self.index.update(self._queues())
+        moves = self._plan()
+        LOGGER.info('Planned %i moves for %i queues with %s',
+                    len(moves), len(self.index.queues), self.args.strategy)
+        self.journal.record_plan(moves)
+        self.metrics.total = len(moves)
+        return iter(moves)
+
+    def _move_batch(self, moves: typing.List[planner.Move]) \
+            -> typing.NoReturn:
+        """Move a batch of queues that share a destination and policy
+        definition using a single temporary policy, waiting on each queue
+        in turn. The queues that no longer share the batch key of the first
+        queue when their current state is requested are moved on their own.
+
+        """
+        moves = self._current_moves(moves)
+        if not moves:
+            return
+        key = self._batch_key(moves[0])
+        changed = [move for move in moves if self._batch_key(move) != key]
+        moves = [move for move in moves if self._batch_key(move) == key]
+        for move in changed:
+            LOGGER.info('Queue %s changed since it was batched, moving it '
+                        'on its own', move.queue['name'])
+            self._move_queue(*move)
+        if len(moves) == 1:
+            return self._move_queue(*moves[0])
+        queue, destination = moves[0]
+        vhost = queue.get('vhost')
+        names = [move.queue['name'] for move in moves]
+        policy = '{}-batch-{}'.format(self.POLICY_NAME, next(self.batch_ids))
+        LOGGER.info('Moving %i queues to %s with %s',
+                    len(moves), destination, policy)
+        sync_seconds, polls = [0.0] * len(moves), [0] * len(moves)
+        deleted = set()  # Offsets of the queues deleted while moving
+        failed = {}  # Offset -> the phase of the queues that timed out
+        for _move in moves:
+            self.metrics.move_started()
+        if self._needs_sync(queue, destination):
+            for move in moves:
+                self.journal.record_phase(move.queue, destination, 'sync')
+            message_bytes = sum(move.queue.get('message_bytes') or 0
+                                for move in moves)
+            with self._sync_budget(message_bytes):
+                started = time.monotonic()
+                deadline = self._phase_deadline('sync', message_bytes)
+                self._apply_batch_policy(
+                    policy, names, self._step1_definition(queue, destination),
+                    vhost)
+                for offset, move in enumerate(moves):
+                    try:
+                        polls[offset] += self._wait_for_synchronized_slaves(
+                            move.queue['name'],
+                            move.queue.get('message_bytes') or 0,
+                            destination if self.args.targeted else None,
+                            vhost, deadline)
+                    except QueueDeleted:
+                        deleted.add(offset)
+                    except PhaseTimeout:
+                        failed[offset] = 'sync'
+                    sync_seconds[offset] = time.monotonic() - started
+                self._record_sync_rate(
+                    sum(move.queue.get('message_bytes') or 0
+                        for offset, move in enumerate(moves)
+                        if offset not in deleted and offset not in failed),
+                    time.monotonic() - started)
+        moving = [offset for offset in range(len(moves))
+                  if offset not in deleted and offset not in failed]
+        move_seconds = [0.0] * len(moves)
+        if moving:
+            for offset in moving:
+                self.journal.record_phase(
+                    moves[offset].queue, destination, 'move')
+            started = time.monotonic()
+            deadline = self._phase_deadline('move')
+            self._apply_batch_policy(
+                policy, [names[offset] for offset in moving],
+                self._step2_definition(queue, destination), vhost)
+            for offset in moving:
+                try:
+                    polls[offset] += self._wait_for_queue_move(
+                        names[offset], destination, vhost, deadline)
+                except QueueDeleted:
+                    deleted.add(offset)
+                    continue
+                except PhaseTimeout:
+                    failed[offset] = 'move'
+                    continue
+                move_seconds[offset] = time.monotonic() - started
+                LOGGER.info('Moved %s to %s (%i of %i in batch)',
+                            names[offset], destination, offset + 1,
+                            len(names))
+        self._delete_policy(policy, vhost)
+        for offset, move in enumerate(moves):
+            if offset in deleted:
+                self._move_abandoned(move.queue)
+            elif offset in failed:
+                self._restore_placement(move.queue)
+                self._move_failed(move, failed[offset])
+            else:
+                self.journal.record_done(move.queue)
+                self._move_finished(move, sync_seconds[offset],
+                                    move_seconds[offset], polls[offset])
+
+    def _move_abandoned(self, queue: dict) -> typing.NoReturn:
+        """Record that the queue was deleted while it was being moved"""
+        LOGGER.warning('Queue %s was deleted while it was being moved',
+                       queue['name'])
+        self.journal.record_done(queue)
+        self.metrics.move_abandoned()
+
+    def _move_failed(self, move: planner.Move, phase: str) \
+            -> typing.NoReturn:
+        """Record a queue move that was rolled back after the phase timed
+        out, so that the run continues with the next queue.
 
-    def _node_assignment(self) -> str:
-        return self.nodes[self.node_offset]
+        """
+        LOGGER.error('Failed to move %s to %s: the %s phase timed out',
+                     move.queue['name'], move.destination, phase)
+        self.journal.record_failed(move.queue, phase)
+        self.metrics.move_failed(move.queue, move.destination, phase)
+
+    def _move_finished(self, move: planner.Move, sync_seconds: float,
+                       move_seconds: float, polls: int) -> typing.NoReturn:
+        """Record the metrics for a finished queue move, logging the
+        overall progress and periodically writing the metrics file.
+
+        """
+        self.metrics.move_finished(
+            move.queue, move.destination, sync_seconds, move_seconds, polls)
+        self.index.move(move.queue, move.destination)
+        LOGGER.info('Progress: %s', self.metrics.progress())
+        if time.monotonic() - self.metrics_written_at > METRICS_INTERVAL:
+            self._write_metrics()
+
+    def _move_queue(self, queue: dict, destination: str) -> typing.NoReturn:
+        """Move the queue master to the destination node, using the
+        queue's own temporary policy so that moves may run concurrently.
+
+        """
+        if self._is_quorum(queue):
+            return self._move_quorum_queue(queue, destination)
+        LOGGER.info('Moving %s to %s', queue['name'], destination)
+        self.metrics.move_started()
+        sync_seconds, polls = 0.0, 0
+        try:
+            if self._needs_sync(queue, destination):
+                self.journal.record_phase(queue, destination, 'sync')
+                started = time.monotonic()
+                polls += self._apply_step1_policy(queue, destination)
+                sync_seconds = time.monotonic() - started
+            self.journal.record_phase(queue, destination, 'move')
+            started = time.monotonic()
+            polls += self._apply_step2_policy(queue, destination)
+            move_seconds = time.monotonic() - started
+        except QueueDeleted:
+            self._delete_policy(
+                self._policy_name(queue['name']), queue.get('vhost'))
+            return self._move_abandoned(queue)
+        except PhaseTimeout as error:
+            self._delete_policy(
+                self._policy_name(queue['name']), queue.get('vhost'))
+            self._restore_placement(queue)
+            return self._move_failed(
+                planner.Move(queue, destination), error.phase)
+        self._delete_policy(
+            self._policy_name(queue['name']), queue.get('vhost'))
+        self.journal.record_done(queue)
+        self._move_finished(planner.Move(queue, destination),
+                            sync_seconds, move_seconds, polls)
+
+    def _move_quorum_queue(self, queue: dict,
+                           destination: str) -> typing.NoReturn:
+        """Move the leader of the quorum queue to the destination node.
+
+        The management API can not transfer the leadership to a specific
+        member, so the leader's replica is removed to trigger an election
+        and then added back, until the destination member wins. When the
+        destination is not a member, it is added first and replaces the
+        replica on the original leader, keeping the number of members.
+
+        """
+        name, vhost = queue['name'], queue.get('vhost')
+        message_bytes = queue.get('message_bytes') or 0
+        LOGGER.info('Moving the leader of %s to %s', name, destination)
+        self.metrics.move_started()
+        sync_seconds, polls = 0.0, 0
+        replace = self._needs_sync(queue, destination)
+        try:
+            if replace:
+                self.journal.record_phase(queue, destination, 'sync')
+                with self._sync_budget(message_bytes):
+                    started = time.monotonic()
+                    self._quorum_member('add', name, destination, vhost)
+                    polls += self._wait_for_quorum_member(
+                        name, destination, message_bytes, vhost,
+                        self._phase_deadline('sync', message_bytes))
+                    sync_seconds = time.monotonic() - started
+                self._record_sync_rate(message_bytes, sync_seconds)
+            self.journal.record_phase(queue, destination, 'move')
+            started = time.monotonic()
+            leader, count = self._elect_quorum_leader(
+                name, destination, replace, message_bytes, vhost,
+                self._phase_deadline('move'))
+        except QueueDeleted:
+            return self._move_abandoned(queue)
+        except PhaseTimeout as error:
+            self._restore_quorum_members(queue)
+            return self._move_failed(
+                planner.Move(queue, destination), error.phase)
+        if leader != destination:
+            LOGGER.warning('The leader of %s is %s after %i elections',
+                           name, leader, MAX_LEADER_ELECTIONS)
+            self._restore_quorum_members(queue)
+            return self._move_failed(
+                planner.Move(queue, destination), 'move')
+        polls += count
+        move_seconds = time.monotonic() - started
+        self.journal.record_done(queue)
+        self._move_finished(planner.Move(queue, destination),
+                            sync_seconds, move_seconds, polls)
+
+    @classmethod
+    def _needs_sync(cls, queue: dict, destination: str) -> bool:
+        """Returns True if the destination does not have a synchronised
+        slave of the queue yet, or is not a member of a quorum queue.
+
+        """
+        if cls._is_quorum(queue):
+            return destination not in (queue.get('members') or [])
+        return destination not in queue.get('synchronised_slave_nodes', [])
+
+    @staticmethod
+    def _next_interval(scheduler: PollScheduler, name: str, phase: str,
+                       deadline: typing.Optional[float] = None) -> float:
+        """Return the time to sleep before the next poll of the queue,
+        raising ``PhaseTimeout`` if the deadline has passed.
+
+        """
+        interval = scheduler.next_interval()
+        if deadline is None:
+            return interval
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise PhaseTimeout(name, phase)
+        return min(interval, remaining)
+
+    def _phase_deadline(self, phase: str, message_bytes: int = 0) \
+            -> typing.Optional[float]:
+        """Return the monotonic time by which the phase of a queue move
+        must finish, or ``None`` if it may take as long as it needs. Unless
+        ``--sync-timeout`` is set, the sync phase is given
+        ``SYNC_TIMEOUT_FACTOR`` times the estimated duration of synchronizing
+        ``message_bytes`` at the HA sync rate observed so far, and at least
+        ``MIN_SYNC_TIMEOUT`` seconds.
+
+        """
+        timeout = getattr(self.args, '{}_timeout'.format(phase))
+        if phase == 'sync' and timeout is None:
+            timeout = max(MIN_SYNC_TIMEOUT, SYNC_TIMEOUT_FACTOR * (
+                message_bytes / (self.sync_rate or DEFAULT_SYNC_RATE)))
+        return time.monotonic() + timeout if timeout else None
+
+    def _poll_scheduler(self, message_bytes: int = 0) -> PollScheduler:
+        """Return a poll scheduler, estimating the initial interval from
+        the queue size and the HA sync rate observed so far.
+
+        """
+        estimate = 0.0
+        if message_bytes and self.sync_rate:
+            estimate = message_bytes / self.sync_rate
+        return PollScheduler(self.args.min_poll_interval,
+                             self.args.max_poll_interval, estimate)
+
+    def _policy_name(self, queue_name: str) -> str:
+        """Return the temporary policy name used when moving the queue"""
+        return '{}-queue-{}'.format(self.POLICY_NAME, queue_name)
+
+    def _read_plan(self) -> typing.List[list]:
+        """Return the moves in the plan file for the vhosts being
+        rebalanced.
+
+        """
+        try:
+            plan = snapshot.read_plan(self.args.plan)
+        except (OSError, ValueError) as error:
+            exit_application('Error reading plan: {}'.format(error), 11)
+        plan = [entry for entry in plan if entry[0] in self.vhosts]
+        LOGGER.info('Applying %i moves from %s', len(plan), self.args.plan)
+        return plan
+
+    def _record_sync_rate(self, message_bytes: int, duration: float) \
+            -> typing.NoReturn:
+        """Update the moving average of the observed HA sync rate from the
+        message bytes synchronized since a step-1 policy was applied.
+
+        """
+        if not message_bytes or duration <= 0:
+            return
+        rate = message_bytes / duration
+        if self.sync_rate is None:
+            self.sync_rate = rate
+        else:
+            self.sync_rate = (SYNC_RATE_WEIGHT * rate +
+                              (1 - SYNC_RATE_WEIGHT) * self.sync_rate)
+        LOGGER.debug('HA sync rate: %.0f bytes/sec', self.sync_rate)
 
     @staticmethod
     def _remove_blacklisted_keys(policy: dict) -> dict:
@@ -184,9 +986,211 @@ class Rebalance:
                 del policy[key]
         return policy
 
-    def _queues(self) -> typing.Generator[dict, None, None]:
+    def _restore_placement(self, queue: dict) -> typing.NoReturn:
+        """Move the master of a queue whose move was rolled back to its
+        original node if it already left it, using the queue's temporary
+        policy within the move timeout.
+
+        """
+        name, vhost = queue['name'], queue.get('vhost')
+        try:
+            state = self._queue_state(name, vhost)
+            if (state['node'] == queue['node'] or
+                    queue['node'] not in self.nodes):
+                return
+            LOGGER.info('Moving %s back to %s', name, queue['node'])
+            self._apply_policy(
+                name, self._step2_definition(queue, queue['node']), vhost)
+            try:
+                self._wait_for_queue_move(name, queue['node'], vhost,
+                                          self._phase_deadline('move'))
+            finally:
+                self._delete_policy(self._policy_name(name), vhost)
+        except (PhaseTimeout, QueueDeleted):
+            LOGGER.warning('Could not move %s back to %s', name,
+                           queue['node'])
+
+    def _restore_quorum_members(self, queue: dict) -> typing.NoReturn:
+        """Restore the members of a quorum queue whose move was rolled
+        back, without waiting for them. The leader can not be moved back.
+
+        """
+        name, vhost = queue['name'], queue.get('vhost')
+        original = queue.get('members') or [queue['node']]
+        try:
+            members = self._queue_state(name, vhost).get('members', [])
+            for node in original:
+                if node not in members and node in self.nodes:
+                    self._quorum_member('add', name, node, vhost)
+            for node in members:
+                if node not in original:
+                    self._quorum_member('delete', name, node, vhost)
+        except QueueDeleted:
+            LOGGER.warning('Queue %s was deleted while rolling back', name)
+
+    def _resumed_moves(self) -> typing.Iterator[planner.Move]:
+        """Return the moves that were in-flight when the previous run was
+        interrupted. Their temporary policies were removed at startup, so
+        each queue is moved again unless it already reached its destination.
+
+        """
+        for (vhost, name), (destination, phase) in \
+                list(self.journal.in_flight.items()):
+            LOGGER.info('Resuming the move of %s to %s from the %s phase',
+                        name, destination, phase)
+            queue = self._get_queue_info(name, vhost, missing_ok=True)
+            if queue is None:
+                LOGGER.info('Queue %s no longer exists, skipping', name)
+                continue
+            queue.setdefault('vhost', vhost)
+            if queue['node'] == destination:
+                self.journal.record_done(queue)
+                continue
+            yield planner.Move(queue, destination)
+
+    def _round_robin_moves(self) -> typing.Iterator[planner.Move]:
+        """Assign nodes round-robin in queue listing order, skipping the
+        queues that are already on their assigned node.
+
+        """
+        return planner.round_robin(self._queues(), self.nodes)
+
+    def _quorum_member(self, action: str, name: str, node: str,
+                       vhost: typing.Optional[str] = None) -> typing.NoReturn:
+        """Add or delete the replica of the quorum queue on the node"""
         try:
-            response = self.session.get(self._build_url('/api/queues/{vhost}'))
+            result = self.session.request(
+                'POST' if action == 'add' else 'DELETE',
+                self._build_url(
+                    '/api/queues/quorum/{{vhost}}/{}/replicas/{}'.format(
+                        parse.quote(name, safe=''), action), vhost=vhost),
+                data=json.dumps({'node': node}))
+        except exceptions.ConnectionError as error:
+            exit_application(
+                'Error changing quorum queue members: {}'.format(error), 1)
+        else:
+            if result.status_code == 404:
+                self._queue_state(name, vhost)  # Raises if it was deleted
+            if not result.ok:
+                exit_application(
+                    'Error changing quorum queue members: {}'.format(
+                        result.json()['reason']), 10)
+
+    def _queue_state(self, name: str,
+                     vhost: typing.Optional[str] = None) -> dict:
+        """Return the current state of the queue from the poller, raising
+        ``QueueDeleted`` if it no longer exists.
+
+        """
+        queue = self.poller.get(vhost or self.vhosts[0], name)
+        if queue is None:
+            raise QueueDeleted(name)
+        return queue
+
+    def _queue_states(self, vhost: str,
+                      names: typing.List[str]) -> typing.Iterator[dict]:
+        """Request the state of the named queues in the vhost, using a
+        name filter with as many queues as fit in the pattern length. Only
+        the columns used while moving a queue are requested, including the
+        message bytes, which set the first poll interval of the queues and
+        their sync budget.
+
+        """
+        params = {'columns': ','.join(POLL_COLUMNS), 'use_regex': 'true'}
+        chunks, length = [[]], 0
+        for name in sorted(names):
+            name = re.escape(name)
+            if chunks[-1] and length + len(name) > MAX_PATTERN_LENGTH:
+                chunks.append([])
+                length = 0
+            chunks[-1].append(name)
+            length += len(name) + 1
+        for chunk in chunks:
+            params['name'] = '^({})$'.format('|'.join(chunk))
+            page, page_count = 1, 1
+            while page <= page_count:
+                result = self._queue_page(page, vhost, params)
+                page_count = result['page_count']
+                for queue in result['items']:
+                    queue.setdefault('vhost', vhost)
+                    yield queue
+                page += 1
+
+    def _queue_params(self) -> dict:
+        """Return the query parameters for queue requests, limiting the
+        response to the fields the application uses in lean mode.
+
+        """
+        if not self.args.lean:
+            return {}
+        params = {'columns': ','.join(QUEUE_COLUMNS)}
+        if self._stats_disabled():
+            params['disable_stats'] = 'true'
+        return params
+
+    def _refresh_params(self) -> dict:
+        """Return the query parameters for the ``--watch`` refreshes, which
+        request the name, vhost, node and type of each queue and only the
+        other fields the weight, strategy, batches, selection and budgets
+        use, disabling the message statistics when none of them are used.
+
+        """
+        columns = REFRESH_COLUMNS + WEIGHT_COLUMNS[self.args.weight]
+        if self.args.strategy == 'mirrors' or self.args.batch_size > 1:
+            columns += ['synchronised_slave_nodes', 'members']
+        if self.args.batch_size > 1:
+            columns.append('effective_policy_definition')
+        columns += self.selection.columns
+        if (self.args.max_duration is not None or
+                self.args.max_sync_bytes is not None or
+                self.args.lazy_above is not None):
+            columns += ['message_bytes', 'synchronised_slave_nodes',
+                        'members']
+        params = {'columns': ','.join(dict.fromkeys(columns))}
+        if not self.selection.needs_stats and not (
+                set(columns) & {'message_bytes', 'memory', 'message_stats'}):
+            params['disable_stats'] = 'true'
+        return params
+
+    def _queues(self, params: typing.Optional[dict] = None) \
+            -> typing.Generator[dict, None, None]:
+        """Iterate through the selected queues in each vhost, requesting
+        them from the management API one page at a time so that memory usage
+        does not grow with the number of queues.
+
+        """
+        params = dict(params or self._queue_params())
+        if self.selection.name_pattern is not None:
+            params.update(name=self.selection.name_pattern, use_regex='true')
+        skipped = 0
+        for vhost in self.vhosts:
+            page, page_count = 1, 1
+            while page <= page_count:
+                result = self._queue_page(page, vhost, params)
+                page_count = result['page_count']
+                for queue in result['items']:
+                    queue.setdefault('vhost', vhost)
+                    reason = self.selection.reason(queue)
+                    if reason is not None:
+                        LOGGER.debug('Skipping %s in %s: %s',
+                                     queue['name'], vhost, reason)
+                        skipped += 1
+                        continue
+                    yield queue
+                page += 1
+        if skipped:
+            LOGGER.info('Skipped %i queues that are not selected', skipped)
+
+    def _queue_page(self, page: int,
+                    vhost: typing.Optional[str] = None,
+                    params: typing.Optional[dict] = None) -> dict:
+        try:
+            response = self.session.get(
+                self._build_url('/api/queues/{vhost}', vhost=vhost),
+                params=dict(params or self._queue_params(),
+                            page=page,
+                            page_size=self.args.page_size,
+                            sort='name'))
         except exceptions.ConnectionError as error:
             exit_application('Error getting queues: {}'.format(error), 1)
         else:
@@ -194,35 +1198,270 @@ class Rebalance:
             if not response.ok:
                 exit_application('Error getting queues: {}'.format(
                    result['reason']), 7)
-            for queue in result:
-                yield queue
+            return result
+
+    @contextlib.contextmanager
+    def _sync_budget(self, message_bytes: int) \
+            -> typing.Generator[None, None, None]:
+        """Wait until synchronizing the queue would not exceed the maximum
+        number of bytes being synchronized at once, holding its share of
+        the budget while HA sync is performed. A queue larger than the
+        budget is synchronized when no other queues are.
+
+        """
+        if not self.args.max_sync_bytes:
+            yield
+            return
+        with self.sync_condition:
+            while (self.sync_bytes and self.sync_bytes + message_bytes >
+                   self.args.max_sync_bytes):
+                LOGGER.debug('Waiting for %i bytes of sync budget',
+                             message_bytes)
+                self.sync_condition.wait()
+            self.sync_bytes += message_bytes
+        try:
+            yield
+        finally:
+            with self.sync_condition:
+                self.sync_bytes -= message_bytes
+                self.sync_condition.notify_all()
 
-    def _wait_for_queue_move(self, name: str, node: str) -> typing.NoReturn:
+    def _stats_disabled(self) -> bool:
+        """Return True if queue listings disable the message statistics,
+        which is only done in lean mode when the statistics of the listed
+        queues are not used to select, weigh, order, budget or batch them.
+
+        """
+        return (self.args.lean and not self.selection.needs_stats and
+                self.args.weight == 'count' and
+                self.args.max_duration is None and
+                self.args.max_sync_bytes is None and
+                self.args.lazy_above is None)
+
+    def _step1_definition(self, queue: dict,
+                          destination: typing.Optional[str]) -> dict:
+        """Return the policy definition for mirroring the queue"""
+        policy = self._temporary_definition(queue)
+        if self.args.targeted and destination:
+            policy['ha-mode'] = 'nodes'
+            policy['ha-params'] = [queue['node'], destination]
+        else:
+            policy['ha-mode'] = 'all'
+        return policy
+
+    def _step2_definition(self, queue: dict, destination: str) -> dict:
+        """Return the policy definition for moving the queue master"""
+        policy = self._temporary_definition(queue)
+        policy['ha-mode'] = 'nodes'
+        policy['ha-params'] = [destination]
+        return policy
+
+    def _temporary_definition(self, queue: dict) -> dict:
+        """Return the queue's own policy definition without the keys the
+        temporary policies set, making the queue lazy while it is moved
+        when it is above ``--lazy-above`` message bytes. The queue returns
+        to its own mode when the temporary policy is deleted.
+
+        """
+        policy = self._remove_blacklisted_keys(
+            dict(queue['effective_policy_definition'] or {}))
+        if self._is_lazy(queue):
+            policy['queue-mode'] = 'lazy'
+        return policy
+
+    @staticmethod
+    def _wait_for_moves(pending: typing.Set[futures.Future],
+                        return_when: str) -> typing.Set[futures.Future]:
+        """Wait on in-flight queue moves, re-raising any errors (including
+        the ``SystemExit`` raised by ``exit_application``) from the
+        worker threads.
+
+        """
+        done, pending = futures.wait(pending, return_when=return_when)
+        for future in done:
+            future.result()
+        return pending
+
+    def _wait_for_healthy_cluster(
+            self, deadline: typing.Optional[float] = None) \
+            -> typing.NoReturn:
+        """Pause before starting another queue move while the cluster has
+        resource alarms or is above the backpressure thresholds, giving up
+        once the deadline passes.
+
+        """
+        if not self.args.backpressure:
+            return
+        if (self.health_checked_at is not None and
+                time.monotonic() - self.health_checked_at <
+                self.args.health_check_interval):
+            return
+        while True:
+            problems = self._health_problems()
+            if not problems:
+                break
+            for problem in problems:
+                LOGGER.warning('Pausing queue moves: %s', problem)
+            interval = self.args.health_check_interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    LOGGER.warning('Stopped waiting for the cluster to '
+                                   'recover at the deadline')
+                    return
+                interval = min(interval, remaining)
+            time.sleep(interval)
+        self.health_checked_at = time.monotonic()
+
+    def _wait_for_quorum_leader(self, name: str, previous: str,
+                                vhost: typing.Optional[str] = None,
+                                deadline: typing.Optional[float] = None) \
+            -> typing.Tuple[str, int]:
+        """Wait until the quorum queue has elected a leader other than
+        ``previous``, returning the leader and the number of polls.
+
+        """
+        LOGGER.info('Waiting for %s to elect a new leader', name)
+        scheduler = self._poll_scheduler()
+        polls = 0
+        while True:
+            queue = self._queue_state(name, vhost)
+            polls += 1
+            if queue.get('leader') not in (None, previous):
+                return queue['leader'], polls
+            interval = self._next_interval(scheduler, name, 'move', deadline)
+            LOGGER.info('Sleeping for %.2f seconds for leader election',
+                        interval)
+            time.sleep(interval)
+
+    def _wait_for_quorum_member(self, name: str, node: str,
+                                message_bytes: int = 0,
+                                vhost: typing.Optional[str] = None,
+                                deadline: typing.Optional[float] = None,
+                                phase: str = 'sync') -> int:
+        """Wait until the replica of the quorum queue on ``node`` is online
+        and has caught up with the leader, returning the number of times
+        the queue was polled.
+
+        The management API does not report how far behind the leader a
+        replica is, so the catch up is estimated from the message bytes of
+        the queue and the sync rate observed so far, counting from when the
+        replica was added.
+
+        """
+        LOGGER.info('Waiting for the %s replica of %s', node, name)
+        added = time.monotonic()
+        scheduler = self._poll_scheduler(message_bytes)
+        polls = 0
+        while True:
+            queue = self._queue_state(name, vhost)
+            polls += 1
+            if node in queue.get('online', queue.get('members', [])):
+                break
+            interval = self._next_interval(scheduler, name, phase, deadline)
+            LOGGER.info('Sleeping for %.2f seconds for quorum replica',
+                        interval)
+            time.sleep(interval)
+        caught_up = added + message_bytes / (
+            self.sync_rate or DEFAULT_SYNC_RATE)
+        if caught_up > time.monotonic():
+            if deadline is not None and caught_up > deadline:
+                raise PhaseTimeout(name, phase)
+            LOGGER.info('Sleeping for %.2f seconds for the %s replica of %s '
+                        'to catch up', caught_up - time.monotonic(), node,
+                        name)
+            time.sleep(max(0.0, caught_up - time.monotonic()))
+        return polls
+
+    def _wait_for_queue_move(self, name: str, node: str,
+                             vhost: typing.Optional[str] = None,
+                             deadline: typing.Optional[float] = None) -> int:
+        """Wait until the queue master is only on ``node``, returning the
+        number of times the queue was polled.
+
+        """
         LOGGER.info('Waiting for %s to move to %s', name, node)
+        scheduler = self._poll_scheduler()
+        polls = 0
         while True:
-            queue = self._get_queue_info(name)
+            queue = self._queue_state(name, vhost)
+            polls += 1
             if (queue['node'] == node and
                     not queue.get('slave_nodes') and
                     not queue.get('synchronised_slave_nodes')):
-                break
-            LOGGER.info('Sleeping for %i seconds for queue move',
-                        SLEEP_DURATION)
-            time.sleep(SLEEP_DURATION)
+                return polls
+            interval = self._next_interval(scheduler, name, 'move', deadline)
+            LOGGER.info('Sleeping for %.2f seconds for queue move', interval)
+            time.sleep(interval)
+
+    def _wait_for_synchronized_slaves(
+            self, name: str, message_bytes: int = 0,
+            node: typing.Optional[str] = None,
+            vhost: typing.Optional[str] = None,
+            deadline: typing.Optional[float] = None) -> int:
+        """Wait until all of the HA slaves of the queue are synchronized,
+        or only the slave on ``node`` when it is specified, returning the
+        number of times the queue was polled.
 
-    def _wait_for_synchronized_slaves(self, name: str) -> typing.NoReturn:
+        """
         LOGGER.info('Waiting for %s to synchronize HA slaves', name)
+        scheduler = self._poll_scheduler(message_bytes)
+        polls = 0
         while True:
-            queue = self._get_queue_info(name)
+            queue = self._queue_state(name, vhost)
+            polls += 1
             LOGGER.debug('sn: %r/ ssn: %r',
                          sorted(queue.get('slave_nodes', [])),
                          sorted(queue.get('synchronised_slave_nodes', [])))
-            if (queue.get('slave_nodes') and
-                sorted(queue.get('slave_nodes', [])) == sorted(queue.get(
-                    'synchronised_slave_nodes', []))):
+            if node is not None:
+                if node in queue.get('synchronised_slave_nodes', []):
+                    break
+            elif (queue.get('slave_nodes') and
+                  sorted(queue.get('slave_nodes', [])) == sorted(queue.get(
+                      'synchronised_slave_nodes', []))):
                 break
-            LOGGER.info('Sleeping for %i seconds while waiting HA sync',
-                        SLEEP_DURATION)
-            time.sleep(SLEEP_DURATION)
+            interval = self._next_interval(scheduler, name, 'sync', deadline)
+            LOGGER.info('Sleeping for %.2f seconds while waiting HA sync',
+                        interval)
+            time.sleep(interval)
+        return polls
+
+    def _watch(self, deadline: typing.Optional[float] = None) \
+            -> typing.NoReturn:
+        """Refresh the queue placement every ``--watch-interval`` seconds
+        with a queue listing limited to the columns it uses, moving the
+        queues planned by the strategy whenever the skew of the running nodes
+        exceeds ``--max-skew``, until the deadline. The ``locality`` strategy
+        is planned on every refresh, as it places queues by more than the
+        skew.
+
+        """
+        self._execute(self._resumed_moves(), deadline)
+        while deadline is None or time.monotonic() < deadline:
+            if self.args.all_vhosts:
+                self.vhosts = self._lookup_vhosts()
+            self.nodes = self._lookup_nodes()
+            changed = self.index.update(self._queues(self._refresh_params()))
+            skew = self.index.skew(self.nodes)
+            LOGGER.info('%i queues changed, the node skew is %.2f with the '
+                        'most load on %s', changed, skew,
+                        self.index.most_loaded(self.nodes))
+            if skew > self.args.max_skew or self.args.strategy == 'locality':
+                moves = self._plan(self.args.max_skew)
+                if moves:
+                    LOGGER.info('Moving %i queues with %s',
+                                len(moves), self.args.strategy)
+                self._execute(moves, deadline)
+            interval = self.args.watch_interval
+            if deadline is not None:
+                interval = min(interval, max(deadline - time.monotonic(), 0))
+            time.sleep(interval)
+
+    def _write_metrics(self) -> typing.NoReturn:
+        if self.args.metrics_file:
+            self.metrics.write(self.args.metrics_file,
+                               self.args.metrics_format)
+            self.metrics_written_at = time.monotonic()
 
 
 def configure_logging(args: argparse.Namespace) \
@@ -264,12 +1503,101 @@ def exit_application(message: typing.Optional[str] = None,
     sys.exit(code)
 
 
+def pattern(value: str) -> typing.Pattern[str]:
+    """Validate a CLI argument as a regular expression"""
+    try:
+        return re.compile(value)
+    except re.error as error:
+        raise argparse.ArgumentTypeError(
+            '{!r} is not a valid regular expression: {}'.format(
+                value, error))
+
+
+def non_negative_float(value: str) -> float:
+    """Validate a CLI argument as a number that is zero or more"""
+    try:
+        result = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            '{!r} is not a number'.format(value))
+    if result < 0:
+        raise argparse.ArgumentTypeError(
+            '{!r} must not be negative'.format(value))
+    return result
+
+
+def non_negative_int(value: str) -> int:
+    """Validate a CLI argument as an integer that is zero or more"""
+    try:
+        result = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            '{!r} is not an integer'.format(value))
+    if result < 0:
+        raise argparse.ArgumentTypeError(
+            '{!r} must not be negative'.format(value))
+    return result
+
+
+def positive_float(value: str) -> float:
+    """Validate a CLI argument as a positive number"""
+    try:
+        result = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            '{!r} is not a number'.format(value))
+    if result <= 0:
+        raise argparse.ArgumentTypeError(
+            '{!r} must be greater than zero'.format(value))
+    return result
+
+
+def positive_int(value: str) -> int:
+    """Validate a CLI argument as a positive integer"""
+    try:
+        result = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            '{!r} is not an integer'.format(value))
+    if result < 1:
+        raise argparse.ArgumentTypeError(
+            '{!r} must be greater than zero'.format(value))
+    return result
+
+
+def page_size(value: str) -> int:
+    """Validate a CLI argument as a management API page size"""
+    result = positive_int(value)
+    if result > MAX_PAGE_SIZE:
+        raise argparse.ArgumentTypeError(
+            '{!r} must not be greater than {}'.format(value, MAX_PAGE_SIZE))
+    return result
+
+
+def ratio(value: str) -> float:
+    """Validate a CLI argument as a ratio between 0 and 1"""
+    result = positive_float(value)
+    if result > 1:
+        raise argparse.ArgumentTypeError(
+            '{!r} must not be greater than 1'.format(value))
+    return result
+
+
 def parse_cli_arguments(args: typing.Optional[list] = None) \
         -> argparse.Namespace:
     """Return the parsed CLI arguments for the application invocation"""
+    args = sys.argv[1:] if args is None else list(args)
+    command = args.pop(0) if args and args[0] in COMMANDS else 'run'
     parser = argparse.ArgumentParser(
         'rmq-cluster-rebalance', conflict_handler='resolve',
         description='Rebalances the queues in a RabbitMQ cluster',
+        epilog='The first argument may be a command: run rebalances the '
+               'cluster (default), snapshot writes the state of the cluster '
+               'to --output, plan reports the moves for the --snapshot file '
+               'without connecting to the cluster and writes them to '
+               '--output, apply performs the moves in the --plan file, and '
+               'fleet rebalances the clusters in the --config file in '
+               'parallel',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument(
         '-u', '--username',
@@ -279,9 +1607,195 @@ def parse_cli_arguments(args: typing.Optional[list] = None) \
         '-p', '--password',
         default=os.environ.get('RABBITMQ_PASSWORD', 'guest'),
         help='The RabbitMQ Management API password')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '--vhost', action='append',
+        help='The RabbitMQ VHost to use, may be specified multiple times '
+             '(default: $RABBITMQ_VHOST or /)')
+    group.add_argument(
+        '--all-vhosts', action='store_true',
+        help='Rebalance the queues in all of the vhosts in the cluster')
+    parser.add_argument(
+        '-c', '--concurrency', type=positive_int, default=1,
+        help='The number of queue moves to perform at the same time')
+    parser.add_argument(
+        '--strategy',
+        choices=['round-robin', 'min-moves', 'locality', 'mirrors'],
+        default='round-robin',
+        help='How queues are assigned to nodes: round-robin in listing order, '
+             'the fewest moves that balance the queue weight, the node most '
+             'of their consumers are connected to within --max-skew, or an '
+             'even share per node that prefers nodes with a synchronised '
+             'mirror within --mirror-tolerance')
+    parser.add_argument(
+        '--weight', choices=sorted(planner.WEIGHTS.keys()), default='count',
+        help='The queue weight to balance with the min-moves and locality '
+             'strategies')
+    parser.add_argument(
+        '--mirror-tolerance', type=non_negative_int, default=1,
+        metavar='COUNT',
+        help='The number of queues above an even share that the mirrors '
+             'strategy places on a node with a synchronised mirror of them')
+    parser.add_argument(
+        '--targeted', action='store_true',
+        help='Only mirror queues to their destination node prior to moving '
+             'them, instead of to every node in the cluster')
+    parser.add_argument(
+        '--lazy-above', type=positive_int, metavar='BYTES',
+        help='Make classic queues with more message bytes than this lazy '
+             'while they are moved, so new mirrors synchronize from disk '
+             'instead of memory')
+    parser.add_argument(
+        '--batch-size', type=positive_int, default=1,
+        help='The maximum number of queues with the same destination to move '
+             'with a single policy')
+    parser.add_argument(
+        '--lean', action='store_true',
+        help='Request only the queue fields used when moving queues, without '
+             'message statistics unless the options in use need them')
+    parser.add_argument(
+        '--discover', action='store_true',
+        help='Add the management API endpoints of the nodes in the cluster '
+             'to the URLs that are used')
+    parser.add_argument(
+        '--min-poll-interval', type=positive_float, default=MIN_POLL_INTERVAL,
+        help='The minimum number of seconds to wait between queue polls')
+    parser.add_argument(
+        '--max-poll-interval', type=positive_float, default=MAX_POLL_INTERVAL,
+        help='The maximum number of seconds to wait between queue polls')
+    parser.add_argument(
+        '--status-interval', type=positive_float, default=STATUS_INTERVAL,
+        metavar='SECONDS',
+        help='The minimum number of seconds between the requests for the '
+             'state of the queues being moved, which are shared by all of '
+             'the queues')
     parser.add_argument(
-        '--vhost', default=os.environ.get('RABBITMQ_VHOST', '/'),
-        help='The RabbitMQ VHost to use')
+        '--max-duration', type=positive_float, metavar='SECONDS',
+        help='Only start queue moves that are estimated to finish within '
+             'this many seconds of starting, moving the cheapest queues '
+             'first, and stop watching after this many seconds')
+    parser.add_argument(
+        '--sync-timeout', type=non_negative_float, metavar='SECONDS',
+        help='Roll back a queue move when its mirrors or replica on the '
+             'destination are not synchronized within this many seconds, '
+             'or never with 0. When it is not set, a queue is given {} times '
+             'the sync duration estimated from its size, and at least {:.0f} '
+             'seconds'.format(
+                 SYNC_TIMEOUT_FACTOR, MIN_SYNC_TIMEOUT))
+    parser.add_argument(
+        '--move-timeout', type=positive_float, default=MOVE_TIMEOUT,
+        metavar='SECONDS',
+        help='Roll back a queue move when its master or leader has not moved '
+             'within this many seconds of the synchronization')
+    parser.add_argument(
+        '--page-size', type=page_size, default=MAX_PAGE_SIZE,
+        help='The number of queues to request from the management API at a '
+             'time')
+
+    group = parser.add_argument_group(title='Selection options')
+    group.add_argument(
+        '--include', type=pattern, action='append', metavar='REGEX',
+        help='Only rebalance the queues with names that match the regular '
+             'expression, may be specified multiple times')
+    group.add_argument(
+        '--exclude', type=pattern, action='append', metavar='REGEX',
+        help='Do not rebalance the queues with names that match the regular '
+             'expression, may be specified multiple times')
+    group.add_argument(
+        '--skip-exclusive', action='store_true',
+        help='Do not rebalance exclusive queues')
+    group.add_argument(
+        '--skip-auto-delete', action='store_true',
+        help='Do not rebalance auto-delete queues')
+    group.add_argument(
+        '--skip-transient', action='store_true',
+        help='Do not rebalance queues that are not durable')
+    group.add_argument(
+        '--min-message-bytes', type=positive_int, default=0,
+        metavar='BYTES',
+        help='Do not rebalance queues with fewer message bytes')
+    group.add_argument(
+        '--min-consumers', type=positive_int, default=0, metavar='COUNT',
+        help='Do not rebalance queues with fewer consumers')
+
+    group = parser.add_argument_group(title='Backpressure options')
+    group.add_argument(
+        '--backpressure', action='store_true',
+        help='Pause queue moves while the cluster has resource alarms or is '
+             'above the backpressure thresholds')
+    group.add_argument(
+        '--health-check-interval', type=positive_float,
+        default=HEALTH_CHECK_INTERVAL,
+        help='The number of seconds between cluster health checks')
+    group.add_argument(
+        '--max-memory-used', type=ratio, default=0.8,
+        help='Pause when a node uses more than this ratio of its memory '
+             'limit')
+    group.add_argument(
+        '--max-fd-used', type=ratio, default=0.9,
+        help='Pause when a node uses more than this ratio of its file '
+             'descriptors')
+    group.add_argument(
+        '--max-publish-rate', type=positive_float,
+        help='Pause when the cluster-wide publish rate is above this number '
+             'of messages per second')
+    group.add_argument(
+        '--max-sync-bytes', type=positive_int,
+        help='The maximum total message bytes of the queues being '
+             'synchronized at once')
+
+    group = parser.add_argument_group(title='Watch options')
+    group.add_argument(
+        '--watch', action='store_true',
+        help='Keep running, moving the queues planned by --strategy whenever '
+             'the skew of the running nodes is above --max-skew')
+    group.add_argument(
+        '--watch-interval', type=positive_float, default=WATCH_INTERVAL,
+        metavar='SECONDS',
+        help='The number of seconds between refreshes of the queue placement')
+    group.add_argument(
+        '--max-skew', type=positive_float, default=MAX_SKEW,
+        help='The difference between the most and least loaded nodes, as a '
+             'ratio of the average node load, that triggers queue moves, and '
+             'the load above the average node load that the locality '
+             'strategy allows')
+
+    group = parser.add_argument_group(title='Offline options')
+    group.add_argument(
+        '--output', metavar='PATH',
+        help='The file to write the snapshot or plan to')
+    group.add_argument(
+        '--snapshot', metavar='PATH',
+        help='The snapshot file to plan the moves for')
+    group.add_argument(
+        '--plan', metavar='PATH',
+        help='The plan file with the moves to apply')
+
+    group = parser.add_argument_group(title='Fleet options')
+    group.add_argument(
+        '--config', metavar='PATH',
+        help='The JSON file with the options of each cluster to rebalance')
+    group.add_argument(
+        '--processes', type=positive_int, metavar='COUNT',
+        help='The number of clusters to rebalance at the same time '
+             '(default: all of them)')
+
+    group = parser.add_argument_group(title='Checkpoint options')
+    group.add_argument(
+        '--journal', metavar='PATH',
+        help='Record the rebalance progress to the specified file')
+    group.add_argument(
+        '--resume', action='store_true',
+        help='Resume the rebalance recorded in the journal')
+
+    group = parser.add_argument_group(title='Metrics options')
+    group.add_argument(
+        '--metrics-file', metavar='PATH',
+        help='Write the queue move and HTTP request metrics to the specified '
+             'file')
+    group.add_argument(
+        '--metrics-format', choices=['json', 'prometheus'], default='json',
+        help='The format of the metrics file')
 
     group = parser.add_argument_group(title='Logging options')
     group.add_argument(
@@ -297,11 +1811,111 @@ def parse_cli_arguments(args: typing.Optional[list] = None) \
         help='output version information, then exit')
 
     parser.add_argument(
-        'url', metavar='URL', nargs='?',
-        default=os.environ.get('RABBITMQ_URL', 'http://localhost:15672'),
-        help='The RabbitMQ Management API base URL')
+        'urls', metavar='URL', nargs='*',
+        help='The RabbitMQ Management API base URLs of the nodes in the '
+             'cluster, read-only requests are spread across them (default: '
+             '$RABBITMQ_URL or http://localhost:15672)')
+
+    parsed = parser.parse_args(args)
+    parsed.command = command
+    if not parsed.urls:
+        parsed.urls = [
+            os.environ.get('RABBITMQ_URL', 'http://localhost:15672')]
+    if not parsed.vhost:
+        parsed.vhost = [os.environ.get('RABBITMQ_VHOST', '/')]
+    if parsed.resume and not parsed.journal:
+        parser.error('--resume requires --journal')
+    if parsed.min_poll_interval > parsed.max_poll_interval:
+        parser.error('--min-poll-interval must not be greater than '
+                     '--max-poll-interval')
+    if command == 'snapshot' and not parsed.output:
+        parser.error('snapshot requires --output')
+    if (command == 'plan') != bool(parsed.snapshot):
+        parser.error('--snapshot is required by and only used by plan')
+    if (command == 'apply') != bool(parsed.plan):
+        parser.error('--plan is required by and only used by apply')
+    if command == 'plan' and parsed.strategy == 'locality':
+        parser.error('the locality strategy can not be used with plan, '
+                     'snapshots do not include consumers')
+    if (command == 'fleet') != bool(parsed.config):
+        parser.error('--config is required by and only used by fleet')
+    if parsed.watch and command != 'run':
+        parser.error('--watch can not be used with {}'.format(command))
+    return parsed
+
 
-    return parser.parse_args(args)
+def plan_snapshot(args: argparse.Namespace) -> typing.NoReturn:
+    """Plan the moves for a snapshot of a cluster without connecting to
+    it, printing a report of the placement before and after the moves and
+    writing the plan to ``args.output`` if it is set.
+
+    """
+    try:
+        state = snapshot.read(args.snapshot)
+    except (OSError, ValueError) as error:
+        exit_application('Error reading snapshot: {}'.format(error), 11)
+    if args.strategy == 'round-robin':
+        moves = list(planner.round_robin(state.queues, state.nodes))
+    elif args.strategy == 'mirrors':
+        moves = planner.mirrored(
+            state.queues, state.nodes, args.mirror_tolerance)
+    else:
+        moves = planner.plan(state.queues, state.nodes, args.weight)
+    sys.stdout.write(snapshot.report(
+        state.queues, state.nodes, moves, Rebalance._needs_sync) + '\n')
+    if args.output:
+        snapshot.write_plan(args.output, moves, strategy=args.strategy,
+                            weight=args.weight, snapshot=args.snapshot)
+        LOGGER.info('Wrote %i moves to %s', len(moves), args.output)
+
+
+def rebalance_cluster(cluster: fleet.Cluster,
+                      totals: typing.MutableMapping[str, dict]) -> dict:
+    """Rebalance a cluster of a fleet in a pool process, publishing the
+    metrics totals of the rebalance to ``totals`` while it runs and
+    returning them with its exit code.
+
+    """
+    args = parse_cli_arguments(['run'] + cluster.arguments)
+    rebalance, exit_code = None, 0
+    with fleet.cluster_logging(cluster.name):
+        try:
+            rebalance = Rebalance(args)
+            with fleet.publishing(cluster.name, rebalance.metrics, totals):
+                rebalance.run()
+        except SystemExit as error:
+            exit_code = error.code or 0
+    result = rebalance.metrics.totals() if rebalance else fleet.EMPTY_TOTALS
+    return dict(result, exit_code=exit_code)
+
+
+def run_fleet(args: argparse.Namespace) -> typing.NoReturn:
+    """Rebalance the clusters in the ``--config`` file in parallel,
+    writing the aggregated metrics to ``--metrics-file`` when it is set.
+
+    """
+    try:
+        clusters = fleet.read_config(args.config)
+    except (OSError, ValueError) as error:
+        exit_application('Error reading fleet config: {}'.format(error), 13)
+    for cluster in clusters:
+        try:
+            parse_cli_arguments(['run'] + cluster.arguments)
+        except SystemExit:
+            exit_application('Invalid options for cluster {}'.format(
+                cluster.name), 13)
+    LOGGER.info('Rebalancing %i clusters', len(clusters))
+    runner = fleet.Fleet(clusters, args.processes or len(clusters),
+                         rebalance_cluster, configure_logging, (args,))
+    try:
+        runner.run()
+    finally:
+        if args.metrics_file:
+            runner.write(args.metrics_file, args.metrics_format)
+    LOGGER.info('Fleet rebalance finished: %s', runner.progress({}))
+    if runner.failed:
+        exit_application('Error rebalancing {}'.format(
+            ', '.join(runner.failed)), 14)
 
 
 def main() -> typing.NoReturn:  # pragma: nocover
@@ -309,4 +1923,11 @@ def main() -> typing.NoReturn:  # pragma: nocover
     urllib3.disable_warnings()
     args = parse_cli_arguments()
     configure_logging(args)
-    Rebalance(args).run()
+    if args.command == 'fleet':
+        run_fleet(args)
+    elif args.command == 'plan':
+        plan_snapshot(args)
+    elif args.command == 'snapshot':
+        Rebalance(args).snapshot(args.output)
+    else:
+        Rebalance(args).run()
@@ -0,0 +1,134 @@
+"""
+Management API client
+
+A ``requests.Session`` that knows the management API endpoints of every
+node in the cluster. Read-only requests are spread across the healthy
+endpoints and any request that fails to connect is retried on the next
+endpoint after a jittered delay, so a run survives the restart of the node
+it was started against.
+
+"""
+import itertools
+import logging
+import random
+import threading
+import time
+import typing
+from urllib import parse
+
+import requests
+from requests import adapters, exceptions
+import urllib3
+
+LOGGER = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY = 10.0
+NUM_RETRIES = 3
+RETRY_DELAY = 0.5
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class Session(requests.Session):
+    """Spreads the management API requests across the endpoints in
+    ``urls``. Requests for URLs that start with one of the endpoints are
+    sent to a healthy endpoint instead: read-only requests rotate through
+    them and other requests go to the first healthy one, in order. An
+    endpoint that fails to connect is skipped for ``down_interval``
+    seconds.
+
+    """
+    def __init__(self, urls: typing.List[str], pool_maxsize: int,
+                 retries: int = NUM_RETRIES,
+                 down_interval: float = 30.0):
+        super().__init__()
+        self.urls = []
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.down_interval = down_interval
+        self.down = {}  # endpoint -> monotonic time to try it again
+        self._offset = itertools.count()
+        self._lock = threading.Lock()
+        self.add_urls(urls)
+
+    def add_urls(self, urls: typing.Iterable[str]) -> typing.NoReturn:
+        """Add endpoints, keeping a connection pool for each of them"""
+        for url in urls:
+            url = url.rstrip('/')
+            if url not in self.urls:
+                self.urls.append(url)
+        adapter = adapters.HTTPAdapter(
+            pool_connections=max(len(self.urls),
+                                 adapters.DEFAULT_POOLSIZE),
+            pool_maxsize=self.pool_maxsize,
+            max_retries=urllib3.Retry(
+                status=self.retries,
+                status_forcelist=[429, 503]))
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method: str, url: str, *args, **kwargs) \
+            -> requests.Response:
+        path = self._path(url)
+        if path is None:
+            return super().request(method, url, *args, **kwargs)
+        error = None
+        endpoints = self._endpoints(method.upper() in SAFE_METHODS)
+        for attempt in range(len(endpoints) * self.retries):
+            endpoint = endpoints[attempt % len(endpoints)]
+            try:
+                response = super().request(
+                    method, endpoint + path, *args, **kwargs)
+            except exceptions.ConnectionError as err:
+                error = err
+                delay = random.uniform(
+                    0, min(RETRY_DELAY * 2 ** attempt, MAX_RETRY_DELAY))
+                LOGGER.warning('Error connecting to %s, retrying in %.1fs: '
+                               '%s', endpoint, delay, err)
+                with self._lock:
+                    self.down[endpoint] = \
+                        time.monotonic() + self.down_interval
+                time.sleep(delay)
+            else:
+                if endpoint in self.down:
+                    with self._lock:
+                        self.down.pop(endpoint, None)
+                return response
+        raise error
+
+    def _endpoints(self, rotate: bool) -> typing.List[str]:
+        """Return the endpoints in the order to try them, with the ones
+        that recently failed to connect at the end.
+
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = [url for url in self.urls
+                       if self.down.get(url, 0) <= now]
+            down = sorted((url for url in self.urls if url not in healthy),
+                          key=lambda url: self.down[url])
+        if rotate and healthy:
+            offset = next(self._offset) % len(healthy)
+            healthy = healthy[offset:] + healthy[:offset]
+        return healthy + down
+
+    def _path(self, url: str) -> typing.Optional[str]:
+        """Return the part of the URL after the endpoint it starts with"""
+        for endpoint in self.urls:
+            if url.startswith(endpoint + '/'):
+                return url[len(endpoint):]
+        return None
+
+
+def listener_urls(overview: dict, url: str) -> typing.List[str]:
+    """Return the management API URLs of the nodes from the listeners in
+    the ``/api/overview`` response, using the scheme of ``url``.
+
+    """
+    scheme = parse.urlsplit(url).scheme
+    urls = []
+    for listener in overview.get('listeners', []):
+        if listener.get('protocol') != scheme:
+            continue
+        host = listener['node'].partition('@')[2]
+        urls.append('{}://{}:{}'.format(scheme, host, listener['port']))
+    return sorted(urls)
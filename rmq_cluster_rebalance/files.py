@@ -0,0 +1,28 @@
+"""
+Atomic file writes
+
+The metrics, journal, snapshot and plan files are read while the rebalance
+runs or after it was interrupted, so they are written to a temporary file
+that replaces the file only once it is complete.
+
+"""
+import contextlib
+import os
+import typing
+
+
+@contextlib.contextmanager
+def atomic_writer(path: str) -> typing.Generator[typing.TextIO, None, None]:
+    """Write to a temporary file next to ``path``, replacing the file at
+    ``path`` with it when the context exits without an error and removing
+    it otherwise.
+
+    """
+    temp_path = '{}.tmp'.format(path)
+    try:
+        with open(temp_path, 'w') as handle:
+            yield handle
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    os.replace(temp_path, path)
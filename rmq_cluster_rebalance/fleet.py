@@ -0,0 +1,235 @@
+"""
+Fleet rebalancing
+
+Reads the clusters of a fleet from a JSON config file and rebalances them in
+parallel with a process per cluster, so a pass over the fleet takes as long
+as the slowest cluster. The metrics totals of each rebalance are published
+to the parent process, which logs the progress of the whole fleet and writes
+the aggregated metrics.
+
+"""
+from concurrent import futures
+import contextlib
+import json
+import logging
+import multiprocessing
+import threading
+import time
+import typing
+
+from . import files, metrics
+
+LOGGER = logging.getLogger(__name__)
+
+EMPTY_TOTALS = {'moved': 0, 'in_flight': 0, 'failed': 0, 'total': None,
+                'synchronized_bytes': 0, 'elapsed': 0.0}
+PROGRESS_INTERVAL = 10.0  # Seconds between the fleet progress lines
+PUBLISH_INTERVAL = 1.0  # Seconds between the metrics totals of a cluster
+
+
+class Cluster(typing.NamedTuple):
+    """A cluster in the fleet with the CLI arguments to rebalance it"""
+    name: str
+    arguments: typing.List[str]
+
+
+class Fleet:
+    """Rebalances the clusters with up to ``processes`` of them at once,
+    calling ``worker`` in a pool process with each cluster and a shared
+    mapping that it publishes the metrics totals of the rebalance to. The
+    worker returns the final totals with the ``exit_code`` of the rebalance.
+
+    """
+    def __init__(self, clusters: typing.List[Cluster], processes: int,
+                 worker: typing.Callable[[Cluster, typing.MutableMapping],
+                                         dict],
+                 initializer: typing.Optional[typing.Callable] = None,
+                 initargs: tuple = ()):
+        self.clusters = clusters
+        self.processes = processes
+        self.worker = worker
+        self.initializer = initializer
+        self.initargs = initargs
+        self.results = {}  # name -> totals with the exit code
+        self.started_at = time.monotonic()
+
+    @property
+    def failed(self) -> typing.List[str]:
+        """Return the names of the clusters whose rebalance failed"""
+        return sorted(name for name, result in self.results.items()
+                      if result['exit_code'])
+
+    def progress(self, totals: typing.Mapping[str, dict]) -> str:
+        """Return a progress line for the fleet from the published totals
+        of the clusters that are being rebalanced.
+
+        """
+        values = list(dict(totals, **self.results).values())
+        line = ('{}/{} clusters finished, {} queues moved, {} in flight, '
+                '{:.1f}s elapsed'.format(
+                    len(self.results), len(self.clusters),
+                    sum(v['moved'] for v in values),
+                    sum(v['in_flight'] for v in values),
+                    time.monotonic() - self.started_at))
+        failed = sum(v['failed'] for v in values)
+        if failed:
+            line += ', {} failed'.format(failed)
+        planned = [v['total'] for v in values if v['total'] is not None]
+        if planned:
+            line += ', {} moves planned'.format(sum(planned))
+        return line
+
+    def run(self, interval: float = PROGRESS_INTERVAL) \
+            -> typing.Dict[str, dict]:
+        """Rebalance the clusters, logging the progress of the fleet every
+        ``interval`` seconds and when a cluster finishes, and return the
+        result of each cluster by name.
+
+        """
+        with multiprocessing.Manager() as manager:
+            totals = manager.dict()
+            with futures.ProcessPoolExecutor(
+                    self.processes, initializer=self.initializer,
+                    initargs=self.initargs) as executor:
+                pending = {
+                    executor.submit(self.worker, cluster, totals):
+                        cluster.name for cluster in self.clusters}
+                while pending:
+                    done, _pending = futures.wait(
+                        pending, interval, futures.FIRST_COMPLETED)
+                    for future in done:
+                        self._finished(pending.pop(future), future)
+                    LOGGER.info('Fleet progress: %s',
+                                self.progress(totals.copy()))
+        return self.results
+
+    def write(self, path: str, output_format: str = 'json') \
+            -> typing.NoReturn:
+        """Atomically write the aggregated metrics to the file at ``path``"""
+        if output_format == 'prometheus':
+            content = self._prometheus()
+        else:
+            content = json.dumps(self._summary(), indent=2)
+        with files.atomic_writer(path) as handle:
+            handle.write(content)
+
+    def _finished(self, name: str, future: futures.Future) \
+            -> typing.NoReturn:
+        try:
+            self.results[name] = future.result()
+        except Exception as error:  # Raised by the worker
+            LOGGER.error('Error rebalancing %s: %r', name, error)
+            self.results[name] = dict(EMPTY_TOTALS, exit_code=1)
+        LOGGER.info('Finished rebalancing %s with exit code %i',
+                    name, self.results[name]['exit_code'])
+
+    def _prometheus(self) -> str:
+        lines = []
+        for metric, key, kind in [
+                ('queue_moves_total', 'moved', 'counter'),
+                ('queue_move_failures_total', 'failed', 'counter'),
+                ('synchronized_bytes_total', 'synchronized_bytes', 'counter'),
+                ('exit_code', 'exit_code', 'gauge')]:
+            lines.append('# TYPE {}_{} {}'.format(
+                metrics.PREFIX, metric, kind))
+            lines += ['{}_{}{{cluster="{}"}} {}'.format(
+                metrics.PREFIX, metric, name, result[key])
+                for name, result in sorted(self.results.items())]
+        return '\n'.join(lines) + '\n'
+
+    def _summary(self) -> dict:
+        values = self.results.values()
+        return {
+            'elapsed': time.monotonic() - self.started_at,
+            'moved': sum(v['moved'] for v in values),
+            'failed': sum(v['failed'] for v in values),
+            'synchronized_bytes': sum(v['synchronized_bytes'] for v in values),
+            'clusters': self.results}
+
+
+def arguments(options: dict) -> typing.List[str]:
+    """Return the CLI arguments for the options of a cluster, keyed by the
+    long option name. Boolean options are flags, lists repeat the option and
+    the ``urls`` are passed as the positional arguments.
+
+    """
+    values = []
+    for key, value in sorted(options.items()):
+        if key == 'urls' or value is None or value is False:
+            continue
+        option = '--{}'.format(key.replace('_', '-'))
+        if value is True:
+            values.append(option)
+        elif isinstance(value, list):
+            for item in value:
+                values += [option, str(item)]
+        else:
+            values += [option, str(value)]
+    urls = options.get('urls') or []
+    return values + ([urls] if isinstance(urls, str) else list(urls))
+
+
+@contextlib.contextmanager
+def cluster_logging(name: str) -> typing.Generator[None, None, None]:
+    """Prefix the messages logged in the context with the cluster name"""
+    factory = logging.getLogRecordFactory()
+
+    def record_factory(*args, **kwargs) -> logging.LogRecord:
+        record = factory(*args, **kwargs)
+        record.msg = '[{}] {}'.format(name, record.msg)
+        return record
+
+    logging.setLogRecordFactory(record_factory)
+    try:
+        yield
+    finally:
+        logging.setLogRecordFactory(factory)
+
+
+@contextlib.contextmanager
+def publishing(name: str, values: metrics.Metrics,
+               totals: typing.MutableMapping[str, dict],
+               interval: float = PUBLISH_INTERVAL) \
+        -> typing.Generator[None, None, None]:
+    """Publish the metrics totals of a cluster to the shared ``totals``
+    every ``interval`` seconds while in the context, and when it exits.
+
+    """
+    stopped = threading.Event()
+
+    def publish() -> typing.NoReturn:
+        while not stopped.wait(interval):
+            totals[name] = values.totals()
+
+    thread = threading.Thread(target=publish, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+        totals[name] = values.totals()
+
+
+def read_config(path: str) -> typing.List[Cluster]:
+    """Read the clusters from the fleet config file, raising
+    ``ValueError`` if it is not valid.
+
+    The file is a JSON object with the ``clusters`` to rebalance, an object
+    of the options of each cluster by name, and optional ``defaults`` for
+    the options of all of the clusters.
+
+    """
+    with open(path) as handle:
+        config = json.load(handle)
+    if not isinstance(config, dict) or not config.get('clusters') or \
+            not isinstance(config['clusters'], dict):
+        raise ValueError('{} does not define any clusters'.format(path))
+    defaults = config.get('defaults') or {}
+    clusters = []
+    for name, options in sorted(config['clusters'].items()):
+        if not isinstance(options, dict):
+            raise ValueError('The options of {} are not an object'.format(
+                name))
+        clusters.append(Cluster(name, arguments(dict(defaults, **options))))
+    return clusters
@@ -0,0 +1,64 @@
+"""
+Cluster health checks
+
+Determines if the cluster is under enough pressure that queue moves should
+be paused, using the data from the ``/api/nodes`` and ``/api/overview``
+management API endpoints.
+
+"""
+import typing
+
+
+def node_problems(nodes: typing.List[dict],
+                  max_memory_used: float,
+                  max_fd_used: float) -> typing.List[str]:
+    """Return the reasons to pause queue moves based upon the state of the
+    running nodes, such as resource alarms and memory or file descriptor
+    usage above the ``max_memory_used`` and ``max_fd_used`` ratios. Nodes
+    that are not running are skipped, as queues are not moved to them.
+
+    """
+    problems = []
+    for node in nodes:
+        name = node['name']
+        if not node.get('running', True):
+            continue
+        if node.get('mem_alarm'):
+            problems.append('{} has a memory alarm'.format(name))
+        if node.get('disk_free_alarm'):
+            problems.append('{} has a disk free alarm'.format(name))
+        ratio = _ratio(node.get('mem_used'), node.get('mem_limit'))
+        if ratio > max_memory_used:
+            problems.append('{} is using {:.0%} of its memory limit'.format(
+                name, ratio))
+        ratio = _ratio(node.get('fd_used'), node.get('fd_total'))
+        if ratio > max_fd_used:
+            problems.append(
+                '{} is using {:.0%} of its file descriptors'.format(
+                    name, ratio))
+    return problems
+
+
+def overview_problems(overview: dict,
+                      max_publish_rate: typing.Optional[float]) \
+        -> typing.List[str]:
+    """Return the reasons to pause queue moves based upon the cluster-wide
+    message rates in the overview.
+
+    """
+    if max_publish_rate is None:
+        return []
+    details = (overview.get('message_stats') or {}).get(
+        'publish_details') or {}
+    rate = details.get('rate') or 0.0
+    if rate > max_publish_rate:
+        return ['the cluster publish rate is {:.0f} messages/sec'.format(
+            rate)]
+    return []
+
+
+def _ratio(used: typing.Optional[float],
+           limit: typing.Optional[float]) -> float:
+    if not used or not limit:
+        return 0.0
+    return used / limit
@@ -0,0 +1,134 @@
+"""
+Rebalance progress journal
+
+Records the plan, the phase of each queue move and the completed and failed
+queues as JSON lines, so that an interrupted rebalance can be resumed without
+redoing work that has already been done.
+
+"""
+import json
+import logging
+import threading
+import typing
+
+from . import files
+
+LOGGER = logging.getLogger(__name__)
+
+Key = typing.Tuple[str, str]
+
+
+def queue_key(queue: dict) -> Key:
+    """Return the vhost and name that identify a queue in the journal"""
+    return queue.get('vhost') or '/', queue['name']
+
+
+class Journal:
+    """Records the progress of a rebalance in the file at ``path``. When
+    ``path`` is ``None``, progress is tracked in memory only.
+
+    """
+    def __init__(self, path: typing.Optional[str] = None,
+                 resume: bool = False):
+        self.path = path
+        self.completed = set()
+        self.failed = {}  # Key -> the phase that timed out
+        self.in_flight = {}  # Key -> (destination, phase)
+        self.plan = None  # [[vhost, name, destination], ...]
+        self._handle = None
+        self._lock = threading.Lock()
+        if path and resume:
+            self._load()
+            self._compact()
+        if path:
+            self._handle = open(path, 'a' if resume else 'w')
+
+    def close(self) -> typing.NoReturn:
+        if self._handle:
+            self._handle.close()
+            self._handle = None
+
+    def is_completed(self, queue: dict) -> bool:
+        return queue_key(queue) in self.completed
+
+    def record_done(self, queue: dict) -> typing.NoReturn:
+        """Record that the queue move has finished"""
+        vhost, name = queue_key(queue)
+        self._write({'e': 'done', 'v': vhost, 'q': name})
+
+    def record_failed(self, queue: dict, phase: str) -> typing.NoReturn:
+        """Record that the queue move was rolled back after the phase timed
+        out. Failed queues are moved again when the rebalance is resumed.
+
+        """
+        vhost, name = queue_key(queue)
+        self._write({'e': 'failed', 'v': vhost, 'q': name, 'p': phase})
+
+    def record_phase(self, queue: dict, destination: str, phase: str) \
+            -> typing.NoReturn:
+        """Record the phase (``sync`` or ``move``) of an in-flight move"""
+        vhost, name = queue_key(queue)
+        self._write({'e': 'phase', 'v': vhost, 'q': name,
+                     'd': destination, 'p': phase})
+
+    def record_plan(self, moves: typing.Iterable[tuple]) -> typing.NoReturn:
+        """Record the planned moves as ``(queue, destination)`` pairs"""
+        self._write({'e': 'plan', 'm': [list(queue_key(queue)) + [dest]
+                                        for queue, dest in moves]})
+
+    def _apply(self, entry: dict) -> typing.NoReturn:
+        key = entry.get('v'), entry.get('q')
+        if entry['e'] == 'plan':
+            self.plan = entry['m']
+        elif entry['e'] == 'phase':
+            self.in_flight[key] = entry['d'], entry['p']
+        elif entry['e'] == 'done':
+            self.in_flight.pop(key, None)
+            self.failed.pop(key, None)
+            self.completed.add(key)
+        elif entry['e'] == 'failed':
+            self.in_flight.pop(key, None)
+            self.failed[key] = entry['p']
+
+    def _compact(self) -> typing.NoReturn:
+        """Rewrite the journal with only the entries needed to resume"""
+        entries = []
+        if self.plan is not None:
+            entries.append({'e': 'plan', 'm': self.plan})
+        for vhost, name in sorted(self.completed):
+            entries.append({'e': 'done', 'v': vhost, 'q': name})
+        for (vhost, name), phase in sorted(self.failed.items()):
+            entries.append({'e': 'failed', 'v': vhost, 'q': name,
+                            'p': phase})
+        for (vhost, name), (destination, phase) in self.in_flight.items():
+            entries.append({'e': 'phase', 'v': vhost, 'q': name,
+                            'd': destination, 'p': phase})
+        with files.atomic_writer(self.path) as handle:
+            for entry in entries:
+                handle.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def _load(self) -> typing.NoReturn:
+        try:
+            with open(self.path) as handle:
+                for line in handle:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # A partially written last line
+                        LOGGER.debug('Skipping invalid journal entry')
+                        continue
+                    self._apply(entry)
+        except FileNotFoundError:
+            LOGGER.info('Journal %s not found, starting a new rebalance',
+                        self.path)
+            return
+        LOGGER.info('Resuming with %i completed, %i failed and %i in-flight '
+                    'queues', len(self.completed), len(self.failed),
+                    len(self.in_flight))
+
+    def _write(self, entry: dict) -> typing.NoReturn:
+        with self._lock:
+            self._apply(entry)
+            if self._handle:
+                self._handle.write(
+                    json.dumps(entry, separators=(',', ':')) + '\n')
+                self._handle.flush()
@@ -0,0 +1,245 @@
+"""
+Rebalance metrics
+
+Records the time spent moving each queue and the latency of the management
+API requests, writing them as a Prometheus textfile or a JSON summary.
+
+"""
+import bisect
+import collections
+import json
+import threading
+import time
+import typing
+
+import requests
+
+from . import files
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_RECORDS = 1000  # The queue moves and failures kept by --watch
+PHASE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+PREFIX = 'rmq_cluster_rebalance'
+
+
+class Histogram:
+    """A cumulative histogram of observed values"""
+
+    def __init__(self, buckets: typing.Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> typing.NoReturn:
+        offset = bisect.bisect_left(self.buckets, value)
+        if offset < len(self.buckets):
+            self.counts[offset] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self) -> dict:
+        return {'buckets': dict(zip(self.buckets, self._cumulative())),
+                'count': self.count,
+                'sum': self.sum}
+
+    def prometheus(self, name: str, labels: str) -> typing.List[str]:
+        separator = ',' if labels else ''
+        lines = ['{}_bucket{{{}{}le="{}"}} {}'.format(
+            name, labels, separator, bucket, count)
+            for bucket, count in zip(self.buckets, self._cumulative())]
+        lines.append('{}_bucket{{{}{}le="+Inf"}} {}'.format(
+            name, labels, separator, self.count))
+        lines.append('{}_sum{{{}}} {}'.format(name, labels, self.sum))
+        lines.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+        return lines
+
+    def _cumulative(self) -> typing.List[int]:
+        total, values = 0, []
+        for count in self.counts:
+            total += count
+            values.append(total)
+        return values
+
+
+class Metrics:
+    """Collects the rebalance metrics from the queue moves and the
+    responses of the management API session. When ``max_records`` is set,
+    only the most recent queue moves and failures are kept, so the memory
+    used by a long running watch does not grow, while the totals are
+    counted.
+
+    """
+    def __init__(self, max_records: typing.Optional[int] = None):
+        self.started_at = time.monotonic()
+        self.total = None  # The number of queue moves, when it is known
+        self.in_flight = 0
+        self.moved = 0
+        self.failed = 0
+        self.polls = 0
+        self.synchronized_bytes = 0
+        self.queues = collections.deque(maxlen=max_records)
+        self.failures = collections.deque(maxlen=max_records)
+        self.requests = {}  # (method, endpoint) -> Histogram
+        self.phases = {}  # (phase, node) -> Histogram
+        self._lock = threading.Lock()
+
+    def move_started(self) -> typing.NoReturn:
+        with self._lock:
+            self.in_flight += 1
+
+    def move_abandoned(self) -> typing.NoReturn:
+        """Record a started queue move that will not finish"""
+        with self._lock:
+            self.in_flight -= 1
+            if self.total is not None:
+                self.total -= 1
+
+    def move_failed(self, queue: dict, destination: str,
+                    phase: str) -> typing.NoReturn:
+        """Record a queue move that was rolled back after the phase timed
+        out, removing it from the total.
+
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if self.total is not None:
+                self.total -= 1
+            self.failed += 1
+            self.failures.append({
+                'vhost': queue.get('vhost'),
+                'name': queue['name'],
+                'source': queue.get('node'),
+                'destination': destination,
+                'phase': phase})
+
+    def move_finished(self, queue: dict, destination: str,
+                      sync_seconds: float, move_seconds: float,
+                      polls: int) -> typing.NoReturn:
+        """Record the timing of a queue move"""
+        message_bytes = queue.get('message_bytes') or 0
+        if not sync_seconds:
+            message_bytes = 0  # Only synchronized bytes are counted
+        with self._lock:
+            self.in_flight -= 1
+            self.moved += 1
+            self.polls += polls
+            self.synchronized_bytes += message_bytes
+            self.queues.append({
+                'vhost': queue.get('vhost'),
+                'name': queue['name'],
+                'source': queue.get('node'),
+                'destination': destination,
+                'sync_seconds': round(sync_seconds, 3),
+                'move_seconds': round(move_seconds, 3),
+                'polls': polls,
+                'bytes': message_bytes})
+            for phase, value in [('sync', sync_seconds),
+                                 ('move', move_seconds)]:
+                if phase == 'sync' and not value:
+                    continue
+                key = phase, destination
+                if key not in self.phases:
+                    self.phases[key] = Histogram(PHASE_BUCKETS)
+                self.phases[key].observe(value)
+
+    def move_skipped(self, count: int = 1) -> typing.NoReturn:
+        """Remove planned moves that will not be made from the total"""
+        with self._lock:
+            if self.total is not None:
+                self.total -= count
+
+    def progress(self) -> str:
+        """Return a progress line with the estimated time remaining"""
+        with self._lock:
+            completed, in_flight = self.moved, self.in_flight
+            failed = self.failed
+        elapsed = time.monotonic() - self.started_at
+        line = '{} queues moved, {} in flight, {:.1f}s elapsed'.format(
+            completed, in_flight, elapsed)
+        if failed:
+            line += ', {} failed'.format(failed)
+        if self.total is not None and completed:
+            remaining = max(self.total - completed, 0)
+            line += ', {}/{} ({:.0%}), ETA {:.0f}s'.format(
+                completed, self.total, completed / self.total,
+                elapsed / completed * remaining)
+        return line
+
+    def response_hook(self, response: requests.Response,
+                      *_args, **_kwargs) -> typing.NoReturn:
+        """Session response hook that records the request latency"""
+        key = response.request.method, _endpoint(response.request.path_url)
+        with self._lock:
+            if key not in self.requests:
+                self.requests[key] = Histogram(HTTP_BUCKETS)
+            self.requests[key].observe(response.elapsed.total_seconds())
+
+    def totals(self) -> dict:
+        """Return the number of queues moved, in flight and failed, the
+        planned number of moves when it is known, and the bytes synchronized.
+
+        """
+        with self._lock:
+            return {'moved': self.moved,
+                    'in_flight': self.in_flight,
+                    'failed': self.failed,
+                    'total': self.total,
+                    'synchronized_bytes': self.synchronized_bytes,
+                    'elapsed': round(time.monotonic() - self.started_at, 3)}
+
+    def write(self, path: str, output_format: str = 'json') \
+            -> typing.NoReturn:
+        """Atomically write the metrics to the file at ``path``"""
+        with self._lock:
+            if output_format == 'prometheus':
+                content = self._prometheus()
+            else:
+                content = json.dumps(self._summary(), indent=2)
+            with files.atomic_writer(path) as handle:
+                handle.write(content)
+
+    def _prometheus(self) -> str:
+        lines = [
+            '# TYPE {}_queue_moves_total counter'.format(PREFIX),
+            '{}_queue_moves_total {}'.format(PREFIX, self.moved),
+            '# TYPE {}_queue_move_failures_total counter'.format(PREFIX),
+            '{}_queue_move_failures_total {}'.format(PREFIX, self.failed),
+            '# TYPE {}_queue_polls_total counter'.format(PREFIX),
+            '{}_queue_polls_total {}'.format(PREFIX, self.polls),
+            '# TYPE {}_synchronized_bytes_total counter'.format(PREFIX),
+            '{}_synchronized_bytes_total {}'.format(
+                PREFIX, self.synchronized_bytes),
+            '# TYPE {}_queue_phase_seconds histogram'.format(PREFIX)]
+        for (phase, node), histogram in sorted(self.phases.items()):
+            lines += histogram.prometheus(
+                '{}_queue_phase_seconds'.format(PREFIX),
+                'phase="{}",node="{}"'.format(phase, node))
+        lines.append('# TYPE {}_http_request_duration_seconds '
+                     'histogram'.format(PREFIX))
+        for (method, endpoint), histogram in sorted(self.requests.items()):
+            lines += histogram.prometheus(
+                '{}_http_request_duration_seconds'.format(PREFIX),
+                'method="{}",endpoint="{}"'.format(method, endpoint))
+        return '\n'.join(lines) + '\n'
+
+    def _summary(self) -> dict:
+        return {
+            'elapsed': time.monotonic() - self.started_at,
+            'moved': self.moved,
+            'failed': self.failed,
+            'queues': list(self.queues),
+            'failures': list(self.failures),
+            'phases': {'{} {}'.format(*key): value.as_dict()
+                       for key, value in sorted(self.phases.items())},
+            'requests': {'{} {}'.format(*key): value.as_dict()
+                         for key, value in sorted(self.requests.items())}}
+
+
+def _endpoint(path: str) -> str:
+    """Return the management API endpoint for the request path, replacing
+    the vhost, queue and policy names with ``*``.
+
+    """
+    segments = path.split('?')[0].split('/')
+    return '/'.join(segments[:3] + ['*' for _segment in segments[3:]])
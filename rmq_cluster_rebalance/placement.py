@@ -0,0 +1,165 @@
+"""
+Queue placement index
+
+Keeps a compact record of the placement of each queue in the cluster, with
+the total weight of the queues on each node. The totals are updated with the
+queues that changed between refreshes and as queue moves finish, instead of
+being recalculated from every queue, so the load of the nodes can be queried
+in O(nodes).
+
+"""
+import json
+import sys
+import threading
+import typing
+
+from . import planner
+
+KEYS = frozenset(['vhost', 'name', 'type', 'node',
+                  'synchronised_slave_nodes', 'members',
+                  'effective_policy_definition', 'message_bytes', 'memory'])
+
+_definitions = {}  # JSON -> the shared policy definition
+
+
+class QueueRecord:
+    """The fields of a queue that are used to plan and batch its move, with
+    interned node names and policy definitions. Records can be read like
+    the management API representation of the queue they were made from.
+
+    """
+    __slots__ = ['vhost', 'name', 'type', 'node', 'synchronised_slave_nodes',
+                 'members', 'effective_policy_definition', 'message_bytes',
+                 'memory', 'publish_rate', 'deliver_rate']
+
+    def __init__(self, vhost: str, name: str, queue_type: str, node: str,
+                 synchronised: typing.Iterable[str] = (),
+                 members: typing.Optional[typing.Iterable[str]] = None,
+                 definition: typing.Optional[dict] = None,
+                 message_bytes: int = 0, memory: int = 0,
+                 publish_rate: float = 0.0, deliver_rate: float = 0.0):
+        self.vhost = sys.intern(vhost) if vhost is not None else None
+        self.name = name
+        self.type = sys.intern(queue_type)
+        self.node = sys.intern(node)
+        self.synchronised_slave_nodes = tuple(
+            sys.intern(n) for n in synchronised)
+        self.members = (tuple(sys.intern(n) for n in members)
+                        if members is not None else None)
+        self.effective_policy_definition = _shared(definition)
+        self.message_bytes = message_bytes
+        self.memory = memory
+        self.publish_rate = publish_rate
+        self.deliver_rate = deliver_rate
+
+    @classmethod
+    def from_queue(cls, queue: dict) -> 'QueueRecord':
+        """Return the record for a queue from the management API"""
+        return cls(queue.get('vhost'), queue['name'],
+                   queue.get('type') or 'classic', queue['node'],
+                   queue.get('synchronised_slave_nodes') or (),
+                   queue.get('members'),
+                   queue.get('effective_policy_definition'),
+                   queue.get('message_bytes') or 0, queue.get('memory') or 0,
+                   planner.WEIGHTS['publish_rate'](queue),
+                   planner.WEIGHTS['deliver_rate'](queue))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys()
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if key == 'message_stats':
+            return {'publish_details': {'rate': self.publish_rate},
+                    'deliver_get_details': {'rate': self.deliver_rate}}
+        if key not in KEYS or (key == 'members' and self.members is None):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: typing.Any = None) -> typing.Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> typing.List[str]:
+        """Return the keys of the management API representation"""
+        keys = [key for key in self.__slots__ if key in KEYS]
+        if self.members is None:
+            keys.remove('members')
+        return keys + ['message_stats']
+
+
+class Index:
+    """The records of the queues in the cluster, keyed by vhost and name,
+    and the total weight of the queues on each node.
+
+    """
+    def __init__(self, weight: str = 'count'):
+        self.weigh = planner.WEIGHTS[weight]
+        self.queues = {}  # (vhost, name) -> QueueRecord
+        self.loads = {}  # node -> total weight
+        self._lock = threading.Lock()
+
+    def loads_for(self, nodes: typing.List[str]) -> typing.Dict[str, float]:
+        """Return the loads of the nodes, including the empty ones"""
+        return {node: self.loads.get(node, 0) for node in nodes}
+
+    def most_loaded(self, nodes: typing.List[str]) -> str:
+        return max(nodes, key=lambda node: self.loads.get(node, 0))
+
+    def move(self, queue: dict, destination: str) -> typing.NoReturn:
+        """Record that a queue move finished, if the queue is indexed"""
+        key = queue.get('vhost'), queue['name']
+        with self._lock:
+            record = self.queues.get(key)
+            if record is None:
+                return
+            self._add(record, -1)
+            record.node = sys.intern(destination)
+            record.synchronised_slave_nodes = ()
+            self._add(record, 1)
+
+    def skew(self, nodes: typing.List[str]) -> float:
+        return planner.skew(self.loads_for(nodes))
+
+    def update(self, queues: typing.Iterable[dict]) -> int:
+        """Replace the index with the current queues, returning the number
+        of queues that were added, moved, resized or removed.
+
+        """
+        seen, changed = set(), 0
+        for queue in queues:
+            record = QueueRecord.from_queue(queue)
+            key = record.vhost, record.name
+            seen.add(key)
+            with self._lock:
+                previous = self.queues.get(key)
+                self.queues[key] = record
+                if previous is not None:
+                    if (previous.node == record.node and
+                            previous.message_bytes == record.message_bytes
+                            and self.weigh(previous) == self.weigh(record)):
+                        continue
+                    self._add(previous, -1)
+                self._add(record, 1)
+            changed += 1
+        with self._lock:
+            for key in [key for key in self.queues if key not in seen]:
+                self._add(self.queues.pop(key), -1)
+                changed += 1
+        return changed
+
+    def _add(self, record: QueueRecord, sign: int) -> typing.NoReturn:
+        node = record.node
+        self.loads[node] = self.loads.get(node, 0) + sign * self.weigh(record)
+
+
+def _shared(definition: typing.Optional[dict]) -> typing.Optional[dict]:
+    """Return a shared copy of the policy definition, as most queues have
+    the same definition as many others.
+
+    """
+    if definition is None:
+        return None
+    key = json.dumps(definition, sort_keys=True)
+    return _definitions.setdefault(key, definition)
@@ -0,0 +1,266 @@
+"""
+Queue assignment planning
+
+Computes the target node for queues from a snapshot of the queues in a vhost,
+either in turn, moving as few queues as possible to balance the load across
+the nodes, or moving queues to the node their consumers are connected to or
+that already has a copy of them as far as the balance allows.
+
+"""
+import bisect
+import itertools
+import math
+import typing
+
+
+Key = typing.Tuple[str, str]  # vhost, name
+
+
+class Move(typing.NamedTuple):
+    """A queue that is to be moved to the destination node"""
+    queue: dict
+    destination: str
+
+
+def _rate(queue: dict, key: str) -> float:
+    details = (queue.get('message_stats') or {}).get(key) or {}
+    return details.get('rate') or 0.0
+
+
+WEIGHTS = {
+    'count': lambda queue: 1,
+    'message_bytes': lambda queue: queue.get('message_bytes') or 0,
+    'memory': lambda queue: queue.get('memory') or 0,
+    'publish_rate': lambda queue: _rate(queue, 'publish_details'),
+    'deliver_rate': lambda queue: _rate(queue, 'deliver_get_details')
+}
+
+
+def mirror_nodes(queue: dict) -> typing.Sequence[str]:
+    """Return the nodes a queue can be moved to without synchronizing it:
+    the nodes with a synchronised mirror of a classic queue, or the other
+    members of a quorum queue.
+
+    """
+    if queue.get('type') == 'quorum':
+        return [node for node in queue.get('members') or []
+                if node != queue['node']]
+    return queue.get('synchronised_slave_nodes') or []
+
+
+def mirrored(queues: typing.Iterable[dict],
+             nodes: typing.List[str],
+             tolerance: int = 1) -> typing.List[Move]:
+    """Return the moves that leave an even share of the queues on each
+    node, moving each queue above the share of its node to a node with a
+    copy of it from ``mirror_nodes`` as long as that node has no more
+    than ``tolerance`` queues above the share, or else to the node with
+    the fewest queues.
+
+    The queues without a copy on another node are the first to stay on
+    their node, and the queues with the fewest copies are the first to be
+    moved, so that as many moves as possible skip the HA sync. A queue is
+    only moved to a node that ends up with fewer queues than the node it
+    leaves had, and queues are moved from the nodes above the share until
+    none has more than one queue more than the node with the fewest, so
+    planning again after the moves does not move any more queues.
+
+    """
+    queues = sorted(queues, key=lambda queue: len(mirror_nodes(queue)))
+    share = math.ceil(len(queues) / len(nodes)) if nodes else 0
+    counts = dict.fromkeys(nodes, 0)
+    placed = {node: [] for node in nodes}  # node -> queues it ends with
+    for queue in queues:
+        if queue['node'] in counts:
+            counts[queue['node']] += 1
+    kept = dict.fromkeys(nodes, 0)
+    destinations = {}  # key -> the destination of the moved queues
+    for queue in queues:
+        source = queue['node']
+        if kept.get(source, share) < share:
+            kept[source] += 1
+            placed[source].append(queue)
+            continue
+        limit = counts.get(source, math.inf) - 1  # Ends below the source
+        mirrors = [node for node in mirror_nodes(queue)
+                   if node != source and node in counts and
+                   counts[node] < min(share + tolerance, limit)]
+        destination = min(mirrors or nodes, key=lambda n: counts[n])
+        if source in counts and counts[destination] >= limit:
+            placed[source].append(queue)
+            continue
+        if source in counts:
+            counts[source] -= 1
+        counts[destination] += 1
+        placed[destination].append(queue)
+        destinations[queue_key(queue)] = destination
+    while len(nodes) > 1:
+        source = max(nodes, key=lambda n: counts[n])
+        destination = min(nodes, key=lambda n: counts[n])
+        if counts[source] <= share or \
+                counts[destination] + 1 >= counts[source]:
+            break
+        offset = next((offset for offset, queue in enumerate(placed[source])
+                       if destination in mirror_nodes(queue)), -1)
+        queue = placed[source].pop(offset)
+        counts[source] -= 1
+        counts[destination] += 1
+        placed[destination].append(queue)
+        destinations[queue_key(queue)] = destination
+    return [Move(queue, destinations[queue_key(queue)]) for queue in queues
+            if destinations.get(queue_key(queue), queue['node']) !=
+            queue['node']]
+
+
+def node_loads(queues: typing.Iterable[dict],
+               nodes: typing.List[str],
+               weight: str = 'count') -> typing.Dict[str, float]:
+    """Return the total weight of the queues on each node"""
+    weigh = WEIGHTS[weight]
+    loads = dict.fromkeys(nodes, 0)
+    for queue in queues:
+        loads[queue['node']] = loads.get(queue['node'], 0) + weigh(queue)
+    return loads
+
+
+def locality(queues: typing.Iterable[dict],
+             nodes: typing.List[str],
+             preferred: typing.Dict[Key, str],
+             weight: str = 'count',
+             max_skew: float = 0.1) -> typing.List[Move]:
+    """Return the moves that place queues on their ``preferred`` node,
+    keyed by vhost and name, followed by the ``plan`` moves of the
+    other queues that balance the load around them.
+
+    The heaviest queues are placed first, as they gain the most from being
+    on the node their clients are connected to, and queues of the same
+    weight that are already on their preferred node are kept first. Queues
+    are placed until they would take a node more than ``max_skew`` above
+    the average node load, though each node takes at least one queue.
+
+    """
+    weigh = WEIGHTS[weight]
+    queues = list(queues)
+    limit = (sum(weigh(queue) for queue in queues) / len(nodes) *
+             (1 + max_skew))
+    reserved = dict.fromkeys(nodes, 0)
+    moves, kept = [], set()
+    by_key = {queue_key(queue): queue for queue in queues}
+    order = sorted(queues, reverse=True, key=lambda queue: (
+        weigh(queue), queue['node'] == preferred.get(queue_key(queue))))
+    for queue in order:
+        key = queue_key(queue)
+        node = preferred.get(key)
+        if node not in reserved or (
+                reserved[node] and reserved[node] + weigh(queue) > limit):
+            continue
+        reserved[node] += weigh(queue)
+        kept.add(key)
+        if queue['node'] != node:
+            moves.append(Move(queue, node))
+            by_key[key] = dict(queue, node=node)
+    return moves + plan(by_key.values(), nodes, weight, max_skew, kept)
+
+
+def plan(queues: typing.Iterable[dict],
+         nodes: typing.List[str],
+         weight: str = 'count',
+         max_skew: typing.Optional[float] = None,
+         pinned: typing.Optional[typing.Set[Key]] = None) \
+        -> typing.List[Move]:
+    """Return the moves that balance the weight of the queues across the
+    nodes, moving each queue at most once. Queues are identified by their
+    vhost and name, so queues from multiple vhosts can be planned together.
+
+    Queues on nodes that are not in ``nodes`` are always moved, to the least
+    loaded node. After that, the queue that brings the most and least loaded
+    nodes closest to each other is moved from the most loaded to the least
+    loaded node until no move would reduce the difference between them, or
+    until the ``skew`` is no more than ``max_skew`` when it is set.
+    The ``pinned`` queues count towards the load but are not moved, so
+    queues are moved from the most loaded node that has others.
+
+    """
+    weigh = WEIGHTS[weight]
+    loads = dict.fromkeys(nodes, 0)
+    candidates = {node: [] for node in nodes}
+    orphans, by_key = [], {}
+    for queue in queues:
+        if queue['node'] not in loads:
+            orphans.append(queue)
+            continue
+        value = weigh(queue)
+        loads[queue['node']] += value
+        key = queue_key(queue)
+        by_key[key] = queue
+        if value > 0 and (pinned is None or key not in pinned):
+            candidates[queue['node']].append((value, key))
+    for node in nodes:
+        candidates[node].sort()
+
+    moves = []
+    for queue in sorted(orphans, key=weigh, reverse=True):
+        destination = min(nodes, key=lambda n: loads[n])
+        loads[destination] += weigh(queue)
+        moves.append(Move(queue, destination))
+
+    while len(nodes) > 1:
+        if max_skew is not None and skew(loads) <= max_skew:
+            break
+        sources = [node for node in nodes if candidates[node]]
+        if not sources:
+            break
+        source = max(sources, key=lambda n: loads[n])
+        destination = min(nodes, key=lambda n: loads[n])
+        gap = loads[source] - loads[destination]
+        offset = _best_candidate(candidates[source], gap)
+        if offset is None:
+            break
+        value, key = candidates[source].pop(offset)
+        loads[source] -= value
+        loads[destination] += value
+        moves.append(Move(by_key[key], destination))
+    return moves
+
+
+def queue_key(queue: dict) -> Key:
+    """Return the vhost and name that identify a queue"""
+    return queue.get('vhost', ''), queue['name']
+
+
+def round_robin(queues: typing.Iterable[dict],
+                nodes: typing.List[str]) -> typing.Iterator[Move]:
+    """Assign the nodes to the queues in turn, returning the moves for
+    the queues that are not already on their assigned node.
+
+    """
+    for queue, node in zip(queues, itertools.cycle(nodes)):
+        if queue['node'] != node:
+            yield Move(queue, node)
+
+
+def skew(loads: typing.Dict[str, float]) -> float:
+    """Return the difference between the most and least loaded nodes as a
+    ratio of the average load.
+
+    """
+    if not loads:
+        return 0.0
+    mean = sum(loads.values()) / len(loads)
+    if not mean:
+        return 0.0
+    return (max(loads.values()) - min(loads.values())) / mean
+
+
+def _best_candidate(candidates: typing.List[typing.Tuple[float, tuple]],
+                    gap: float) -> typing.Optional[int]:
+    """Return the offset of the candidate whose weight is closest to half of
+    the gap, provided that moving it reduces the gap.
+
+    """
+    offset = bisect.bisect_left(candidates, (gap / 2,))
+    options = [o for o in (offset - 1, offset)
+               if 0 <= o < len(candidates) and candidates[o][0] < gap]
+    if not options:
+        return None
+    return min(options, key=lambda o: abs(candidates[o][0] - gap / 2))
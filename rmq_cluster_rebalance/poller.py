@@ -0,0 +1,101 @@
+"""
+Shared queue state polling
+
+Threads that wait on the state of queues share bulk listing requests instead
+of each requesting its own queue. A thread that needs fresh state either
+performs the next request, for every queue that is being waited on, or waits
+for the one that is about to be made, so the number of requests depends on
+the poll interval and not on the number of queues being moved.
+
+"""
+import threading
+import time
+import typing
+
+Key = typing.Tuple[str, str]  # vhost, name
+
+
+class Poller:
+    """Returns the current state of queues, requesting the state of all of
+    the queues being waited on with ``fetch(vhost, names)`` at most once
+    every ``interval`` seconds.
+
+    """
+    def __init__(self,
+                 fetch: typing.Callable[[str, typing.List[str]],
+                                        typing.Iterable[dict]],
+                 interval: float):
+        self.fetch = fetch
+        self.interval = interval
+        self.generation = 0  # The number of completed fetches
+        self.requested_at = None  # Monotonic time of the last fetch
+        self.states = {}  # (vhost, name) -> queue, or None if missing
+        self.wanted = {}  # (vhost, name) -> number of waiting threads
+        self._collecting = False  # A fetch is waiting for the interval
+        self._fetching = False
+        self._condition = threading.Condition()
+
+    def get(self, vhost: str, name: str) -> typing.Optional[dict]:
+        """Return the state of the queue from a request that was made after
+        this call, or ``None`` if the queue does not exist.
+
+        """
+        return self.get_many([(vhost, name)])[vhost, name]
+
+    def get_many(self, keys: typing.List[Key]) \
+            -> typing.Dict[Key, typing.Optional[dict]]:
+        """Return the state of the queues from a single request that was
+        made after this call.
+
+        """
+        with self._condition:
+            for key in keys:
+                self.wanted[key] = self.wanted.get(key, 0) + 1
+            try:
+                target = self.generation + 1
+                if self._fetching and not self._collecting:
+                    target += 1  # The fetch in progress may not include keys
+                while self.generation < target:
+                    if self._fetching:
+                        self._condition.wait()
+                    else:
+                        self._fetch()
+                return {key: self.states.get(key) for key in keys}
+            finally:
+                for key in keys:
+                    self.wanted[key] -= 1
+                    if not self.wanted[key]:
+                        del self.wanted[key]
+                        self.states.pop(key, None)
+
+    def _fetch(self) -> typing.NoReturn:
+        """Request the state of the wanted queues, called with the condition
+        held. Other threads may register the queues they want while waiting
+        for the interval to elapse.
+
+        """
+        self._fetching = self._collecting = True
+        try:
+            while self.requested_at is not None:
+                delay = self.requested_at + self.interval - time.monotonic()
+                if delay <= 0:
+                    break
+                self._condition.wait(delay)
+            self._collecting = False
+            self.requested_at = time.monotonic()
+            names, states = {}, {}
+            for vhost, name in self.wanted:
+                names.setdefault(vhost, []).append(name)
+                states[vhost, name] = None
+            self._condition.release()
+            try:
+                for vhost in sorted(names):
+                    for queue in self.fetch(vhost, names[vhost]):
+                        states[vhost, queue['name']] = queue
+            finally:
+                self._condition.acquire()
+            self.states.update(states)
+            self.generation += 1
+        finally:
+            self._fetching = self._collecting = False
+            self._condition.notify_all()
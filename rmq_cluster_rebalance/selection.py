@@ -0,0 +1,84 @@
+"""
+Queue selection
+
+Decides which queues are rebalanced from their names and attributes, so that
+queues that disappear on their own, such as exclusive, auto-delete and
+transient reply queues, or that do not matter for the balance of the cluster
+are not moved.
+
+"""
+import typing
+
+Pattern = typing.Pattern[str]
+
+
+class Selection:
+    """Matches the queues with a name that matches one of the ``include``
+    patterns, when there are any, and none of the ``exclude`` patterns,
+    with the attributes that are not skipped and at least the minimum
+    message bytes and consumers.
+
+    """
+    def __init__(self,
+                 include: typing.Optional[typing.List[Pattern]] = None,
+                 exclude: typing.Optional[typing.List[Pattern]] = None,
+                 skip_exclusive: bool = False,
+                 skip_auto_delete: bool = False,
+                 skip_transient: bool = False,
+                 min_message_bytes: int = 0,
+                 min_consumers: int = 0):
+        self.include = include or []
+        self.exclude = exclude or []
+        self.skip_exclusive = skip_exclusive
+        self.skip_auto_delete = skip_auto_delete
+        self.skip_transient = skip_transient
+        self.min_message_bytes = min_message_bytes
+        self.min_consumers = min_consumers
+
+    @property
+    def name_pattern(self) -> typing.Optional[str]:
+        """Return a pattern for the management API name filter that matches
+        the included queues, or ``None`` if all of them are included.
+
+        """
+        if not self.include:
+            return None
+        return '|'.join('(?:{})'.format(p.pattern) for p in self.include)
+
+    @property
+    def columns(self) -> typing.List[str]:
+        """Return the queue fields used to select the queues"""
+        columns = []
+        for column, used in [('exclusive', self.skip_exclusive),
+                             ('auto_delete', self.skip_auto_delete),
+                             ('durable', self.skip_transient),
+                             ('message_bytes', self.min_message_bytes),
+                             ('consumers', self.min_consumers)]:
+            if used:
+                columns.append(column)
+        return columns
+
+    @property
+    def needs_stats(self) -> bool:
+        """Return ``True`` if the queue statistics are used"""
+        return bool(self.min_message_bytes or self.min_consumers)
+
+    def reason(self, queue: dict) -> typing.Optional[str]:
+        """Return why the queue is not selected, or ``None`` if it is"""
+        name = queue['name']
+        if self.include and not any(p.search(name) for p in self.include):
+            return 'not included'
+        for pattern in self.exclude:
+            if pattern.search(name):
+                return 'excluded by {}'.format(pattern.pattern)
+        if self.skip_exclusive and queue.get('exclusive'):
+            return 'exclusive'
+        if self.skip_auto_delete and queue.get('auto_delete'):
+            return 'auto-delete'
+        if self.skip_transient and not queue.get('durable', True):
+            return 'transient'
+        if (queue.get('message_bytes') or 0) < self.min_message_bytes:
+            return 'below the minimum message bytes'
+        if (queue.get('consumers') or 0) < self.min_consumers:
+            return 'below the minimum consumers'
+        return None
@@ -0,0 +1,161 @@
+"""
+Offline snapshots and plans
+
+Snapshots record the nodes, policies and a compact list of the queues in a
+cluster so that moves can be planned without access to it. Both snapshots
+and plans are written as JSON lines: a header object followed by one array
+per queue, so they can be written and read while streaming the queues.
+
+"""
+import contextlib
+import datetime
+import json
+import typing
+
+from . import files, placement, planner
+
+PLAN_FORMAT = 'rmq-cluster-rebalance-plan'
+SNAPSHOT_COLUMNS = ['vhost', 'name', 'type', 'node',
+                    'synchronised_slave_nodes', 'members', 'message_bytes',
+                    'memory', 'publish_rate', 'deliver_rate']
+SNAPSHOT_FORMAT = 'rmq-cluster-rebalance-snapshot'
+
+
+class Snapshot(typing.NamedTuple):
+    """The state of a cluster read from a snapshot file"""
+    nodes: typing.List[str]
+    vhosts: typing.List[str]
+    policies: typing.List[dict]
+    queues: typing.List[placement.QueueRecord]
+
+
+def compact(queue: dict) -> list:
+    """Return the snapshot row for a queue from the management API"""
+    stats = queue.get('message_stats') or {}
+    return [queue.get('vhost'), queue['name'], queue.get('type', 'classic'),
+            queue['node'], queue.get('synchronised_slave_nodes') or [],
+            queue.get('members'), queue.get('message_bytes') or 0,
+            queue.get('memory') or 0,
+            (stats.get('publish_details') or {}).get('rate') or 0.0,
+            (stats.get('deliver_get_details') or {}).get('rate') or 0.0]
+
+
+def expand(row: list) -> placement.QueueRecord:
+    """Return the queue record for a snapshot row"""
+    (vhost, name, queue_type, node, synchronised, members, message_bytes,
+     memory, publish_rate, deliver_rate) = row
+    return placement.QueueRecord(
+        vhost, name, queue_type, node, synchronised, members, None,
+        message_bytes, memory, publish_rate, deliver_rate)
+
+
+def read(path: str) -> Snapshot:
+    """Read the snapshot file, raising ``ValueError`` if it is not a
+    snapshot.
+
+    """
+    with open(path) as handle:
+        header = _header(handle, SNAPSHOT_FORMAT)
+        return Snapshot(header['nodes'], header['vhosts'],
+                        header['policies'],
+                        [expand(json.loads(line)) for line in handle])
+
+
+def read_plan(path: str) -> typing.List[list]:
+    """Return the ``[vhost, name, destination]`` entries of the plan file,
+    raising ``ValueError`` if it is not a plan.
+
+    """
+    with open(path) as handle:
+        _header(handle, PLAN_FORMAT)
+        return [json.loads(line) for line in handle]
+
+
+def report(queues: typing.List[dict],
+           nodes: typing.List[str],
+           moves: typing.List[planner.Move],
+           needs_sync: typing.Callable[[dict, str], bool]) -> str:
+    """Return a report of the queue count and bytes on each node before
+    and after the moves, with the number of bytes to synchronize.
+
+    """
+    destinations = {(m.queue.get('vhost'), m.queue['name']): m.destination
+                    for m in moves}
+    after = [dict(queue, node=destinations.get(
+        (queue.get('vhost'), queue['name']), queue['node']))
+        for queue in queues]
+    sync_bytes = sum(move.queue.get('message_bytes') or 0 for move in moves
+                     if needs_sync(move.queue, move.destination))
+    width = max([len(node) for node in nodes] + [4])
+    lines = ['{} queues, {} moves, {} bytes to synchronize'.format(
+                len(queues), len(moves), sync_bytes),
+             '',
+             '{:<{}} {:>10} {:>10} {:>16} {:>16}'.format(
+                 'Node', width, 'Queues', 'After', 'Bytes', 'After')]
+    loads = [planner.node_loads(values, nodes, weight)
+             for weight in ['count', 'message_bytes']
+             for values in [queues, after]]
+    for node in sorted(set().union(*loads)):
+        lines.append('{:<{}} {:>10} {:>10} {:>16} {:>16}'.format(
+            node, width, *[load.get(node, 0) for load in loads]))
+    return '\n'.join(lines)
+
+
+def write(path: str,
+          nodes: typing.List[str],
+          vhosts: typing.List[str],
+          policies: typing.List[dict],
+          queues: typing.Iterable[dict]) -> int:
+    """Atomically write a snapshot of the cluster, returning the number of
+    queues written.
+
+    """
+    count = 0
+    with _writer(path, {'format': SNAPSHOT_FORMAT,
+                        'nodes': nodes,
+                        'vhosts': vhosts,
+                        'policies': policies,
+                        'columns': SNAPSHOT_COLUMNS}) as handle:
+        for queue in queues:
+            handle.write(json.dumps(compact(queue),
+                                    separators=(',', ':')) + '\n')
+            count += 1
+    return count
+
+
+def write_plan(path: str, moves: typing.Iterable[planner.Move],
+               **kwargs) -> typing.NoReturn:
+    """Atomically write the moves to a plan file, with the keyword
+    arguments in its header.
+
+    """
+    with _writer(path, dict(kwargs, format=PLAN_FORMAT)) as handle:
+        for move in moves:
+            handle.write(json.dumps(
+                [move.queue.get('vhost'), move.queue['name'],
+                 move.destination], separators=(',', ':')) + '\n')
+
+
+def _header(handle: typing.TextIO, expectation: str) -> dict:
+    try:
+        header = json.loads(handle.readline())
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('format') != expectation:
+        raise ValueError('{} is not a {} file'.format(
+            handle.name, expectation))
+    return header
+
+
+@contextlib.contextmanager
+def _writer(path: str, header: dict) \
+        -> typing.Generator[typing.TextIO, None, None]:
+    """Write to a temporary file with the header, replacing the file at
+    ``path`` with it when the context exits without an error.
+
+    """
+    header = dict(header, created_at=datetime.datetime.now(
+        datetime.timezone.utc).isoformat())
+    with files.atomic_writer(path) as handle:
+        handle.write(json.dumps(header) + '\n')
+        yield handle
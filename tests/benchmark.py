@@ -0,0 +1,116 @@
+"""
+Rebalance benchmark
+
+Measures the wall time, management API request count and peak memory of
+``Rebalance.run()`` against the fake management API for clusters with
+different numbers of queues. Arguments after ``--`` are passed to the
+rebalance CLI argument parser, so strategies and options can be compared:
+
+    python -m tests.benchmark --queues 1000 10000 -- --strategy min-moves
+
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+import typing
+
+from tests import fake_api
+
+from rmq_cluster_rebalance import __main__
+
+DEFAULT_ARGS = ['--min-poll-interval', '0.001', '--max-poll-interval', '1',
+                '--status-interval', '0.001']
+QUEUE_COUNTS = [1000, 10000, 100000]
+
+
+def benchmark(queue_count: int,
+              rebalance_args: typing.List[str],
+              nodes: int = 3,
+              seed: int = 0,
+              sync_rate: float = fake_api.SYNC_RATE,
+              trace_memory: bool = True) -> dict:
+    """Run a rebalance of ``queue_count`` queues that are unevenly placed
+    across the nodes, returning the measurements.
+
+    """
+    api = fake_api.FakeManagementAPI(
+        ['rabbit@rabbit{}'.format(n + 1) for n in range(nodes)],
+        sync_rate).start()
+    generator = random.Random(seed)
+    weights = [2 ** (nodes - n) for n in range(nodes)]
+    for offset in range(queue_count):
+        api.add_queue(
+            'queue-{:06d}'.format(offset),
+            generator.choices(api.nodes, weights)[0],
+            message_bytes=int(generator.lognormvariate(8, 2)))
+    before = api.placement()
+    args = __main__.parse_cli_arguments(
+        DEFAULT_ARGS + rebalance_args + [api.url])
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        __main__.Rebalance(args).run()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        api.stop()
+    after = api.placement()
+    return {
+        'queues': queue_count,
+        'moves': sum(1 for name in before if before[name] != after[name]),
+        'seconds': round(elapsed, 3),
+        'requests': api.request_count,
+        'peak_memory': peak,
+        'distribution': {node: list(after.values()).count(node)
+                         for node in api.nodes}}
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> typing.NoReturn:
+    argv = sys.argv[1:] if argv is None else argv
+    rebalance_args = []
+    if '--' in argv:
+        offset = argv.index('--')
+        argv, rebalance_args = argv[:offset], argv[offset + 1:]
+    parser = argparse.ArgumentParser(
+        'python -m tests.benchmark',
+        description='Benchmark rmq-cluster-rebalance with a fake cluster',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--queues', type=int, nargs='+', default=QUEUE_COUNTS,
+                        help='The queue counts to benchmark')
+    parser.add_argument('--nodes', type=int, default=3,
+                        help='The number of nodes in the fake cluster')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The random seed for queue placement and size')
+    parser.add_argument('--sync-rate', type=float, default=fake_api.SYNC_RATE,
+                        help='The simulated HA sync rate in bytes per second')
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help='Do not trace memory allocations, which slows '
+                             'down the benchmark')
+    parser.add_argument('--json', action='store_true',
+                        help='Output the results as JSON')
+    args = parser.parse_args(argv)
+    results = []
+    for queue_count in args.queues:
+        result = benchmark(queue_count, rebalance_args, args.nodes,
+                           args.seed, args.sync_rate,
+                           not args.no_trace_memory)
+        results.append(result)
+        if not args.json:
+            sys.stdout.write(
+                '{queues:>8} queues {moves:>8} moves {seconds:>10.2f}s '
+                '{requests:>9} requests {memory:>10} peak memory\n'.format(
+                    memory='{:.1f}MB'.format(result['peak_memory'] / 2**20)
+                    if result['peak_memory'] is not None else '-',
+                    **result))
+    if args.json:
+        sys.stdout.write(json.dumps(results, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
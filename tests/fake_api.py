@@ -0,0 +1,436 @@
+"""
+In-process stand-in for the RabbitMQ management API
+
+Simulates the nodes, vhosts, policies, classic mirrored queues and quorum
+queues of a cluster, including policy evaluation, HA mirror placement,
+synchronization that takes time in proportion to the queue size, master
+migration, and quorum queue membership changes and leader elections.
+Queue state is reconciled with the effective policy when it is read, so
+applying a policy does not require evaluating every queue in the vhost.
+
+"""
+import http.server
+import json
+import math
+import random
+import re
+import threading
+import time
+import typing
+from urllib import parse
+
+NODES = ['rabbit@rabbit1', 'rabbit@rabbit2', 'rabbit@rabbit3']
+POLL_INTERVAL = 0.01  # Seconds between checks for a server shutdown
+SYNC_RATE = 1024 ** 3  # Bytes per second
+
+
+class Queue:
+    """A simulated classic or quorum queue. The node of a quorum queue is
+    its leader.
+
+    """
+    __slots__ = ['name', 'vhost', 'node', 'type', 'mirrors', 'members',
+                 'message_bytes', 'arguments', 'auto_delete', 'consumers',
+                 'consumer_nodes', 'durable', 'exclusive', 'pinned']
+
+    def __init__(self, name: str, vhost: str, node: str,
+                 message_bytes: int = 0, **kwargs):
+        self.name = name
+        self.vhost = vhost
+        self.node = node
+        self.type = kwargs.get('queue_type', 'classic')
+        self.mirrors = {}  # node -> monotonic time the mirror is synced
+        self.members = {}  # node -> monotonic time the replica is online
+        for member in kwargs.get('members', [node]):
+            self.members[member] = 0.0
+        self.message_bytes = message_bytes
+        self.arguments = kwargs.get('arguments', {})
+        self.auto_delete = kwargs.get('auto_delete', False)
+        # The node the channel of each consumer is connected to
+        self.consumer_nodes = kwargs.get('consumer_nodes', [])
+        self.consumers = kwargs.get('consumers', len(self.consumer_nodes))
+        self.durable = kwargs.get('durable', True)
+        self.exclusive = kwargs.get('exclusive', False)
+        self.pinned = kwargs.get('pinned', False)  # The master never moves
+
+
+class FakeManagementAPI:
+    """Serves the simulated cluster over HTTP on a local port"""
+
+    def __init__(self, nodes: typing.Optional[typing.List[str]] = None,
+                 sync_rate: float = SYNC_RATE):
+        self.nodes = list(nodes or NODES)
+        self.sync_rate = sync_rate
+        self.vhosts = {'/': {}}  # vhost -> {name: Queue}
+        self.policies = {'/': {}}  # vhost -> {name: policy}
+        self.node_stats = {node: {} for node in self.nodes}
+        self.overview = {'message_stats': {}}
+        self.requests = {}  # (method, endpoint) -> count
+        self.channel_nodes = True  # Include the node in channel details
+        self.policy_times = {}  # (vhost, policy) -> monotonic time applied
+        self.random = random.Random(0)  # Decides the leader elections
+        self.endpoint_requests = {}  # url -> count
+        self.lock = threading.RLock()
+        self.servers = {}  # url -> (server, thread)
+        self.url = None
+
+    @property
+    def request_count(self) -> int:
+        return sum(self.requests.values())
+
+    @property
+    def urls(self) -> typing.List[str]:
+        return list(self.servers)
+
+    def start(self) -> 'FakeManagementAPI':
+        self.url = self.add_endpoint()
+        return self
+
+    def stop(self) -> typing.NoReturn:
+        for url in list(self.servers):
+            self.stop_endpoint(url)
+
+    def add_endpoint(self) -> str:
+        """Serve the cluster on another port, returning its URL"""
+        server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), self._handler())
+        server.daemon_threads = True
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        thread = threading.Thread(target=server.serve_forever,
+                                  args=(POLL_INTERVAL,), daemon=True)
+        thread.start()
+        self.servers[url] = server, thread
+        self.endpoint_requests[url] = 0
+        return url
+
+    def stop_endpoint(self, url: str) -> typing.NoReturn:
+        """Stop serving the cluster at the URL, as if the node is down"""
+        server, thread = self.servers.pop(url)
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    def add_policy(self, vhost: str, name: str, pattern: str,
+                   definition: dict, priority: int = 0) -> typing.NoReturn:
+        with self.lock:
+            self.policies.setdefault(vhost, {})[name] = {
+                'vhost': vhost, 'name': name, 'pattern': pattern,
+                'apply-to': 'queues', 'definition': definition,
+                'priority': priority}
+            self.policy_times[vhost, name] = time.monotonic()
+
+    def add_queue(self, name: str, node: str, vhost: str = '/',
+                  message_bytes: int = 0, **kwargs) -> typing.NoReturn:
+        """Add a queue, passing ``queue_type='quorum'`` and optionally
+        the ``members`` for a quorum queue, ``pinned=True`` for a queue
+        whose master never moves, or the ``consumer_nodes`` its consumers
+        are connected to.
+
+        """
+        with self.lock:
+            self.vhosts.setdefault(vhost, {})
+            self.policies.setdefault(vhost, {})
+            self.vhosts[vhost][name] = Queue(
+                name, vhost, node, message_bytes, **kwargs)
+
+    def delete_queue(self, vhost: str, name: str) -> typing.NoReturn:
+        with self.lock:
+            del self.vhosts[vhost][name]
+
+    def placement(self, vhost: str = '/') -> typing.Dict[str, str]:
+        """Return the master node of each queue in the vhost"""
+        with self.lock:
+            return {name: self.queue(vhost, name)['node']
+                    for name in self.vhosts[vhost]}
+
+    def queue(self, vhost: str, name: str) -> dict:
+        """Return the management API representation of the queue"""
+        with self.lock:
+            queue = self.vhosts[vhost][name]
+            policy = self._effective_policy(queue)
+            now = time.monotonic()
+            if queue.type == 'quorum':
+                value = {
+                    'leader': queue.node,
+                    'members': sorted(queue.members),
+                    'online': sorted(node for node, online
+                                     in queue.members.items()
+                                     if online <= now)}
+            else:
+                self._reconcile(queue, policy)
+                value = {
+                    'slave_nodes': sorted(queue.mirrors),
+                    'synchronised_slave_nodes': sorted(
+                        node for node, synced in queue.mirrors.items()
+                        if synced <= now)}
+            return dict(value, **{
+                'name': queue.name,
+                'vhost': queue.vhost,
+                'type': queue.type,
+                'node': queue.node,
+                'policy': policy['name'] if policy else None,
+                'effective_policy_definition':
+                    dict(policy['definition']) if policy else {},
+                'arguments': queue.arguments,
+                'auto_delete': queue.auto_delete,
+                'consumers': queue.consumers,
+                'durable': queue.durable,
+                'exclusive': queue.exclusive,
+                'message_bytes': queue.message_bytes,
+                'memory': 1024 + queue.message_bytes // 10,
+                'messages': queue.message_bytes // 1024,
+                'message_stats': {'publish_details': {'rate': 0.0},
+                                  'deliver_get_details': {'rate': 0.0}}})
+
+    def _effective_policy(self, queue: Queue) -> typing.Optional[dict]:
+        matches = [p for p in self.policies[queue.vhost].values()
+                   if re.search(p['pattern'], queue.name)]
+        if not matches:
+            return None
+        return max(matches, key=lambda p: (p['priority'], p['name']))
+
+    def _desired_nodes(self, queue: Queue,
+                       policy: typing.Optional[dict]) -> typing.Set[str]:
+        definition = policy['definition'] if policy else {}
+        mode = definition.get('ha-mode')
+        if mode == 'all':
+            return set(self.nodes)
+        elif mode == 'nodes':
+            return set(definition.get('ha-params', []))
+        elif mode == 'exactly':
+            count = int(definition.get('ha-params', 1)) - 1
+            mirrors = sorted(queue.mirrors)[:count]
+            others = [node for node in self.nodes
+                      if node != queue.node and node not in mirrors]
+            return ({queue.node} | set(mirrors) |
+                    set(others[:count - len(mirrors)]))
+        return {queue.node}
+
+    def _reconcile(self, queue: Queue,
+                   policy: typing.Optional[dict]) -> typing.NoReturn:
+        """Update the mirrors and master of the queue for the policy, with
+        new mirrors synchronizing from the time the policy was applied.
+
+        """
+        now = time.monotonic()
+        started = now
+        if policy:
+            started = self.policy_times.get(
+                (queue.vhost, policy['name']), now)
+        desired = self._desired_nodes(queue, policy)
+        for node in desired - {queue.node} - set(queue.mirrors):
+            queue.mirrors[node] = \
+                started + queue.message_bytes / self.sync_rate
+        if queue.node not in desired and not queue.pinned:
+            synced = sorted(node for node, at in queue.mirrors.items()
+                            if at <= now and node in desired)
+            if synced:
+                queue.node = synced[0]
+                del queue.mirrors[queue.node]
+        for node in set(queue.mirrors) - desired:
+            del queue.mirrors[node]
+
+    def _handler(self) -> typing.Type[http.server.BaseHTTPRequestHandler]:
+        api = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            disable_nagle_algorithm = True
+            protocol_version = 'HTTP/1.1'
+
+            def do_DELETE(self):
+                self._dispatch('DELETE')
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PUT(self):
+                self._dispatch('PUT')
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self, method: str):
+                url = parse.urlsplit(self.path)
+                segments = [parse.unquote(s) for s in url.path.split('/')[2:]]
+                query = dict(parse.parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                endpoint = '/'.join(['/api'] + segments[:1] +
+                                    ['*' for _segment in segments[1:]])
+                address = 'http://127.0.0.1:{}'.format(
+                    self.server.server_address[1])
+                with api.lock:
+                    api.requests[method, endpoint] = \
+                        api.requests.get((method, endpoint), 0) + 1
+                    api.endpoint_requests[address] += 1
+                    status, value = api.route(method, segments, query, body)
+                content = json.dumps(value).encode('utf-8') \
+                    if value is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        return Handler
+
+    def route(self, method: str, segments: typing.List[str],
+              query: dict, body: typing.Optional[dict]) \
+            -> typing.Tuple[int, typing.Any]:
+        """Return the status and response body for a request"""
+        resource, args = segments[0], segments[1:]
+        handler = getattr(self, '_{}_{}'.format(method.lower(), resource),
+                          None)
+        if handler is None:
+            return 404, {'error': 'Object Not Found', 'reason': 'Not Found'}
+        return handler(args, query, body)
+
+    def _get_connections(self, args, query, body):
+        nodes = sorted({node for queues in self.vhosts.values()
+                        for queue in queues.values()
+                        for node in queue.consumer_nodes})
+        return 200, [self._project({'name': self._connection_name(node),
+                                    'node': node}, query)
+                     for node in nodes]
+
+    def _get_consumers(self, args, query, body):
+        vhosts = args[:1] or sorted(self.vhosts)
+        consumers = []
+        for vhost in vhosts:
+            for name, queue in sorted(self.vhosts.get(vhost, {}).items()):
+                for offset, node in enumerate(queue.consumer_nodes):
+                    channel = {
+                        'connection_name': self._connection_name(node),
+                        'name': '{} (1)'.format(self._connection_name(node))}
+                    if self.channel_nodes:
+                        channel['node'] = node
+                    consumers.append({
+                        'queue': {'name': name, 'vhost': vhost},
+                        'consumer_tag': 'ctag-{}'.format(offset),
+                        'channel_details': channel})
+        return 200, consumers
+
+    def _get_nodes(self, args, query, body):
+        return 200, [dict({'name': node, 'running': True,
+                           'mem_alarm': False, 'disk_free_alarm': False,
+                           'mem_used': 100, 'mem_limit': 1000,
+                           'fd_used': 10, 'fd_total': 1000},
+                          **self.node_stats[node])
+                     for node in self.nodes]
+
+    def _get_overview(self, args, query, body):
+        return 200, dict(self.overview, listeners=[
+            {'node': 'rabbit@127.0.0.1', 'protocol': 'http',
+             'port': parse.urlsplit(url).port} for url in self.servers])
+
+    def _get_vhosts(self, args, query, body):
+        return 200, [{'name': vhost} for vhost in sorted(self.vhosts)]
+
+    def _get_policies(self, args, query, body):
+        vhosts = args[:1] or sorted(self.policies)
+        return 200, [dict(p) for vhost in vhosts
+                     for p in self.policies.get(vhost, {}).values()]
+
+    def _put_policies(self, args, query, body):
+        vhost, name = args
+        if vhost not in self.policies:
+            return 404, {'error': 'Object Not Found', 'reason': 'Not Found'}
+        if body.get('definition', {}).get('ha-mode') not in (
+                None, 'all', 'nodes', 'exactly'):
+            return 400, {'error': 'bad_request',
+                         'reason': 'Validation failed'}
+        self.add_policy(vhost, name, body['pattern'], body['definition'],
+                        body.get('priority', 0))
+        return 201, None
+
+    def _delete_policies(self, args, query, body):
+        vhost, name = args
+        if name not in self.policies.get(vhost, {}):
+            return 404, {'error': 'Object Not Found', 'reason': 'Not Found'}
+        del self.policies[vhost][name]
+        self.policy_times.pop((vhost, name), None)
+        return 204, None
+
+    def _get_queues(self, args, query, body):
+        if len(args) == 2:
+            vhost, name = args
+            if name not in self.vhosts.get(vhost, {}):
+                return 404, {'error': 'Object Not Found',
+                             'reason': 'Not Found'}
+            return 200, self._project(self.queue(vhost, name), query)
+        vhosts = args[:1] or sorted(self.vhosts)
+        names = [(vhost, name) for vhost in vhosts
+                 for name in sorted(self.vhosts.get(vhost, {}))]
+        if 'name' in query and 'page' in query:
+            if query.get('use_regex') == 'true':
+                names = [key for key in names
+                         if re.search(query['name'], key[1])]
+            else:
+                names = [key for key in names if query['name'] in key[1]]
+        if 'page' not in query:
+            return 200, [self._project(self.queue(*key), query)
+                         for key in names]
+        page, page_size = int(query['page']), int(query['page_size'])
+        page_count = math.ceil(len(names) / page_size)
+        if page > 1 and page > page_count:
+            return 400, {'error': 'bad_request',
+                         'reason': 'page_out_of_range'}
+        start = (page - 1) * page_size
+        return 200, {
+            'filtered_count': len(names),
+            'item_count': len(names[start:start + page_size]),
+            'items': [self._project(self.queue(*key), query)
+                      for key in names[start:start + page_size]],
+            'page': page,
+            'page_count': page_count,
+            'page_size': page_size,
+            'total_count': len(names)}
+
+    def _post_queues(self, args, query, body):
+        if len(args) != 5 or args[0] != 'quorum' or args[4] != 'add':
+            return 405, {'error': 'Method Not Allowed', 'reason': 'POST'}
+        queue = self.vhosts.get(args[1], {}).get(args[2])
+        if queue is None or queue.type != 'quorum':
+            return 404, {'error': 'Object Not Found', 'reason': 'Not Found'}
+        if body['node'] not in queue.members:
+            queue.members[body['node']] = \
+                time.monotonic() + queue.message_bytes / self.sync_rate
+        return 204, None
+
+    def _delete_queues(self, args, query, body):
+        if len(args) != 5 or args[0] != 'quorum' or args[4] != 'delete':
+            return 405, {'error': 'Method Not Allowed', 'reason': 'DELETE'}
+        queue = self.vhosts.get(args[1], {}).get(args[2])
+        if queue is None or queue.type != 'quorum':
+            return 404, {'error': 'Object Not Found', 'reason': 'Not Found'}
+        if body['node'] not in queue.members:
+            return 404, {'error': 'Object Not Found',
+                         'reason': 'not_a_member'}
+        if len(queue.members) == 1:
+            return 400, {'error': 'bad_request',
+                         'reason': 'last_quorum_member'}
+        del queue.members[body['node']]
+        if queue.node == body['node']:
+            now = time.monotonic()
+            queue.node = self.random.choice(
+                sorted(node for node, online in queue.members.items()
+                       if online <= now) or sorted(queue.members))
+        return 204, None
+
+    def _connection_name(self, node: str) -> str:
+        return '127.0.0.1:{} -> 127.0.0.1:5672'.format(
+            50000 + self.nodes.index(node))
+
+    @staticmethod
+    def _project(queue: dict, query: dict) -> dict:
+        if query.get('disable_stats') == 'true':
+            for key in ['message_stats', 'message_bytes', 'memory',
+                        'messages']:
+                queue.pop(key, None)
+        if 'columns' in query:
+            columns = query['columns'].split(',')
+            queue = {k: v for k, v in queue.items() if k in columns}
+        return queue
@@ -0,0 +1,83 @@
+import unittest
+from unittest import mock
+
+from requests import exceptions
+from tests import fake_api
+
+from rmq_cluster_rebalance import client
+
+
+class SessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.api = fake_api.FakeManagementAPI().start()
+        self.api.add_endpoint()
+        self.api.add_endpoint()
+        self.session = client.Session(self.api.urls, 10)
+        patcher = mock.patch.object(client, 'RETRY_DELAY', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.session.close()
+        self.api.stop()
+
+    def test_reads_are_spread(self):
+        for _offset in range(6):
+            self.assertTrue(self.session.get(
+                '{}/api/nodes'.format(self.api.url)).ok)
+        self.assertListEqual(
+            list(self.api.endpoint_requests.values()), [2, 2, 2])
+
+    def test_writes_use_first_endpoint(self):
+        for offset in range(3):
+            self.assertTrue(self.session.put(
+                '{}/api/policies/%2f/test-{}'.format(self.api.url, offset),
+                json={'pattern': '^$', 'definition': {}}).ok)
+        self.assertListEqual(
+            list(self.api.endpoint_requests.values()), [3, 0, 0])
+
+    def test_failover(self):
+        self.api.stop_endpoint(self.api.url)
+        for _offset in range(4):
+            self.assertTrue(self.session.put(
+                '{}/api/policies/%2f/test'.format(self.session.urls[0]),
+                json={'pattern': '^$', 'definition': {}}).ok)
+            self.assertTrue(self.session.get(
+                '{}/api/nodes'.format(self.session.urls[0])).ok)
+        self.assertListEqual(list(self.session.down), [self.api.url])
+        self.assertEqual(sum(self.api.endpoint_requests.values()), 8)
+
+    def test_all_endpoints_down(self):
+        urls = self.api.urls
+        self.api.stop()
+        with self.assertRaises(exceptions.ConnectionError):
+            self.session.get('{}/api/nodes'.format(urls[0]))
+        self.assertSetEqual(set(self.session.down), set(urls))
+
+    def test_other_urls_are_not_rewritten(self):
+        session = client.Session(['http://127.0.0.1:1'], 10)
+        response = session.get('{}/api/nodes'.format(self.api.url))
+        self.assertTrue(response.ok)
+        self.assertDictEqual(session.down, {})
+
+    def test_add_urls(self):
+        self.session.add_urls([self.api.url + '/', 'http://rabbit2:15672'])
+        self.assertListEqual(
+            self.session.urls, self.api.urls + ['http://rabbit2:15672'])
+
+
+class ListenerURLsTestCase(unittest.TestCase):
+
+    def test_listener_urls(self):
+        overview = {'listeners': [
+            {'node': 'rabbit@rabbit2', 'protocol': 'http', 'port': 15672},
+            {'node': 'rabbit@rabbit1', 'protocol': 'amqp', 'port': 5672},
+            {'node': 'rabbit@rabbit1', 'protocol': 'http', 'port': 15672},
+            {'node': 'rabbit@rabbit1', 'protocol': 'https', 'port': 15671}]}
+        self.assertListEqual(
+            client.listener_urls(overview, 'https://rabbit1:15671/'),
+            ['https://rabbit1:15671'])
+        self.assertListEqual(
+            client.listener_urls(overview, 'http://localhost:15672'),
+            ['http://rabbit1:15672', 'http://rabbit2:15672'])
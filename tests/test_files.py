@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+
+from rmq_cluster_rebalance import files
+
+
+class AtomicWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'file')
+        with open(self.path, 'w') as handle:
+            handle.write('previous')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_replaces_file(self):
+        with files.atomic_writer(self.path) as handle:
+            handle.write('current')
+            with open(self.path) as previous:
+                self.assertEqual(previous.read(), 'previous')
+        with open(self.path) as handle:
+            self.assertEqual(handle.read(), 'current')
+        self.assertListEqual(os.listdir(self.directory.name), ['file'])
+
+    def test_keeps_file_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with files.atomic_writer(self.path) as handle:
+                handle.write('partial')
+                raise RuntimeError('failed')
+        with open(self.path) as handle:
+            self.assertEqual(handle.read(), 'previous')
+        self.assertListEqual(os.listdir(self.directory.name), ['file'])
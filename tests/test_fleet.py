@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+from rmq_cluster_rebalance import fleet, metrics
+
+
+def worker(cluster, totals):
+    totals[cluster.name] = dict(fleet.EMPTY_TOTALS, in_flight=1)
+    if cluster.arguments == ['--fail']:
+        raise RuntimeError('failed')
+    return dict(fleet.EMPTY_TOTALS, moved=len(cluster.arguments),
+                total=len(cluster.arguments), synchronized_bytes=10,
+                exit_code=int(cluster.arguments == ['--exit']))
+
+
+class ConfigTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'fleet.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, config):
+        with open(self.path, 'w') as handle:
+            json.dump(config, handle)
+
+    def test_arguments(self):
+        self.assertListEqual(
+            fleet.arguments({'urls': ['http://a:15672', 'http://b:15672'],
+                             'vhost': ['/', 'orders'],
+                             'concurrency': 4,
+                             'skip_exclusive': True,
+                             'lean': False,
+                             'max-skew': 0.2}),
+            ['--concurrency', '4', '--max-skew', '0.2', '--skip-exclusive',
+             '--vhost', '/', '--vhost', 'orders',
+             'http://a:15672', 'http://b:15672'])
+
+    def test_single_url(self):
+        self.assertListEqual(fleet.arguments({'urls': 'http://a:15672'}),
+                             ['http://a:15672'])
+
+    def test_read_config(self):
+        self.write({'defaults': {'strategy': 'min-moves', 'concurrency': 2},
+                    'clusters': {
+                        'b': {'urls': 'http://b:15672'},
+                        'a': {'urls': 'http://a:15672', 'concurrency': 8}}})
+        self.assertListEqual(fleet.read_config(self.path), [
+            fleet.Cluster('a', ['--concurrency', '8', '--strategy',
+                                'min-moves', 'http://a:15672']),
+            fleet.Cluster('b', ['--concurrency', '2', '--strategy',
+                                'min-moves', 'http://b:15672'])])
+
+    def test_read_config_without_clusters(self):
+        self.write({'defaults': {}})
+        with self.assertRaises(ValueError):
+            fleet.read_config(self.path)
+
+    def test_read_config_invalid_options(self):
+        self.write({'clusters': {'a': ['http://a:15672']}})
+        with self.assertRaises(ValueError):
+            fleet.read_config(self.path)
+
+
+class FleetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.fleet = fleet.Fleet(
+            [fleet.Cluster('a', ['x', 'y']), fleet.Cluster('b', ['--exit']),
+             fleet.Cluster('c', ['--fail'])], 2, worker)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'metrics')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_run(self):
+        with self.assertLogs('rmq_cluster_rebalance.fleet', logging.INFO):
+            results = self.fleet.run(0.01)
+        self.assertEqual(results['a']['moved'], 2)
+        self.assertEqual(results['b']['exit_code'], 1)
+        self.assertEqual(results['c']['exit_code'], 1)
+        self.assertListEqual(self.fleet.failed, ['b', 'c'])
+
+    def test_progress(self):
+        self.fleet.results['a'] = dict(
+            fleet.EMPTY_TOTALS, moved=3, total=3, exit_code=0)
+        line = self.fleet.progress({
+            'a': dict(fleet.EMPTY_TOTALS, moved=1, in_flight=1),
+            'b': dict(fleet.EMPTY_TOTALS, moved=2, in_flight=1, failed=1,
+                      total=10)})
+        self.assertTrue(line.startswith(
+            '1/3 clusters finished, 5 queues moved, 1 in flight, '), line)
+        self.assertTrue(line.endswith(', 1 failed, 13 moves planned'), line)
+
+    def test_write_json(self):
+        self.fleet.run(0.01)
+        self.fleet.write(self.path)
+        with open(self.path) as handle:
+            summary = json.load(handle)
+        self.assertEqual(summary['moved'], 3)
+        self.assertEqual(summary['synchronized_bytes'], 20)
+        self.assertSetEqual(set(summary['clusters']), {'a', 'b', 'c'})
+
+    def test_write_prometheus(self):
+        self.fleet.run(0.01)
+        self.fleet.write(self.path, 'prometheus')
+        with open(self.path) as handle:
+            content = handle.read()
+        self.assertIn('{}_queue_moves_total{{cluster="a"}} 2\n'.format(
+            metrics.PREFIX), content)
+        self.assertIn('{}_exit_code{{cluster="b"}} 1\n'.format(
+            metrics.PREFIX), content)
+
+    def test_publishing(self):
+        totals, values = {}, metrics.Metrics()
+        with fleet.publishing('a', values, totals, 0.001):
+            values.move_started()
+        self.assertEqual(totals['a']['in_flight'], 1)
+
+    def test_cluster_logging(self):
+        logger = logging.getLogger('rmq_cluster_rebalance.fleet')
+        with self.assertLogs(logger, logging.INFO) as logs:
+            with fleet.cluster_logging('a'):
+                logger.info('inside')
+            logger.info('outside')
+        self.assertListEqual(
+            [record.getMessage() for record in logs.records],
+            ['[a] inside', 'outside'])
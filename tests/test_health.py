@@ -0,0 +1,64 @@
+import unittest
+
+from rmq_cluster_rebalance import health
+
+
+def node(**kwargs):
+    value = {'name': 'rabbit@rabbit1', 'running': True,
+             'mem_alarm': False, 'disk_free_alarm': False,
+             'mem_used': 100, 'mem_limit': 1000,
+             'fd_used': 10, 'fd_total': 100}
+    value.update(kwargs)
+    return value
+
+
+class NodeProblemsTestCase(unittest.TestCase):
+
+    def test_healthy_node(self):
+        self.assertListEqual(health.node_problems([node()], 0.8, 0.9), [])
+
+    def test_node_not_running(self):
+        problems = health.node_problems(
+            [node(running=False, mem_alarm=True)], 0.8, 0.9)
+        self.assertListEqual(problems, [])
+
+    def test_alarms(self):
+        problems = health.node_problems(
+            [node(mem_alarm=True, disk_free_alarm=True)], 0.8, 0.9)
+        self.assertListEqual(problems, [
+            'rabbit@rabbit1 has a memory alarm',
+            'rabbit@rabbit1 has a disk free alarm'])
+
+    def test_memory_used(self):
+        problems = health.node_problems([node(mem_used=900)], 0.8, 0.9)
+        self.assertListEqual(
+            problems, ['rabbit@rabbit1 is using 90% of its memory limit'])
+
+    def test_fd_used(self):
+        problems = health.node_problems([node(fd_used=95)], 0.8, 0.9)
+        self.assertListEqual(
+            problems, ['rabbit@rabbit1 is using 95% of its file descriptors'])
+
+    def test_missing_stats(self):
+        self.assertListEqual(
+            health.node_problems([{'name': 'rabbit@rabbit1'}], 0.8, 0.9), [])
+
+
+class OverviewProblemsTestCase(unittest.TestCase):
+
+    OVERVIEW = {'message_stats': {'publish_details': {'rate': 500.0}}}
+
+    def test_disabled(self):
+        self.assertListEqual(health.overview_problems(self.OVERVIEW, None), [])
+
+    def test_below_publish_rate(self):
+        self.assertListEqual(
+            health.overview_problems(self.OVERVIEW, 1000.0), [])
+
+    def test_above_publish_rate(self):
+        self.assertListEqual(
+            health.overview_problems(self.OVERVIEW, 100.0),
+            ['the cluster publish rate is 500 messages/sec'])
+
+    def test_missing_stats(self):
+        self.assertListEqual(health.overview_problems({}, 100.0), [])
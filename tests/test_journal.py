@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+from rmq_cluster_rebalance import journal
+
+QUEUE1 = {'vhost': '/', 'name': 'queue1', 'node': 'rabbit@rabbit1'}
+QUEUE2 = {'vhost': 'test', 'name': 'queue2', 'node': 'rabbit@rabbit2'}
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'journal')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_in_memory_journal(self):
+        value = journal.Journal()
+        value.record_phase(QUEUE1, 'rabbit@rabbit2', 'sync')
+        self.assertFalse(value.is_completed(QUEUE1))
+        value.record_done(QUEUE1)
+        self.assertTrue(value.is_completed(QUEUE1))
+        self.assertDictEqual(value.in_flight, {})
+        value.close()
+
+    def test_resume(self):
+        value = journal.Journal(self.path)
+        value.record_plan([(QUEUE1, 'rabbit@rabbit2'),
+                           (QUEUE2, 'rabbit@rabbit3')])
+        value.record_phase(QUEUE1, 'rabbit@rabbit2', 'sync')
+        value.record_phase(QUEUE1, 'rabbit@rabbit2', 'move')
+        value.record_done(QUEUE1)
+        value.record_phase(QUEUE2, 'rabbit@rabbit3', 'sync')
+        value.close()
+
+        value = journal.Journal(self.path, resume=True)
+        self.assertListEqual(
+            value.plan, [['/', 'queue1', 'rabbit@rabbit2'],
+                         ['test', 'queue2', 'rabbit@rabbit3']])
+        self.assertTrue(value.is_completed(QUEUE1))
+        self.assertFalse(value.is_completed(QUEUE2))
+        self.assertDictEqual(
+            value.in_flight, {('test', 'queue2'): ('rabbit@rabbit3', 'sync')})
+        value.close()
+
+    def test_resume_failed(self):
+        value = journal.Journal(self.path)
+        value.record_phase(QUEUE1, 'rabbit@rabbit2', 'sync')
+        value.record_failed(QUEUE1, 'sync')
+        value.close()
+
+        value = journal.Journal(self.path, resume=True)
+        self.assertFalse(value.is_completed(QUEUE1))
+        self.assertDictEqual(value.in_flight, {})
+        self.assertDictEqual(value.failed, {('/', 'queue1'): 'sync'})
+        value.close()
+
+    def test_resume_compacts_journal(self):
+        value = journal.Journal(self.path)
+        for phase in ['sync', 'move']:
+            value.record_phase(QUEUE1, 'rabbit@rabbit2', phase)
+        value.record_done(QUEUE1)
+        value.close()
+        journal.Journal(self.path, resume=True).close()
+        with open(self.path) as handle:
+            self.assertEqual(len(handle.readlines()), 1)
+
+    def test_resume_skips_partial_entry(self):
+        value = journal.Journal(self.path)
+        value.record_done(QUEUE1)
+        value.close()
+        with open(self.path, 'a') as handle:
+            handle.write('{"e":"do')
+        value = journal.Journal(self.path, resume=True)
+        self.assertTrue(value.is_completed(QUEUE1))
+        value.close()
+
+    def test_resume_without_journal(self):
+        value = journal.Journal(self.path, resume=True)
+        self.assertIsNone(value.plan)
+        self.assertSetEqual(value.completed, set())
+        value.close()
+
+    def test_new_journal_truncates(self):
+        value = journal.Journal(self.path)
+        value.record_done(QUEUE1)
+        value.close()
+        journal.Journal(self.path).close()
+        value = journal.Journal(self.path, resume=True)
+        self.assertFalse(value.is_completed(QUEUE1))
+        value.close()
@@ -0,0 +1,156 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from rmq_cluster_rebalance import metrics
+
+QUEUE = {'vhost': '/', 'name': 'queue1', 'node': 'rabbit@rabbit1',
+         'message_bytes': 1024}
+
+
+class HistogramTestCase(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = metrics.Histogram((1.0, 5.0))
+        for value in [0.5, 1.0, 3.0, 10.0]:
+            histogram.observe(value)
+        self.assertDictEqual(histogram.as_dict(), {
+            'buckets': {1.0: 2, 5.0: 3}, 'count': 4, 'sum': 14.5})
+
+    def test_prometheus(self):
+        histogram = metrics.Histogram((1.0,))
+        histogram.observe(0.5)
+        self.assertListEqual(histogram.prometheus('test', 'a="b"'), [
+            'test_bucket{a="b",le="1.0"} 1',
+            'test_bucket{a="b",le="+Inf"} 1',
+            'test_sum{a="b"} 0.5',
+            'test_count{a="b"} 1'])
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'metrics')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def response(self, method='GET', path='/api/queues/%2F/queue1',
+                 elapsed=0.02):
+        return mock.Mock(
+            request=mock.Mock(method=method, path_url=path),
+            elapsed=datetime.timedelta(seconds=elapsed))
+
+    def test_move_finished(self):
+        self.metrics.move_started()
+        self.assertEqual(self.metrics.in_flight, 1)
+        self.metrics.move_finished(QUEUE, 'rabbit@rabbit2', 2.0, 0.5, 7)
+        self.assertEqual(self.metrics.in_flight, 0)
+        self.assertDictEqual(self.metrics.queues[0], {
+            'vhost': '/', 'name': 'queue1', 'source': 'rabbit@rabbit1',
+            'destination': 'rabbit@rabbit2', 'sync_seconds': 2.0,
+            'move_seconds': 0.5, 'polls': 7, 'bytes': 1024})
+        self.assertSetEqual(set(self.metrics.phases.keys()), {
+            ('sync', 'rabbit@rabbit2'), ('move', 'rabbit@rabbit2')})
+
+    def test_move_without_sync(self):
+        self.metrics.move_started()
+        self.metrics.move_finished(QUEUE, 'rabbit@rabbit2', 0.0, 0.5, 1)
+        self.assertEqual(self.metrics.queues[0]['bytes'], 0)
+        self.assertSetEqual(set(self.metrics.phases.keys()),
+                            {('move', 'rabbit@rabbit2')})
+
+    def test_move_failed(self):
+        self.metrics.total = 2
+        self.metrics.move_started()
+        self.metrics.move_failed(QUEUE, 'rabbit@rabbit2', 'sync')
+        self.assertEqual(self.metrics.in_flight, 0)
+        self.assertEqual(self.metrics.total, 1)
+        self.assertDictEqual(self.metrics.failures[0], {
+            'vhost': '/', 'name': 'queue1', 'source': 'rabbit@rabbit1',
+            'destination': 'rabbit@rabbit2', 'phase': 'sync'})
+        self.assertTrue(self.metrics.progress().endswith(', 1 failed'))
+
+    def test_totals(self):
+        self.metrics.total = 3
+        for _offset in range(3):
+            self.metrics.move_started()
+        self.metrics.move_finished(QUEUE, 'rabbit@rabbit2', 1.0, 0.5, 1)
+        self.metrics.move_failed(QUEUE, 'rabbit@rabbit2', 'sync')
+        totals = self.metrics.totals()
+        self.assertIsInstance(totals.pop('elapsed'), float)
+        self.assertDictEqual(totals, {
+            'moved': 1, 'in_flight': 1, 'failed': 1, 'total': 2,
+            'synchronized_bytes': 1024})
+
+    def test_max_records(self):
+        values = metrics.Metrics(2)
+        for _offset in range(3):
+            values.move_started()
+            values.move_finished(QUEUE, 'rabbit@rabbit2', 1.0, 0.5, 2)
+        self.assertEqual(len(values.queues), 2)
+        self.assertEqual(values.totals()['moved'], 3)
+        self.assertEqual(values.totals()['synchronized_bytes'], 3072)
+        self.assertEqual(values.polls, 6)
+
+    def test_unbounded_records(self):
+        values = metrics.Metrics()
+        for _offset in range(metrics.MAX_RECORDS + 1):
+            values.move_started()
+            values.move_finished(QUEUE, 'rabbit@rabbit2', 1.0, 0.5, 2)
+        self.assertEqual(len(values.queues), metrics.MAX_RECORDS + 1)
+
+    def test_progress(self):
+        self.assertTrue(self.metrics.progress().startswith(
+            '0 queues moved, 0 in flight'))
+        self.metrics.total = 4
+        self.metrics.move_started()
+        self.metrics.move_finished(QUEUE, 'rabbit@rabbit2', 0.0, 0.5, 1)
+        self.assertIn('1/4 (25%), ETA', self.metrics.progress())
+
+    def test_response_hook(self):
+        self.metrics.response_hook(self.response())
+        self.metrics.response_hook(self.response(
+            'PUT', '/api/policies/%2F/rmq-cluster-rebalance-queue1', 0.2))
+        self.metrics.response_hook(self.response(
+            path='/api/queues/%2F?page=1&page_size=500'))
+        self.assertSetEqual(set(self.metrics.requests.keys()), {
+            ('GET', '/api/queues/*/*'),
+            ('PUT', '/api/policies/*/*'),
+            ('GET', '/api/queues/*')})
+
+    def test_write_json(self):
+        self.metrics.response_hook(self.response())
+        self.metrics.move_started()
+        self.metrics.move_finished(QUEUE, 'rabbit@rabbit2', 2.0, 0.5, 7)
+        self.metrics.write(self.path)
+        with open(self.path) as handle:
+            summary = json.load(handle)
+        self.assertEqual(summary['queues'][0]['name'], 'queue1')
+        self.assertEqual(
+            summary['requests']['GET /api/queues/*/*']['count'], 1)
+        self.assertEqual(
+            summary['phases']['sync rabbit@rabbit2']['sum'], 2.0)
+
+    def test_write_prometheus(self):
+        self.metrics.response_hook(self.response())
+        self.metrics.move_started()
+        self.metrics.move_finished(QUEUE, 'rabbit@rabbit2', 2.0, 0.5, 7)
+        self.metrics.write(self.path, 'prometheus')
+        with open(self.path) as handle:
+            lines = handle.read().splitlines()
+        self.assertIn('rmq_cluster_rebalance_queue_moves_total 1', lines)
+        self.assertIn('rmq_cluster_rebalance_queue_polls_total 7', lines)
+        self.assertIn(
+            'rmq_cluster_rebalance_synchronized_bytes_total 1024', lines)
+        self.assertIn(
+            'rmq_cluster_rebalance_http_request_duration_seconds_count'
+            '{method="GET",endpoint="/api/queues/*/*"} 1', lines)
+        self.assertIn(
+            'rmq_cluster_rebalance_queue_phase_seconds_count'
+            '{phase="move",node="rabbit@rabbit2"} 1', lines)
@@ -0,0 +1,92 @@
+import unittest
+
+from rmq_cluster_rebalance import placement
+
+NODES = ['rabbit@rabbit1', 'rabbit@rabbit2', 'rabbit@rabbit3']
+
+
+def queue(name, node, **kwargs):
+    return dict(kwargs, name=name, node=node, vhost='/')
+
+
+class IndexTestCase(unittest.TestCase):
+
+    def test_update(self):
+        index = placement.Index()
+        self.assertEqual(index.update(
+            [queue('q1', NODES[0]), queue('q2', NODES[0])]), 2)
+        self.assertDictEqual(index.loads_for(NODES),
+                             {NODES[0]: 2, NODES[1]: 0, NODES[2]: 0})
+        self.assertEqual(index.skew(NODES), 3.0)
+
+    def test_update_changes(self):
+        index = placement.Index()
+        index.update([queue('q1', NODES[0]), queue('q2', NODES[0]),
+                      queue('q3', NODES[1])])
+        self.assertEqual(index.update(
+            [queue('q1', NODES[0]), queue('q2', NODES[2]),
+             queue('q4', NODES[1])]), 3)
+        self.assertDictEqual(index.loads_for(NODES),
+                             {NODES[0]: 1, NODES[1]: 1, NODES[2]: 1})
+        self.assertSetEqual(set(index.queues),
+                            {('/', 'q1'), ('/', 'q2'), ('/', 'q4')})
+        self.assertEqual(index.skew(NODES), 0.0)
+
+    def test_weighted_update(self):
+        index = placement.Index('message_bytes')
+        index.update([queue('q1', NODES[0], message_bytes=10)])
+        self.assertEqual(index.update(
+            [queue('q1', NODES[0], message_bytes=10)]), 0)
+        self.assertEqual(index.update(
+            [queue('q1', NODES[0], message_bytes=25)]), 1)
+        self.assertEqual(index.loads[NODES[0]], 25)
+
+    def test_most_loaded(self):
+        index = placement.Index()
+        index.update([queue('q1', NODES[0]), queue('q2', NODES[1]),
+                      queue('q3', NODES[1])])
+        self.assertEqual(index.most_loaded(NODES), NODES[1])
+
+    def test_move(self):
+        index = placement.Index('message_bytes')
+        index.update([queue('q1', NODES[0], message_bytes=10,
+                            synchronised_slave_nodes=[NODES[1]])])
+        index.move(queue('q1', NODES[0]), NODES[1])
+        index.move(queue('unknown', NODES[0]), NODES[1])
+        self.assertDictEqual(index.loads_for(NODES),
+                             {NODES[0]: 0, NODES[1]: 10, NODES[2]: 0})
+        record = index.queues['/', 'q1']
+        self.assertEqual(record.node, NODES[1])
+        self.assertTupleEqual(record.synchronised_slave_nodes, ())
+
+
+class QueueRecordTestCase(unittest.TestCase):
+
+    def test_mapping(self):
+        record = placement.QueueRecord.from_queue(queue(
+            'q1', NODES[0], type='quorum', members=NODES, message_bytes=10,
+            effective_policy_definition={'ha-mode': 'all'},
+            message_stats={'publish_details': {'rate': 2.5}}))
+        value = dict(record, node=NODES[1])
+        self.assertEqual(value['node'], NODES[1])
+        self.assertEqual(value['members'], tuple(NODES))
+        self.assertEqual(value['message_stats']['publish_details']['rate'],
+                         2.5)
+        self.assertEqual(record.get('missing', 1), 1)
+        with self.assertRaises(KeyError):
+            record['missing']
+
+    def test_classic_queue_has_no_members(self):
+        record = placement.QueueRecord.from_queue(queue('q1', NODES[0]))
+        self.assertNotIn('members', record)
+        self.assertIsNone(record.get('members'))
+        self.assertEqual(record['type'], 'classic')
+
+    def test_shares_values(self):
+        records = [placement.QueueRecord.from_queue(queue(
+            'q{}'.format(i), ''.join(['rabbit@', 'rabbit1']),
+            effective_policy_definition={'ha-mode': 'all'}))
+            for i in range(2)]
+        self.assertIs(records[0].node, records[1].node)
+        self.assertIs(records[0].effective_policy_definition,
+                      records[1].effective_policy_definition)
@@ -0,0 +1,201 @@
+import unittest
+
+from rmq_cluster_rebalance import planner
+
+NODES = ['rabbit@rabbit1', 'rabbit@rabbit2', 'rabbit@rabbit3']
+
+
+def queue(name, node, **kwargs):
+    return dict(kwargs, name=name, node=node)
+
+
+class PlanTestCase(unittest.TestCase):
+
+    def apply(self, queues, moves):
+        destinations = {m.queue['name']: m.destination for m in moves}
+        return [dict(q, node=destinations.get(q['name'], q['node']))
+                for q in queues]
+
+    def test_balanced_cluster_has_no_moves(self):
+        queues = [queue('q{}'.format(i), NODES[i % 3]) for i in range(9)]
+        self.assertListEqual(planner.plan(queues, NODES), [])
+
+    def test_nearly_balanced_cluster_has_one_move(self):
+        queues = [queue('q{}'.format(i), NODES[i % 3]) for i in range(8)]
+        queues.append(queue('q8', NODES[0]))
+        queues.append(queue('q9', NODES[0]))
+        moves = planner.plan(queues, NODES)
+        self.assertEqual(len(moves), 1)
+        self.assertEqual(moves[0].queue['node'], NODES[0])
+        loads = planner.node_loads(self.apply(queues, moves), NODES)
+        self.assertLessEqual(max(loads.values()) - min(loads.values()), 1)
+
+    def test_all_on_one_node(self):
+        queues = [queue('q{}'.format(i), NODES[0]) for i in range(30)]
+        moves = planner.plan(queues, NODES)
+        self.assertEqual(len(moves), 20)
+        loads = planner.node_loads(self.apply(queues, moves), NODES)
+        self.assertDictEqual(loads, dict.fromkeys(NODES, 10))
+
+    def test_queues_are_moved_at_most_once(self):
+        queues = [queue('q{}'.format(i), NODES[0], message_bytes=i + 1)
+                  for i in range(50)]
+        moves = planner.plan(queues, NODES, 'message_bytes')
+        names = [m.queue['name'] for m in moves]
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_weighted_by_message_bytes(self):
+        queues = [queue('big', NODES[0], message_bytes=1000),
+                  queue('small1', NODES[0], message_bytes=10),
+                  queue('small2', NODES[0], message_bytes=10),
+                  queue('small3', NODES[1], message_bytes=10),
+                  queue('empty', NODES[2], message_bytes=0)]
+        moves = planner.plan(queues, NODES, 'message_bytes')
+        self.assertNotIn('empty', [m.queue['name'] for m in moves])
+        loads = planner.node_loads(
+            self.apply(queues, moves), NODES, 'message_bytes')
+        self.assertEqual(max(loads.values()), 1000)
+
+    def test_weighted_by_publish_rate(self):
+        queues = [queue('q1', NODES[0], message_stats={
+                      'publish_details': {'rate': 100.0}}),
+                  queue('q2', NODES[0], message_stats={
+                      'publish_details': {'rate': 100.0}}),
+                  queue('q3', NODES[1])]
+        moves = planner.plan(queues, NODES, 'publish_rate')
+        self.assertEqual(len(moves), 1)
+        self.assertIn(moves[0].destination, NODES[1:])
+
+    def test_queues_in_multiple_vhosts(self):
+        queues = [queue('q1', NODES[0], vhost='/'),
+                  queue('q1', NODES[0], vhost='other'),
+                  queue('q2', NODES[0], vhost='other')]
+        moves = planner.plan(queues, NODES)
+        self.assertEqual(len(moves), 2)
+        self.assertEqual(
+            len({(m.queue['vhost'], m.queue['name']) for m in moves}), 2)
+        self.assertSetEqual({m.destination for m in moves}, set(NODES[1:]))
+
+    def test_orphaned_queues_are_moved(self):
+        queues = [queue('q1', 'rabbit@gone'), queue('q2', NODES[0])]
+        moves = planner.plan(queues, NODES)
+        self.assertEqual(moves[0].queue['name'], 'q1')
+        self.assertNotEqual(moves[0].destination, NODES[0])
+
+    def test_node_loads(self):
+        queues = [queue('q1', NODES[0], memory=10),
+                  queue('q2', NODES[0], memory=5),
+                  queue('q3', NODES[1])]
+        self.assertDictEqual(
+            planner.node_loads(queues, NODES, 'memory'),
+            {NODES[0]: 15, NODES[1]: 0, NODES[2]: 0})
+
+    def test_max_skew_limits_moves(self):
+        queues = [queue('q{}'.format(i), NODES[0]) for i in range(30)]
+        moves = planner.plan(queues, NODES, max_skew=0.5)
+        loads = planner.node_loads(self.apply(queues, moves), NODES)
+        self.assertLessEqual(planner.skew(loads), 0.5)
+        self.assertLess(len(moves), 20)
+
+    def test_skew(self):
+        self.assertEqual(planner.skew({}), 0.0)
+        self.assertEqual(planner.skew({NODES[0]: 0, NODES[1]: 0}), 0.0)
+        self.assertEqual(
+            planner.skew({NODES[0]: 20, NODES[1]: 10, NODES[2]: 0}), 2.0)
+
+    def test_round_robin(self):
+        queues = [queue('q{}'.format(i), NODES[0]) for i in range(6)]
+        moves = list(planner.round_robin(queues, NODES))
+        self.assertListEqual(
+            [(m.queue['name'], m.destination) for m in moves],
+            [('q1', NODES[1]), ('q2', NODES[2]),
+             ('q4', NODES[1]), ('q5', NODES[2])])
+
+    def test_pinned_queues_are_not_moved(self):
+        queues = [queue('q{}'.format(i), NODES[0]) for i in range(6)]
+        moves = planner.plan(queues, NODES, pinned={('', 'q0'), ('', 'q1')})
+        self.assertEqual(len(moves), 4)
+        self.assertNotIn('q0', [m.queue['name'] for m in moves])
+        self.assertNotIn('q1', [m.queue['name'] for m in moves])
+
+    def test_locality_moves_to_client_node(self):
+        queues = [queue('q{}'.format(i), NODES[i % 3]) for i in range(6)]
+        preferred = {('', 'q0'): NODES[1], ('', 'q1'): NODES[0],
+                     ('', 'q2'): NODES[2], ('', 'q3'): NODES[1]}
+        moves = planner.locality(queues, NODES, preferred)
+        placement = {q['name']: q['node'] for q in self.apply(queues, moves)}
+        for (_vhost, name), node in preferred.items():
+            self.assertEqual(placement[name], node)
+        loads = planner.node_loads(self.apply(queues, moves), NODES)
+        self.assertDictEqual(loads, dict.fromkeys(NODES, 2))
+
+    def test_locality_within_max_skew(self):
+        queues = [queue('q{}'.format(i), NODES[i % 3]) for i in range(9)]
+        preferred = {('', q['name']): NODES[0] for q in queues}
+        moves = planner.locality(queues, NODES, preferred, max_skew=0.5)
+        loads = planner.node_loads(self.apply(queues, moves), NODES)
+        self.assertEqual(loads[NODES[0]], 4)
+        self.assertEqual(sum(m.destination == NODES[0] for m in moves), 1)
+
+    def test_locality_ignores_unknown_nodes(self):
+        queues = [queue('q0', NODES[0]), queue('q1', NODES[1])]
+        moves = planner.locality(
+            queues, NODES[:2], {('', 'q0'): 'rabbit@gone'})
+        self.assertListEqual(moves, [])
+
+    def test_mirror_nodes(self):
+        self.assertListEqual(
+            list(planner.mirror_nodes(queue(
+                'q0', NODES[0], synchronised_slave_nodes=NODES[1:2]))),
+            NODES[1:2])
+        self.assertListEqual(
+            planner.mirror_nodes(queue(
+                'q1', NODES[0], type='quorum', members=NODES)), NODES[1:])
+
+    def test_mirrored_prefers_mirror_nodes(self):
+        queues = [queue('q{}'.format(i), NODES[0],
+                        synchronised_slave_nodes=[NODES[2]])
+                  for i in range(6)]
+        moves = planner.mirrored(queues, NODES)
+        self.assertEqual(
+            sum(m.destination == NODES[2] for m in moves), 2)
+        loads = planner.node_loads(self.apply(queues, moves), NODES)
+        self.assertDictEqual(loads, dict.fromkeys(NODES, 2))
+
+    def test_mirrored_without_tolerance(self):
+        queues = [queue('q{}'.format(i), NODES[0],
+                        synchronised_slave_nodes=[NODES[2]])
+                  for i in range(6)]
+        moves = planner.mirrored(queues, NODES, 0)
+        loads = planner.node_loads(self.apply(queues, moves), NODES)
+        self.assertDictEqual(loads, dict.fromkeys(NODES, 2))
+
+    def test_mirrored_keeps_queues_without_mirrors(self):
+        queues = [queue('q0', NODES[0], synchronised_slave_nodes=[NODES[1]]),
+                  queue('q1', NODES[0]),
+                  queue('q2', NODES[0], synchronised_slave_nodes=[NODES[2]])]
+        moves = planner.mirrored(queues, NODES)
+        self.assertListEqual(
+            sorted((m.queue['name'], m.destination) for m in moves),
+            [('q0', NODES[1]), ('q2', NODES[2])])
+
+    def test_mirrored_plan_is_stable(self):
+        nodes = NODES + ['rabbit@rabbit4']
+        queues = [queue('q{}'.format(i), nodes[i % 3],
+                        synchronised_slave_nodes=[nodes[(i + 1) % 4]])
+                  for i in range(34)]
+        queues += [queue('q{}'.format(i), nodes[3],
+                         synchronised_slave_nodes=[nodes[i % 3]])
+                   for i in range(34, 44)]
+        moves = planner.mirrored(queues, nodes)
+        self.assertTrue(all(m.queue['node'] != m.destination for m in moves))
+        queues = self.apply(queues, moves)
+        self.assertListEqual(planner.mirrored(queues, nodes), [])
+        loads = planner.node_loads(queues, nodes)
+        self.assertLessEqual(max(loads.values()) - min(loads.values()), 1)
+
+    def test_mirrored_balanced_cluster_has_no_moves(self):
+        queues = [queue('q{}'.format(i), NODES[i % 3],
+                        synchronised_slave_nodes=NODES)
+                  for i in range(9)]
+        self.assertListEqual(planner.mirrored(queues, NODES), [])
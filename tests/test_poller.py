@@ -0,0 +1,71 @@
+import threading
+import unittest
+
+from rmq_cluster_rebalance import poller
+
+QUEUES = {('/', 'queue{}'.format(offset)):
+          {'vhost': '/', 'name': 'queue{}'.format(offset),
+           'node': 'rabbit@rabbit1'} for offset in range(10)}
+
+
+class PollerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.poller = poller.Poller(self.fetch, 0.2)
+
+    def fetch(self, vhost, names):
+        self.requests.append((vhost, sorted(names)))
+        return [QUEUES[vhost, name] for name in names
+                if (vhost, name) in QUEUES]
+
+    def test_get(self):
+        self.assertDictEqual(self.poller.get('/', 'queue1'),
+                             QUEUES['/', 'queue1'])
+        self.assertListEqual(self.requests, [('/', ['queue1'])])
+        self.assertDictEqual(self.poller.wanted, {})
+        self.assertDictEqual(self.poller.states, {})
+
+    def test_missing_queue(self):
+        self.assertIsNone(self.poller.get('/', 'missing'))
+
+    def test_each_get_is_fresh(self):
+        self.poller.interval = 0
+        for _offset in range(3):
+            self.poller.get('/', 'queue1')
+        self.assertEqual(len(self.requests), 3)
+
+    def test_requests_are_shared(self):
+        self.poller.get('/', 'queue0')
+        results = {}
+
+        def get(key):
+            results[key] = self.poller.get(*key)
+
+        threads = [threading.Thread(target=get, args=(key,))
+                   for key in QUEUES]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertDictEqual(results, QUEUES)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(len(self.requests[1][1]), 10)
+
+    def test_get_many(self):
+        keys = [('/', 'queue1'), ('/', 'queue2'), ('other', 'queue1')]
+        self.assertDictEqual(self.poller.get_many(keys), {
+            keys[0]: QUEUES[keys[0]], keys[1]: QUEUES[keys[1]],
+            keys[2]: None})
+        self.assertListEqual(self.requests, [
+            ('/', ['queue1', 'queue2']), ('other', ['queue1'])])
+
+    def test_fetch_error(self):
+        def fetch(vhost, names):
+            raise SystemExit(1)
+
+        self.poller.fetch = fetch
+        with self.assertRaises(SystemExit):
+            self.poller.get('/', 'queue1')
+        self.poller.fetch = self.fetch
+        self.assertIsNotNone(self.poller.get('/', 'queue1'))
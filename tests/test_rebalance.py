@@ -1,13 +1,14 @@
 import contextlib
 import json
 import os
+import tempfile
 import time
 import unittest
 from unittest import mock
 
 from requests import exceptions
 
-from rmq_cluster_rebalance import __main__
+from rmq_cluster_rebalance import __main__, journal
 
 
 class TestCase(unittest.TestCase):
@@ -48,6 +49,110 @@ class TestCase(unittest.TestCase):
             time.sleep(1)
 
 
+class ParseCLIArgumentsTestCase(unittest.TestCase):
+
+    def test_default_vhost(self):
+        with mock.patch.dict(os.environ, {'RABBITMQ_VHOST': 'test'}):
+            args = __main__.parse_cli_arguments([])
+        self.assertListEqual(args.vhost, ['test'])
+        self.assertFalse(args.all_vhosts)
+
+    def test_multiple_vhosts(self):
+        args = __main__.parse_cli_arguments(
+            ['--vhost', '/', '--vhost', 'test'])
+        self.assertListEqual(args.vhost, ['/', 'test'])
+
+    def test_all_vhosts_excludes_vhost(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                __main__.parse_cli_arguments(
+                    ['--vhost', '/', '--all-vhosts'])
+
+    def test_resume_requires_journal(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                __main__.parse_cli_arguments(['--resume'])
+
+    def test_invalid_poll_intervals(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                __main__.parse_cli_arguments(
+                    ['--min-poll-interval', '10',
+                     '--max-poll-interval', '1'])
+
+    def test_invalid_include_pattern(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                __main__.parse_cli_arguments(['--include', '(orders'])
+
+    def test_default_command(self):
+        self.assertEqual(__main__.parse_cli_arguments([]).command, 'run')
+
+    def test_plan_command(self):
+        args = __main__.parse_cli_arguments(
+            ['plan', '--snapshot', 'cluster.snapshot'])
+        self.assertEqual(args.command, 'plan')
+        self.assertEqual(args.snapshot, 'cluster.snapshot')
+
+    def test_apply_requires_plan(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                __main__.parse_cli_arguments(['apply'])
+
+    def test_plan_requires_apply(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                __main__.parse_cli_arguments(['--plan', 'moves.plan'])
+
+    def test_fleet_requires_config(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                __main__.parse_cli_arguments(['fleet'])
+
+    def test_config_requires_fleet(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                __main__.parse_cli_arguments(['--config', 'fleet.json'])
+
+    def test_negative_mirror_tolerance(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                __main__.parse_cli_arguments(['--mirror-tolerance', '-1'])
+
+    def test_plan_with_locality(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                __main__.parse_cli_arguments(
+                    ['plan', '--snapshot', 'cluster.snapshot',
+                     '--strategy', 'locality'])
+
+
+class PollSchedulerTestCase(unittest.TestCase):
+
+    def test_starts_at_minimum(self):
+        scheduler = __main__.PollScheduler(0.1, 30.0)
+        self.assertGreaterEqual(scheduler.next_interval(), 0.05)
+        self.assertLessEqual(scheduler.interval, 0.2)
+
+    def test_starts_at_estimate(self):
+        scheduler = __main__.PollScheduler(0.1, 30.0, 10.0)
+        self.assertGreaterEqual(scheduler.next_interval(), 5.0)
+
+    def test_backoff_is_bounded(self):
+        scheduler = __main__.PollScheduler(0.1, 2.0, 60.0)
+        for _offset in range(10):
+            self.assertLessEqual(scheduler.next_interval(), 2.0)
+        self.assertEqual(scheduler.interval, 2.0)
+
+    def test_backoff_is_exponential(self):
+        scheduler = __main__.PollScheduler(1.0, 30.0)
+        intervals = []
+        for _offset in range(4):
+            scheduler.next_interval()
+            intervals.append(scheduler.interval)
+        self.assertListEqual(intervals, [2.0, 4.0, 8.0, 16.0])
+
+
 class ExitApplicationTestCase(TestCase):
 
     @contextlib.contextmanager
@@ -74,12 +179,13 @@ class ExitApplicationTestCase(TestCase):
             delete.side_effect = exceptions.ConnectionError
             with self.exit_application():
                 with self.assertRaises(AssertionError):
-                    self.rebalance._delete_policy()
+                    self.rebalance._delete_policy(
+                        self.rebalance.POLICY_NAME)
 
     def test_exit_called_on_policy_delete_error(self):
         with self.exit_application():
             with self.assertRaises(AssertionError):
-                self.rebalance._delete_policy()
+                self.rebalance._delete_policy(self.rebalance.POLICY_NAME)
 
     def test_exit_called_on_get_queue_info_connection_error(self):
         with mock.patch.object(self.rebalance.session, 'get') as get:
@@ -155,6 +261,22 @@ class PolicyTestCase(TestCase):
         self.assertGreater(rebalance.priority, __main__.DEFAULT_PRIORITY)
         self.assertEqual(rebalance.priority, __main__.DEFAULT_PRIORITY + 6)
 
+    def test_leftover_policies_removed(self):
+        name = self.rebalance._policy_name('leftover-queue')
+        self.rebalance.session.put(
+            self.rebalance._build_url('/api/policies/{vhost}/{policy}', name),
+            data=json.dumps({
+                'pattern': '^leftover-queue$',
+                'definition': {'ha-mode': 'all'},
+                'priority': __main__.DEFAULT_PRIORITY + 10,
+                'apply-to': 'queues'
+            }))
+        rebalance = __main__.Rebalance(self.cli_args)
+        self.assertEqual(rebalance.priority, __main__.DEFAULT_PRIORITY)
+        result = rebalance.session.get(
+            rebalance._build_url('/api/policies/{vhost}/{policy}', name))
+        self.assertEqual(result.status_code, 404)
+
     def test_apply_policy_1(self):
         queue_name = 'policy-queue'
         queue_url = '{}/api/queues/%2f/{}'.format(self.rabbit1_uri, queue_name)
@@ -165,7 +287,8 @@ class PolicyTestCase(TestCase):
         self._wait_for_queue_ready(queue_name, 'test-policy')
         queue = self.rebalance.session.get(queue_url).json()
         self.rebalance._apply_step1_policy(queue)
-        self._wait_for_queue_ready(queue_name, self.rebalance.POLICY_NAME)
+        self._wait_for_queue_ready(
+            queue_name, self.rebalance._policy_name(queue_name))
         queue = self.rebalance.session.get(queue_url).json()
         policy = queue['effective_policy_definition']
         self.assertEqual(policy['ha-mode'], 'all')
@@ -175,6 +298,30 @@ class PolicyTestCase(TestCase):
         self.assertNotIn('queue-master-locator', policy)
         self.rebalance.session.delete(queue_url)
 
+    def test_apply_targeted_policy_1(self):
+        queue_name = 'policy-queue'
+        queue_url = '{}/api/queues/%2f/{}'.format(self.rabbit1_uri, queue_name)
+        if not self.rebalance.session.put(
+                queue_url, data=json.dumps({
+                    'auto_delete': False, 'durable': True, 'arguments': {}})):
+            raise RuntimeError('Failed to create queue {}'.format(queue_name))
+        self._wait_for_queue_ready(queue_name, 'test-policy')
+        queue = self.rebalance.session.get(queue_url).json()
+        self.rebalance.args.targeted = True
+        self.rebalance._apply_step1_policy(queue, 'rabbit@rabbit2')
+        self._wait_for_queue_ready(
+            queue_name, self.rebalance._policy_name(queue_name))
+        queue = self.rebalance.session.get(queue_url).json()
+        policy = queue['effective_policy_definition']
+        self.assertEqual(policy['ha-mode'], 'nodes')
+        self.assertListEqual(
+            policy['ha-params'], ['rabbit@rabbit1', 'rabbit@rabbit2'])
+        self.assertEqual(policy['max-length'], 100)
+        self.assertNotIn('queue-master-locator', policy)
+        self.assertListEqual(
+            queue['synchronised_slave_nodes'], ['rabbit@rabbit2'])
+        self.rebalance.session.delete(queue_url)
+
     def test_apply_policy_2(self):
         queue_name = 'policy-queue'
         queue_url = '{}/api/queues/%2f/{}'.format(self.rabbit1_uri, queue_name)
@@ -185,7 +332,8 @@ class PolicyTestCase(TestCase):
         self._wait_for_queue_ready(queue_name, 'test-policy')
         queue = self.rebalance.session.get(queue_url).json()
         self.rebalance._apply_step2_policy(queue, 'rabbit@rabbit2')
-        self._wait_for_queue_ready(queue_name, self.rebalance.POLICY_NAME)
+        self._wait_for_queue_ready(
+            queue_name, self.rebalance._policy_name(queue_name))
         queue = self.rebalance.session.get(queue_url).json()
         policy = queue['effective_policy_definition']
         self.assertEqual(policy['ha-mode'], 'nodes')
@@ -248,6 +396,26 @@ class RebalanceTestCase(TestCase):
             'queue5': 'rabbit@rabbit1',
             'queue6': 'rabbit@rabbit2'})
 
+    def test_paginated_queues(self):
+        self.rebalance.args.page_size = 4
+        with mock.patch.object(
+                self.rebalance, '_queue_page',
+                wraps=self.rebalance._queue_page) as queue_page:
+            self.assertListEqual(
+                [q['name'] for q in self.rebalance._queues()], self.QUEUES)
+            self.assertListEqual(
+                [args[0] for args, _kw in queue_page.call_args_list], [1, 2])
+
+    def test_lean_queues(self):
+        self.rebalance.args.lean = True
+        columns = set(__main__.QUEUE_COLUMNS)
+        for queue in self.rebalance._queues():
+            self.assertLessEqual(set(queue.keys()), columns)
+            self.assertNotIn('message_stats', queue)
+        queue = self.rebalance._get_queue_info('queue1')
+        self.assertLessEqual(set(queue.keys()), columns)
+        self.assertEqual(queue['node'], 'rabbit@rabbit3')
+
     def test_queue_rebalance(self):
         # Make queue6 non-ha for branch coverage
         for offset in [1, 2, 3]:
@@ -290,3 +458,129 @@ class RebalanceTestCase(TestCase):
                 wraps=self.rebalance._apply_policy) as apply_policy:
             self.rebalance.run()
             apply_policy.assert_not_called()
+
+    def test_min_moves_balanced_cluster(self):
+        self.rebalance.args.strategy = 'min-moves'
+        with mock.patch.object(
+                self.rebalance, '_apply_policy',
+                wraps=self.rebalance._apply_policy) as apply_policy:
+            self.rebalance.run()
+            apply_policy.assert_not_called()
+
+    def test_min_moves_unbalanced_cluster(self):
+        for name in ['queue3', 'queue6']:
+            self.rebalance._move_queue(
+                self.rebalance._get_queue_info(name), 'rabbit@rabbit1')
+        self.rebalance.args.strategy = 'min-moves'
+        with mock.patch.object(
+                self.rebalance, '_move_queue',
+                wraps=self.rebalance._move_queue) as move_queue:
+            self.rebalance.run()
+            self.assertEqual(move_queue.call_count, 2)
+        nodes = {}
+        for queue in self.rebalance._queues():
+            nodes[queue['node']] = nodes.get(queue['node'], 0) + 1
+        self.assertDictEqual(nodes, {'rabbit@rabbit1': 2,
+                                     'rabbit@rabbit2': 2,
+                                     'rabbit@rabbit3': 2})
+
+    def test_targeted_queue_rebalance(self):
+        self.rebalance.args.targeted = True
+        self.rebalance.run()
+        self._compare_queues({
+            'queue1': 'rabbit@rabbit1',
+            'queue2': 'rabbit@rabbit2',
+            'queue3': 'rabbit@rabbit3',
+            'queue4': 'rabbit@rabbit1',
+            'queue5': 'rabbit@rabbit2',
+            'queue6': 'rabbit@rabbit3'})
+
+    def test_batched_queue_rebalance(self):
+        self.rebalance.args.batch_size = 3
+        with mock.patch.object(
+                self.rebalance, '_apply_batch_policy',
+                wraps=self.rebalance._apply_batch_policy) as apply_policy:
+            self.rebalance.run()
+            self.assertListEqual(
+                sorted(len(args[1]) for args, _kw in
+                       apply_policy.call_args_list
+                       if args[2]['ha-mode'] == 'nodes'),
+                [2, 2, 2])
+        self._compare_queues({
+            'queue1': 'rabbit@rabbit1',
+            'queue2': 'rabbit@rabbit2',
+            'queue3': 'rabbit@rabbit3',
+            'queue4': 'rabbit@rabbit1',
+            'queue5': 'rabbit@rabbit2',
+            'queue6': 'rabbit@rabbit3'})
+        policies = self.rebalance.session.get(
+            self.rebalance._build_url('/api/policies/{vhost}')).json()
+        self.assertFalse(
+            any(self.rebalance._is_own_policy(p) for p in policies))
+
+    def test_resumed_queue_rebalance(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'journal')
+            progress = journal.Journal(path)
+            progress.record_done({'vhost': '/', 'name': 'queue1'})
+            progress.record_phase(
+                {'vhost': '/', 'name': 'queue5'}, 'rabbit@rabbit2', 'move')
+            progress.close()
+            cli_args = __main__.parse_cli_arguments(
+                ['-u', 'guest', '-p', 'guest', '--journal', path,
+                 '--resume', self.rabbit1_uri])
+            rebalance = __main__.Rebalance(cli_args)
+            with mock.patch.object(
+                    rebalance, '_move_queue',
+                    wraps=rebalance._move_queue) as move_queue:
+                rebalance.run()
+                self.assertListEqual(
+                    [args[0]['name'] for args, _kw in
+                     move_queue.call_args_list],
+                    ['queue5', 'queue2', 'queue3', 'queue4', 'queue6'])
+            progress = journal.Journal(path, resume=True)
+            self.assertEqual(len(progress.completed), 6)
+            self.assertDictEqual(progress.in_flight, {})
+            progress.close()
+
+    def test_backpressure_pauses_moves(self):
+        self.rebalance.args.backpressure = True
+        self.rebalance.args.health_check_interval = 0.1
+        problems = [['rabbit@rabbit1 has a memory alarm']]
+        with mock.patch.object(
+                self.rebalance, '_health_problems',
+                side_effect=lambda: problems.pop() if problems else []) as \
+                health_problems:
+            self.rebalance.run()
+            self.assertGreaterEqual(health_problems.call_count, 2)
+        self.assertListEqual(self.rebalance._health_problems(), [])
+
+    def test_queue_rebalance_metrics(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.rebalance.args.metrics_file = os.path.join(
+                directory, 'metrics.json')
+            self.rebalance.run()
+            with open(self.rebalance.args.metrics_file) as handle:
+                summary = json.load(handle)
+        self.assertListEqual(
+            [queue['name'] for queue in summary['queues']],
+            ['queue1', 'queue2', 'queue3', 'queue4', 'queue5', 'queue6'])
+        self.assertTrue(all(queue['polls'] > 0
+                            for queue in summary['queues']))
+        self.assertIn('PUT /api/policies/*/*', summary['requests'])
+
+    def test_concurrent_queue_rebalance(self):
+        cli_args = __main__.parse_cli_arguments(
+            ['-u', 'guest', '-p', 'guest', '-c', '3', self.rabbit1_uri])
+        rebalance = __main__.Rebalance(cli_args)
+        rebalance.run()
+        self._compare_queues({
+            'queue1': 'rabbit@rabbit1',
+            'queue2': 'rabbit@rabbit2',
+            'queue3': 'rabbit@rabbit3',
+            'queue4': 'rabbit@rabbit1',
+            'queue5': 'rabbit@rabbit2',
+            'queue6': 'rabbit@rabbit3'})
+        policies = rebalance.session.get(
+            rebalance._build_url('/api/policies/{vhost}')).json()
+        self.assertFalse(any(rebalance._is_own_policy(p) for p in policies))
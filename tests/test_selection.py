@@ -0,0 +1,48 @@
+import re
+import unittest
+
+from rmq_cluster_rebalance import selection
+
+
+def queue(name, **kwargs):
+    return dict(kwargs, name=name, node='rabbit@rabbit1')
+
+
+class SelectionTestCase(unittest.TestCase):
+
+    def test_selects_all_by_default(self):
+        value = selection.Selection()
+        self.assertIsNone(value.reason(queue('q1', exclusive=True)))
+        self.assertIsNone(value.name_pattern)
+        self.assertFalse(value.needs_stats)
+
+    def test_include_exclude(self):
+        value = selection.Selection(
+            [re.compile('^orders'), re.compile('^invoices')],
+            [re.compile('-dlq$')])
+        self.assertIsNone(value.reason(queue('orders-1')))
+        self.assertEqual(value.reason(queue('users')), 'not included')
+        self.assertEqual(value.reason(queue('orders-dlq')),
+                         'excluded by -dlq$')
+        self.assertEqual(value.name_pattern, '(?:^orders)|(?:^invoices)')
+
+    def test_attributes(self):
+        value = selection.Selection(skip_exclusive=True,
+                                    skip_auto_delete=True,
+                                    skip_transient=True)
+        self.assertEqual(value.reason(queue('q', exclusive=True)),
+                         'exclusive')
+        self.assertEqual(value.reason(queue('q', auto_delete=True)),
+                         'auto-delete')
+        self.assertEqual(value.reason(queue('q', durable=False)),
+                         'transient')
+        self.assertIsNone(value.reason(queue('q', durable=True)))
+
+    def test_minimums(self):
+        value = selection.Selection(min_message_bytes=100, min_consumers=1)
+        self.assertTrue(value.needs_stats)
+        self.assertIsNotNone(value.reason(queue('q', message_bytes=10,
+                                                consumers=1)))
+        self.assertIsNotNone(value.reason(queue('q', message_bytes=100)))
+        self.assertIsNone(value.reason(queue('q', message_bytes=100,
+                                             consumers=2)))
@@ -0,0 +1,647 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tests import fake_api
+
+from rmq_cluster_rebalance import __main__, client
+
+POLL_ARGS = ['--min-poll-interval', '0.001', '--max-poll-interval', '0.01',
+             '--status-interval', '0.001']
+
+
+class SimulationTestCase(unittest.TestCase):
+    """Runs rebalances end to end against the fake management API"""
+
+    def setUp(self):
+        self.api = fake_api.FakeManagementAPI().start()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.api.stop()
+        self.directory.cleanup()
+
+    def add_queues(self, count, node=fake_api.NODES[0], vhost='/'):
+        for offset in range(count):
+            self.api.add_queue('queue-{:03d}'.format(offset), node, vhost,
+                               message_bytes=1024 * offset)
+
+    def assertBalanced(self, *vhosts):
+        placement = [node for vhost in vhosts or ['/']
+                     for node in self.api.placement(vhost).values()]
+        counts = [placement.count(node) for node in self.api.nodes]
+        self.assertLessEqual(max(counts) - min(counts), 1, counts)
+
+    def assertNoPolicies(self):
+        for vhost, policies in self.api.policies.items():
+            self.assertDictEqual(policies, {}, vhost)
+
+    def parse(self, *args, command='run', urls=None):
+        return __main__.parse_cli_arguments(
+            [command] + POLL_ARGS + list(args) + (urls or [self.api.url]))
+
+    def rebalance(self, *args, urls=None):
+        __main__.Rebalance(self.parse(*args, urls=urls)).run()
+
+    def rebalance_plan(self, path):
+        __main__.Rebalance(self.parse(
+            '--plan', path, command='apply')).run()
+
+    def test_round_robin(self):
+        self.add_queues(9)
+        self.rebalance()
+        self.assertListEqual(
+            list(self.api.placement().values()), self.api.nodes * 3)
+        self.assertNoPolicies()
+
+    def test_min_moves(self):
+        self.add_queues(9)
+        before = self.api.placement()
+        self.rebalance('--strategy', 'min-moves')
+        after = self.api.placement()
+        self.assertBalanced()
+        self.assertEqual(sum(before[n] != after[n] for n in before), 6)
+        self.assertNoPolicies()
+
+    def test_min_moves_balanced_cluster(self):
+        for offset, node in enumerate(self.api.nodes * 2):
+            self.api.add_queue('queue-{}'.format(offset), node)
+        self.rebalance('--strategy', 'min-moves')
+        self.assertEqual(self.api.request_count, 3)
+
+    def test_batched_targeted_concurrent(self):
+        self.add_queues(12)
+        self.rebalance('--strategy', 'min-moves', '--batch-size', '4',
+                       '--targeted', '--concurrency', '2')
+        self.assertBalanced()
+        self.assertNoPolicies()
+
+    def test_batch_records_sync_rate_once(self):
+        message_bytes = fake_api.SYNC_RATE // 5
+        for offset in range(6):
+            self.api.add_queue('queue-{}'.format(offset), fake_api.NODES[0],
+                               message_bytes=message_bytes)
+        with mock.patch.object(__main__.Rebalance, '_record_sync_rate',
+                               autospec=True) as record_sync_rate:
+            self.rebalance('--strategy', 'min-moves', '--batch-size', '2')
+        self.assertEqual(record_sync_rate.call_count, 2)
+        for call in record_sync_rate.call_args_list:
+            self.assertEqual(call[0][1], 2 * message_bytes)
+            self.assertGreaterEqual(call[0][2], 0.2)
+        self.assertBalanced()
+
+    def test_quorum_sync_budget_and_rate(self):
+        message_bytes = fake_api.SYNC_RATE // 5
+        self.add_queues(1)
+        self.api.add_queue('quorum', fake_api.NODES[0], queue_type='quorum',
+                           members=fake_api.NODES[:1],
+                           message_bytes=message_bytes)
+        with mock.patch.object(__main__.Rebalance, '_sync_budget',
+                               autospec=True,
+                               side_effect=__main__.Rebalance._sync_budget) \
+                as sync_budget, \
+                mock.patch.object(__main__.Rebalance, '_record_sync_rate',
+                                  autospec=True) as record_sync_rate:
+            self.rebalance('--max-sync-bytes', str(message_bytes))
+        sync_budget.assert_called_once_with(mock.ANY, message_bytes)
+        self.assertEqual(record_sync_rate.call_count, 1)
+        self.assertEqual(record_sync_rate.call_args[0][1], message_bytes)
+        self.assertGreater(record_sync_rate.call_args[0][2], 0)
+
+    def test_batch_splits_changed_queues(self):
+        for name in ['queue-a', 'queue-b']:
+            self.api.add_queue(name, fake_api.NODES[0])
+        self.api.add_policy('/', 'ha-a', '^queue-a$', {
+            'ha-mode': 'nodes', 'ha-params': fake_api.NODES[:2]}, 10)
+        rebalance = __main__.Rebalance(self.parse('--batch-size', '2'))
+        moves = [__main__.planner.Move(
+            {'vhost': '/', 'name': name, 'node': fake_api.NODES[0]},
+            fake_api.NODES[1]) for name in ['queue-a', 'queue-b']]
+        with mock.patch.object(
+                rebalance, '_move_queue',
+                wraps=rebalance._move_queue) as move_queue:
+            rebalance._move_batch(moves)
+        self.assertListEqual(
+            [call[0][0]['name'] for call in move_queue.call_args_list],
+            ['queue-b', 'queue-a'])
+        self.assertListEqual(list(self.api.placement().values()),
+                             [fake_api.NODES[1]] * 2)
+        self.assertListEqual(list(self.api.policies['/']), ['ha-a'])
+
+    def test_batch_and_queue_policy_names(self):
+        self.add_queues(6)
+        for name in ['rmq-cluster-rebalance-batch-7',
+                     'rmq-cluster-rebalance-queue-gone']:
+            self.api.add_policy('/', name, '^gone$', {'ha-mode': 'all'})
+        rebalance = __main__.Rebalance(self.parse(
+            '--strategy', 'min-moves', '--batch-size', '2'))
+        self.assertEqual(rebalance._policy_name('batch-1'),
+                         'rmq-cluster-rebalance-queue-batch-1')
+        with mock.patch.object(self.api, 'add_policy',
+                               wraps=self.api.add_policy) as add_policy:
+            rebalance.run()
+        self.assertIn('rmq-cluster-rebalance-batch-1',
+                      {call[0][1] for call in add_policy.call_args_list})
+        self.assertBalanced()
+        self.assertNoPolicies()
+
+    def test_lean_paginated(self):
+        self.add_queues(9)
+        self.rebalance('--lean', '--page-size', '2')
+        self.assertBalanced()
+        self.assertNotIn(('GET', '/api/queues/*/*'), self.api.requests)
+
+    def test_poll_columns(self):
+        self.add_queues(3)
+        with mock.patch.object(
+                __main__.Rebalance, '_queue_page', autospec=True,
+                side_effect=__main__.Rebalance._queue_page) as queue_page:
+            self.rebalance('--lean')
+        polls = [call[0][3] for call in queue_page.call_args_list
+                 if 'use_regex' in call[0][3]]
+        self.assertGreater(len(polls), 0)
+        for params in polls:
+            self.assertNotIn('message_stats', params['columns'].split(','))
+            self.assertIn('message_bytes', params['columns'].split(','))
+
+    def test_lean_with_weight(self):
+        self.add_queues(6)
+        before = self.api.placement()
+        self.rebalance('--lean', '--strategy', 'min-moves',
+                       '--weight', 'message_bytes')
+        after = self.api.placement()
+        self.assertGreater(sum(before[n] != after[n] for n in before), 0)
+        self.assertEqual(len(set(after.values())), 3)
+
+    def test_all_vhosts(self):
+        self.add_queues(6)
+        self.add_queues(6, vhost='test')
+        self.rebalance('--all-vhosts', '--strategy', 'min-moves')
+        self.assertBalanced('/', 'test')
+        self.assertNoPolicies()
+
+    def test_existing_policies_are_preserved(self):
+        self.api.add_policy('/', 'ha', '.*', {'ha-mode': 'exactly',
+                                              'ha-params': 2}, 10)
+        self.add_queues(6)
+        self.rebalance()
+        self.assertBalanced()
+        self.assertListEqual(list(self.api.policies['/']), ['ha'])
+
+    def test_resume(self):
+        self.add_queues(6)
+        path = os.path.join(self.directory.name, 'journal')
+        with open(path, 'w') as handle:
+            handle.write('{"e":"done","v":"/","q":"queue-000"}\n')
+        self.rebalance('--journal', path, '--resume')
+        self.assertEqual(self.api.placement()['queue-000'],
+                         fake_api.NODES[0])
+        self.assertEqual(self.api.requests['PUT', '/api/policies/*/*'], 8)
+
+    def test_metrics_file(self):
+        self.add_queues(3)
+        path = os.path.join(self.directory.name, 'metrics.json')
+        self.rebalance('--metrics-file', path)
+        with open(path) as handle:
+            metrics = json.load(handle)
+        self.assertEqual(len(metrics['queues']), 2)
+        self.assertIn('GET /api/queues/*', metrics['requests'])
+
+    def test_discover_endpoints(self):
+        self.api.add_endpoint()
+        self.add_queues(9)
+        self.rebalance('--discover')
+        self.assertBalanced()
+        for url, count in self.api.endpoint_requests.items():
+            self.assertGreater(count, 0, url)
+
+    @mock.patch.object(client, 'RETRY_DELAY', 0)
+    def test_endpoint_failover(self):
+        urls = [self.api.url, self.api.add_endpoint()]
+        self.add_queues(9)
+        self.api.stop_endpoint(self.api.url)
+        self.rebalance(urls=urls)
+        self.assertBalanced()
+        self.assertNoPolicies()
+
+    def test_quorum_queues(self):
+        for offset in range(6):
+            self.api.add_queue(
+                'quorum-{}'.format(offset), fake_api.NODES[0],
+                queue_type='quorum', members=fake_api.NODES)
+        self.rebalance('--strategy', 'min-moves', '--batch-size', '5')
+        self.assertBalanced()
+        for name in self.api.vhosts['/']:
+            self.assertListEqual(
+                self.api.queue('/', name)['members'], fake_api.NODES)
+        self.assertNoPolicies()
+        self.assertNotIn(('PUT', '/api/policies/*/*'), self.api.requests)
+
+    def test_quorum_queue_replaces_leader_replica(self):
+        self.add_queues(2)
+        self.api.add_queue('quorum', fake_api.NODES[0], queue_type='quorum',
+                           members=fake_api.NODES[:2])
+        self.rebalance()
+        queue = self.api.queue('/', 'quorum')
+        self.assertEqual(queue['leader'], fake_api.NODES[2])
+        self.assertListEqual(queue['members'], fake_api.NODES[1:])
+
+    def test_quorum_leader_not_elected(self):
+        self.add_queues(2)
+        self.api.add_queue('quorum', fake_api.NODES[0], queue_type='quorum',
+                           members=fake_api.NODES)
+        path = os.path.join(self.directory.name, 'journal')
+        with mock.patch.object(
+                self.api.random, 'choice',
+                lambda nodes: [n for n in nodes if n != fake_api.NODES[2]][0]):
+            self.rebalance('--journal', path)
+        queue = self.api.queue('/', 'quorum')
+        self.assertNotEqual(queue['leader'], fake_api.NODES[2])
+        self.assertListEqual(queue['members'], fake_api.NODES)
+        with open(path) as handle:
+            lines = handle.readlines()
+        self.assertIn('{"e":"failed","v":"/","q":"quorum","p":"move"}\n',
+                      lines)
+        self.assertNotIn('{"e":"done","v":"/","q":"quorum"}\n', lines)
+
+    def test_mixed_queue_types(self):
+        self.add_queues(3)
+        for offset in range(3):
+            self.api.add_queue(
+                'quorum-{}'.format(offset), fake_api.NODES[0],
+                queue_type='quorum', members=fake_api.NODES)
+        self.rebalance('--strategy', 'min-moves', '--lean')
+        self.assertBalanced()
+        self.assertNoPolicies()
+
+    def test_max_duration_moves_cheapest_first(self):
+        for offset in range(6):
+            self.api.add_queue('queue-{}'.format(offset), fake_api.NODES[0],
+                               message_bytes=1024 * (6 - offset))
+        path = os.path.join(self.directory.name, 'metrics.json')
+        self.rebalance('--max-duration', '3600', '--metrics-file', path)
+        with open(path) as handle:
+            moved = [queue['name'] for queue in json.load(handle)['queues']]
+        self.assertListEqual(
+            moved, ['queue-5', 'queue-4', 'queue-2', 'queue-1'])
+
+    @mock.patch.object(__main__, 'MOVE_SECONDS', 0.5)
+    def test_max_duration_skips_moves(self):
+        self.add_queues(4)
+        self.api.add_queue('queue-big', fake_api.NODES[0],
+                           message_bytes=10 * 1024 ** 3)
+        self.rebalance('--max-duration', '60')
+        self.assertListEqual(list(self.api.placement().values()),
+                             [fake_api.NODES[0], fake_api.NODES[1],
+                              fake_api.NODES[2], fake_api.NODES[0],
+                              fake_api.NODES[0]])
+
+    def test_backpressure_gives_up_at_deadline(self):
+        self.add_queues(3)
+        self.api.node_stats[fake_api.NODES[1]]['mem_alarm'] = True
+        started = time.monotonic()
+        self.rebalance('--backpressure', '--health-check-interval', '0.05',
+                       '--max-duration', '0.3')
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertNotIn(('PUT', '/api/policies/*/*'), self.api.requests)
+
+    def test_backpressure_ignores_stopped_nodes(self):
+        self.add_queues(4)
+        self.api.node_stats[fake_api.NODES[2]]['running'] = False
+        self.rebalance('--backpressure', '--health-check-interval', '0.05')
+        counts = [list(self.api.placement().values()).count(node)
+                  for node in fake_api.NODES]
+        self.assertListEqual(counts, [2, 2, 0])
+
+    @mock.patch.object(__main__, 'MOVE_SECONDS', 0.01)
+    def test_watch(self):
+        self.add_queues(9)
+        timer = threading.Timer(0.3, self.add_queues, (6,), {'vhost': 'test'})
+        timer.start()
+        self.rebalance('--watch', '--watch-interval', '0.05',
+                       '--max-duration', '1', '--all-vhosts')
+        timer.join()
+        self.assertBalanced('/', 'test')
+        self.assertNoPolicies()
+
+    @mock.patch.object(__main__, 'MOVE_SECONDS', 0.01)
+    def test_watch_within_max_skew(self):
+        for offset, node in enumerate(fake_api.NODES * 3 + fake_api.NODES[:1]):
+            self.api.add_queue('queue-{}'.format(offset), node)
+        self.api.add_queue('queue-extra', fake_api.NODES[0])
+        self.rebalance('--watch', '--watch-interval', '0.05',
+                       '--max-duration', '0.3', '--max-skew', '0.6')
+        self.assertNotIn(('PUT', '/api/policies/*/*'), self.api.requests)
+
+    @mock.patch.object(__main__, 'MOVE_SECONDS', 0.01)
+    def test_watch_with_strategy(self):
+        self.add_queues(6)
+        self.api.node_stats[fake_api.NODES[2]]['running'] = False
+        with mock.patch.object(
+                __main__.Rebalance, '_queue_page', autospec=True,
+                side_effect=__main__.Rebalance._queue_page) as queue_page, \
+                mock.patch.object(__main__.planner, 'mirrored',
+                                  wraps=__main__.planner.mirrored) as mirrored:
+            self.rebalance('--watch', '--watch-interval', '0.05',
+                           '--max-duration', '0.3', '--strategy', 'mirrors')
+        mirrored.assert_called()
+        self.assertListEqual(mirrored.call_args[0][1], fake_api.NODES[:2])
+        for call in queue_page.call_args_list:
+            self.assertIn('columns', call[0][3])
+        counts = [list(self.api.placement().values()).count(node)
+                  for node in fake_api.NODES]
+        self.assertListEqual(counts, [3, 3, 0])
+
+    @mock.patch.object(__main__, 'MOVE_SECONDS', 0.01)
+    def test_watch_refresh_columns(self):
+        self.add_queues(6)
+        with mock.patch.object(
+                __main__.Rebalance, '_queue_page', autospec=True,
+                side_effect=__main__.Rebalance._queue_page) as queue_page:
+            self.rebalance('--watch', '--watch-interval', '0.05',
+                           '--max-duration', '0.3', '--batch-size', '1')
+        refreshes = [call[0][3] for call in queue_page.call_args_list
+                     if 'use_regex' not in call[0][3]]
+        self.assertGreater(len(refreshes), 0)
+        for params in refreshes:
+            self.assertDictEqual(params, {
+                'columns': 'name,vhost,node,type,message_bytes,'
+                           'synchronised_slave_nodes,members'})
+        self.assertBalanced()
+
+    def test_watch_refresh_disables_stats(self):
+        args = self.parse('--watch', '--batch-size', '1')
+        params = __main__.Rebalance(args)._refresh_params()
+        self.assertDictEqual(params, {'columns': 'name,vhost,node,type',
+                                      'disable_stats': 'true'})
+
+    def test_watch_refresh_weight_columns(self):
+        args = self.parse('--watch', '--weight', 'publish_rate',
+                          '--batch-size', '1', '--min-consumers', '1')
+        params = __main__.Rebalance(args)._refresh_params()
+        self.assertDictEqual(params, {
+            'columns': 'name,vhost,node,type,message_stats,consumers'})
+
+    def test_snapshot_plan_apply(self):
+        self.add_queues(9)
+        self.api.add_policy('/', 'ha', '.*', {'ha-mode': 'all'}, 10)
+        snapshot_path = os.path.join(self.directory.name, 'cluster.snapshot')
+        plan_path = os.path.join(self.directory.name, 'moves.plan')
+        args = self.parse('--output', snapshot_path, command='snapshot')
+        __main__.Rebalance(args).snapshot(args.output)
+        self.assertListEqual(list(self.api.policies['/']), ['ha'])
+        requests = self.api.request_count
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            __main__.plan_snapshot(self.parse(
+                '--snapshot', snapshot_path, '--output', plan_path,
+                '--strategy', 'min-moves', command='plan'))
+        self.assertEqual(self.api.request_count, requests)
+        self.assertIn('9 queues, 6 moves', stdout.getvalue())
+        self.rebalance_plan(plan_path)
+        self.assertBalanced()
+        self.assertListEqual(list(self.api.policies['/']), ['ha'])
+
+    def test_apply_skips_missing_and_placed_queues(self):
+        self.add_queues(3)
+        plan_path = os.path.join(self.directory.name, 'moves.plan')
+        with open(plan_path, 'w') as handle:
+            handle.write('{"format":"rmq-cluster-rebalance-plan"}\n'
+                         '["/","queue-000","rabbit@rabbit2"]\n'
+                         '["/","queue-001","rabbit@rabbit1"]\n'
+                         '["/","missing","rabbit@rabbit2"]\n'
+                         '["test","queue-002","rabbit@rabbit3"]\n')
+        self.rebalance_plan(plan_path)
+        self.assertListEqual(
+            list(self.api.placement().values()),
+            [fake_api.NODES[1], fake_api.NODES[0], fake_api.NODES[0]])
+        self.assertNotIn(('GET', '/api/queues/*/*'), self.api.requests)
+
+    def test_selection(self):
+        self.add_queues(6)
+        self.api.add_queue('amq.gen-reply', fake_api.NODES[0],
+                           exclusive=True, auto_delete=True, durable=False)
+        self.api.add_queue('queue-skip', fake_api.NODES[0])
+        self.rebalance('--include', '^queue-', '--include', 'reply$',
+                       '--exclude', 'skip', '--skip-exclusive', '--lean')
+        placement = self.api.placement()
+        self.assertEqual(placement.pop('amq.gen-reply'), fake_api.NODES[0])
+        self.assertEqual(placement.pop('queue-skip'), fake_api.NODES[0])
+        self.assertListEqual(list(placement.values()), self.api.nodes * 2)
+        self.assertNoPolicies()
+
+    def test_locality(self):
+        nodes = self.api.nodes
+        for offset in range(4):
+            self.api.add_queue('queue-{}'.format(offset), nodes[0],
+                               consumer_nodes=[nodes[offset % 2 + 1]] * 2)
+        self.api.add_queue('queue-idle', nodes[2])
+        self.api.add_queue('queue-mixed', nodes[0],
+                           consumer_nodes=[nodes[0], nodes[2], nodes[2]])
+        self.rebalance('--strategy', 'locality', '--max-skew', '0.5')
+        self.assertDictEqual(self.api.placement(), {
+            'queue-0': nodes[1], 'queue-1': nodes[2],
+            'queue-2': nodes[1], 'queue-3': nodes[2],
+            'queue-idle': nodes[0], 'queue-mixed': nodes[2]})
+        self.assertNoPolicies()
+
+    def test_locality_from_connections(self):
+        self.api.channel_nodes = False
+        self.api.add_queue('queue-0', fake_api.NODES[0],
+                           consumer_nodes=[fake_api.NODES[1]])
+        self.api.add_queue('queue-1', fake_api.NODES[1],
+                           consumer_nodes=[fake_api.NODES[2]])
+        self.rebalance('--strategy', 'locality')
+        self.assertDictEqual(self.api.placement(), {
+            'queue-0': fake_api.NODES[1], 'queue-1': fake_api.NODES[2]})
+        self.assertEqual(
+            self.api.requests['GET', '/api/connections'], 1)
+
+    def test_fleet(self):
+        other = fake_api.FakeManagementAPI().start()
+        self.addCleanup(other.stop)
+        self.add_queues(6)
+        for offset in range(3):
+            other.add_queue('queue-{}'.format(offset), other.nodes[1])
+        config_path = os.path.join(self.directory.name, 'fleet.json')
+        metrics_path = os.path.join(self.directory.name, 'metrics.json')
+        with open(config_path, 'w') as handle:
+            json.dump({'defaults': dict(
+                           zip(['min_poll_interval', 'max_poll_interval',
+                                'status_interval'], POLL_ARGS[1::2])),
+                       'clusters': {
+                           'one': {'urls': [self.api.url],
+                                   'concurrency': 2},
+                           'two': {'urls': other.url,
+                                   'strategy': 'min-moves'}}}, handle)
+        __main__.run_fleet(self.parse(
+            '--config', config_path, '--metrics-file', metrics_path,
+            command='fleet'))
+        self.assertBalanced()
+        self.assertListEqual(sorted(other.placement().values()), other.nodes)
+        with open(metrics_path) as handle:
+            summary = json.load(handle)
+        self.assertEqual(summary['moved'], 6)
+        self.assertDictEqual(
+            {name: value['moved']
+             for name, value in summary['clusters'].items()},
+            {'one': 4, 'two': 2})
+
+    def test_fleet_cluster_failure(self):
+        config_path = os.path.join(self.directory.name, 'fleet.json')
+        with open(config_path, 'w') as handle:
+            json.dump({'clusters': {
+                'one': {'urls': [self.api.url]},
+                'down': {'urls': ['http://127.0.0.1:1']}}}, handle)
+        with self.assertRaises(SystemExit) as context:
+            __main__.run_fleet(self.parse(
+                '--config', config_path, command='fleet'))
+        self.assertEqual(context.exception.code, 14)
+
+    def test_lazy_above(self):
+        self.add_queues(3)
+        self.api.add_policy(
+            '/', 'ha', '.*', {'ha-mode': 'exactly', 'ha-params': 2})
+        with mock.patch.object(self.api, 'add_policy',
+                               wraps=self.api.add_policy) as add_policy:
+            self.rebalance('--lazy-above', '1024', '--lean')
+        lazy = {call[0][1]: call[0][3].get('queue-mode')
+                for call in add_policy.call_args_list}
+        self.assertDictEqual(lazy, {
+            'rmq-cluster-rebalance-queue-queue-001': None,
+            'rmq-cluster-rebalance-queue-queue-002': 'lazy'})
+        self.assertListEqual(
+            list(self.api.placement().values()), self.api.nodes)
+        self.assertListEqual(list(self.api.policies['/']), ['ha'])
+
+    def test_mirrors(self):
+        self.add_queues(6)
+        self.api.add_policy(
+            '/', 'ha', '.*', {'ha-mode': 'exactly', 'ha-params': 2})
+        with mock.patch.object(self.api, 'add_policy',
+                               wraps=self.api.add_policy) as add_policy:
+            self.rebalance('--strategy', 'mirrors')
+        placement = list(self.api.placement().values())
+        self.assertListEqual(
+            [placement.count(node) for node in self.api.nodes], [2, 2, 2])
+        self.assertEqual(
+            [call[0][3]['ha-mode']
+             for call in add_policy.call_args_list].count('all'), 2)
+        self.assertListEqual(list(self.api.policies['/']), ['ha'])
+
+    def test_queue_deleted_while_moving(self):
+        self.add_queues(2)
+        self.api.add_queue('queue-big', fake_api.NODES[0],
+                           message_bytes=fake_api.SYNC_RATE)
+        timer = threading.Timer(0.3, self.api.delete_queue, ('/', 'queue-big'))
+        timer.start()
+        path = os.path.join(self.directory.name, 'metrics.json')
+        self.rebalance('--metrics-file', path)
+        timer.join()
+        with open(path) as handle:
+            metrics = json.load(handle)
+        self.assertListEqual([queue['name'] for queue in metrics['queues']],
+                             ['queue-001'])
+        self.assertNoPolicies()
+
+    def test_queue_deleted_while_moving_batch(self):
+        for offset in range(6):
+            self.api.add_queue('queue-{}'.format(offset), fake_api.NODES[0],
+                               message_bytes=fake_api.SYNC_RATE // 2)
+        timer = threading.Timer(0.2, self.api.delete_queue, ('/', 'queue-3'))
+        timer.start()
+        path = os.path.join(self.directory.name, 'metrics.json')
+        self.rebalance('--strategy', 'min-moves', '--batch-size', '2',
+                       '--concurrency', '2', '--metrics-file', path)
+        timer.join()
+        with open(path) as handle:
+            metrics = json.load(handle)
+        self.assertListEqual(
+            sorted(queue['name'] for queue in metrics['queues']),
+            ['queue-0', 'queue-4', 'queue-5'])
+        self.assertNoPolicies()
+
+    def test_sync_timeout_rolls_back(self):
+        self.add_queues(2)
+        self.api.add_queue('queue-big', fake_api.NODES[0],
+                           message_bytes=100 * fake_api.SYNC_RATE)
+        path = os.path.join(self.directory.name, 'metrics.json')
+        self.rebalance('--sync-timeout', '0.2', '--metrics-file', path)
+        self.assertListEqual(list(self.api.placement().values()),
+                             fake_api.NODES[:2] + fake_api.NODES[:1])
+        self.assertListEqual(self.api.queue('/', 'queue-big')['slave_nodes'],
+                             [])
+        with open(path) as handle:
+            failures = json.load(handle)['failures']
+        self.assertListEqual([(f['name'], f['phase']) for f in failures],
+                             [('queue-big', 'sync')])
+        self.assertNoPolicies()
+
+    @mock.patch.object(__main__, 'MIN_SYNC_TIMEOUT', 0.2)
+    @mock.patch.object(__main__, 'DEFAULT_SYNC_RATE', 1024 ** 4)
+    def test_default_sync_timeout_rolls_back(self):
+        self.api.add_queue('queue-0', fake_api.NODES[1])
+        self.api.add_queue('queue-big', fake_api.NODES[0],
+                           message_bytes=100 * fake_api.SYNC_RATE)
+        path = os.path.join(self.directory.name, 'metrics.json')
+        self.rebalance('--metrics-file', path)
+        with open(path) as handle:
+            failures = json.load(handle)['failures']
+        self.assertListEqual([(f['name'], f['phase']) for f in failures],
+                             [('queue-big', 'sync')])
+        self.assertNoPolicies()
+
+    def test_sync_timeout_default(self):
+        rebalance = __main__.Rebalance(self.parse())
+        now = time.monotonic()
+        self.assertGreaterEqual(rebalance._phase_deadline('sync'),
+                                now + __main__.MIN_SYNC_TIMEOUT)
+        deadline = rebalance._phase_deadline(
+            'sync', 100 * __main__.DEFAULT_SYNC_RATE)
+        self.assertGreaterEqual(
+            deadline, now + 100 * __main__.SYNC_TIMEOUT_FACTOR)
+        rebalance = __main__.Rebalance(self.parse('--sync-timeout', '0'))
+        self.assertIsNone(rebalance._phase_deadline('sync', 1024 ** 4))
+
+    def test_sync_timeout_in_batch(self):
+        for offset in range(6):
+            self.api.add_queue(
+                'queue-{}'.format(offset), fake_api.NODES[0],
+                message_bytes=100 * fake_api.SYNC_RATE if offset == 3 else 0)
+        path = os.path.join(self.directory.name, 'metrics.json')
+        self.rebalance('--strategy', 'min-moves', '--batch-size', '2',
+                       '--sync-timeout', '0.2', '--metrics-file', path)
+        placement = self.api.placement()
+        self.assertEqual(placement['queue-3'], fake_api.NODES[0])
+        self.assertEqual(placement['queue-5'], fake_api.NODES[1])
+        with open(path) as handle:
+            metrics = json.load(handle)
+        self.assertEqual(len(metrics['queues']), 3)
+        self.assertEqual(metrics['failures'][0]['name'], 'queue-3')
+        self.assertNoPolicies()
+
+    def test_move_timeout_rolls_back(self):
+        self.add_queues(2)
+        self.api.add_queue('queue-stuck', fake_api.NODES[0], pinned=True)
+        path = os.path.join(self.directory.name, 'journal')
+        self.rebalance('--move-timeout', '0.2', '--journal', path)
+        self.assertEqual(self.api.placement()['queue-stuck'],
+                         fake_api.NODES[0])
+        with open(path) as handle:
+            self.assertIn('{"e":"failed","v":"/","q":"queue-stuck",'
+                          '"p":"move"}\n', handle.readlines())
+        self.assertNoPolicies()
+
+    def test_quorum_sync_timeout_rolls_back(self):
+        self.add_queues(1)
+        self.api.add_queue('quorum', fake_api.NODES[0], queue_type='quorum',
+                           members=fake_api.NODES[:1],
+                           message_bytes=100 * fake_api.SYNC_RATE)
+        self.rebalance('--sync-timeout', '0.2')
+        queue = self.api.queue('/', 'quorum')
+        self.assertEqual(queue['leader'], fake_api.NODES[0])
+        self.assertListEqual(queue['members'], fake_api.NODES[:1])
@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+import unittest
+
+from rmq_cluster_rebalance import planner, snapshot
+
+NODES = ['rabbit@rabbit1', 'rabbit@rabbit2', 'rabbit@rabbit3']
+
+
+def queue(name, node, **kwargs):
+    return dict(kwargs, vhost='/', name=name, node=node)
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cluster.snapshot')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_compact_expand(self):
+        value = queue('q1', NODES[0], type='classic', message_bytes=10,
+                      memory=20, synchronised_slave_nodes=[NODES[1]],
+                      message_stats={'publish_details': {'rate': 1.5}})
+        expanded = snapshot.expand(snapshot.compact(value))
+        self.assertEqual(expanded['node'], NODES[0])
+        self.assertTupleEqual(
+            expanded['synchronised_slave_nodes'], (NODES[1],))
+        self.assertEqual(expanded['message_bytes'], 10)
+        self.assertEqual(
+            planner.WEIGHTS['publish_rate'](expanded), 1.5)
+        self.assertNotIn('members', expanded)
+
+    def test_write_read(self):
+        queues = [queue('q{}'.format(i), NODES[i % 3]) for i in range(5)]
+        queues.append(queue('quorum', NODES[0], type='quorum',
+                            members=NODES))
+        policies = [{'vhost': '/', 'name': 'ha', 'priority': 10}]
+        count = snapshot.write(self.path, NODES, ['/'], policies,
+                               iter(queues))
+        self.assertEqual(count, 6)
+        state = snapshot.read(self.path)
+        self.assertListEqual(state.nodes, NODES)
+        self.assertListEqual(state.vhosts, ['/'])
+        self.assertListEqual(state.policies, policies)
+        self.assertListEqual([q['name'] for q in state.queues],
+                             [q['name'] for q in queues])
+        self.assertTupleEqual(state.queues[-1]['members'], tuple(NODES))
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_failed_write_keeps_file(self):
+        snapshot.write(self.path, NODES, ['/'], [], [])
+
+        def queues():
+            yield queue('q1', NODES[0])
+            raise RuntimeError('Interrupted')
+
+        with self.assertRaises(RuntimeError):
+            snapshot.write(self.path, NODES, ['/'], [], queues())
+        self.assertListEqual(snapshot.read(self.path).queues, [])
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_plan_round_trip(self):
+        moves = [planner.Move(queue('q1', NODES[0]), NODES[1]),
+                 planner.Move(queue('q2', NODES[0]), NODES[2])]
+        snapshot.write_plan(self.path, moves, strategy='min-moves')
+        with open(self.path) as handle:
+            self.assertEqual(json.loads(handle.readline())['strategy'],
+                             'min-moves')
+        self.assertListEqual(snapshot.read_plan(self.path),
+                             [['/', 'q1', NODES[1]], ['/', 'q2', NODES[2]]])
+
+    def test_read_plan_from_snapshot(self):
+        snapshot.write(self.path, NODES, ['/'], [], [])
+        with self.assertRaises(ValueError):
+            snapshot.read_plan(self.path)
+
+    def test_report(self):
+        queues = [queue('q{}'.format(i), NODES[0], message_bytes=100)
+                  for i in range(3)]
+        moves = [planner.Move(queues[1], NODES[1]),
+                 planner.Move(queues[2], NODES[2])]
+        lines = snapshot.report(
+            queues, NODES, moves, lambda queue, node: True).splitlines()
+        self.assertEqual(lines[0], '3 queues, 2 moves, 200 bytes to '
+                                   'synchronize')
+        self.assertListEqual(lines[3].split(), [NODES[0], '3', '1', '300',
+                                                '100'])
+        self.assertListEqual(lines[4].split(), [NODES[1], '0', '1', '0',
+                                                '100'])